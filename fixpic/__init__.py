@@ -0,0 +1 @@
+"""FixPic 后端公共图像处理库（server.py 与 Modal 应用共用）"""
@@ -0,0 +1,127 @@
+"""
+动态批处理：把并发请求合并成一次批量 forward
+
+容器开启并发输入后，多个请求各自跑 batch=1 的 forward，GPU 在两次 kernel 之间大多空闲。
+每个模型一个 DynamicBatcher：
+- 请求提交输入后阻塞等待结果；后台线程收集 BATCH_MAX_WAIT_MS 毫秒内到达的输入
+  （最多 BATCH_MAX_SIZE 个），一次 run_batch 后按顺序把结果分发回各请求
+- 输入按 key 分桶（如张量形状 / 分辨率），只有同一桶内的输入才合并
+- 一个请求可以一次提交多个输入（如大图的各个 tile），与其他请求的输入合并推理
+- stats() 提供批大小直方图和平均等待时间
+
+- BATCH_MAX_SIZE：单批最多输入数，默认 8；1 表示不合并
+- BATCH_MAX_WAIT_MS：第一个输入到达后最多等待的毫秒数，默认 5
+"""
+
+import os
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import Future
+
+MAX_BATCH = int(os.environ.get("BATCH_MAX_SIZE", "8"))
+MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "5"))
+
+
+class DynamicBatcher:
+    """单个模型的动态批处理器（线程安全）"""
+
+    def __init__(self, name, run_batch, max_batch=None, max_wait_ms=None):
+        """run_batch(inputs) 对同一桶内的一批输入推理，按顺序返回等长的结果列表"""
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch = max(1, MAX_BATCH if max_batch is None else max_batch)
+        self.max_wait = (MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000
+        self._cond = threading.Condition()
+        self._pending = OrderedDict()  # key -> deque[(input, future, 到达时间)]
+        self._thread = None
+
+        self._histogram = Counter()
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._wait_total = 0.0
+        self._run_total = 0.0
+
+    def submit(self, item, key=None):
+        """提交单个输入，阻塞到结果返回（run_batch 的异常在此重新抛出）"""
+        return self.submit_many([item], key)[0]
+
+    def submit_many(self, items, key=None):
+        """提交同一桶内的多个输入，按顺序返回结果"""
+        if not items:
+            return []
+
+        now = time.perf_counter()
+        futures = []
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name=f"batcher-{self.name}", daemon=True)
+                self._thread.start()
+            queue = self._pending.setdefault(key, deque())
+            for item in items:
+                future = Future()
+                queue.append((item, future, now))
+                futures.append(future)
+            self._cond.notify()
+        return [future.result() for future in futures]
+
+    def _next_batch(self):
+        """取最早到达的桶，等到凑满一批或超过等待时间"""
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+
+            key = min(self._pending, key=lambda k: self._pending[k][0][2])
+            queue = self._pending[key]
+            deadline = queue[0][2] + self.max_wait
+            while len(queue) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+
+            batch = [queue.popleft() for _ in range(min(self.max_batch, len(queue)))]
+            if not queue:
+                del self._pending[key]
+            return batch
+
+    def _loop(self):
+        while True:
+            batch = self._next_batch()
+            start = time.perf_counter()
+            try:
+                results = self.run_batch([item for item, _, _ in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"{self.name}: run_batch returned {len(results)} results for {len(batch)} inputs")
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                failed = True
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+                failed = False
+
+            with self._cond:
+                self._histogram[len(batch)] += 1
+                self._batches += 1
+                self._items += len(batch)
+                self._errors += int(failed)
+                self._wait_total += sum(start - arrived for _, _, arrived in batch)
+                self._run_total += time.perf_counter() - start
+
+    def stats(self):
+        with self._cond:
+            return {
+                'max_batch': self.max_batch,
+                'max_wait_ms': self.max_wait * 1000,
+                'batches': self._batches,
+                'items': self._items,
+                'errors': self._errors,
+                'pending': sum(len(q) for q in self._pending.values()),
+                'mean_batch_size': round(self._items / self._batches, 2) if self._batches else None,
+                'mean_wait_ms': round(self._wait_total / self._items * 1000, 2) if self._items else None,
+                'mean_run_ms': round(self._run_total / self._batches * 1000, 2) if self._batches else None,
+                'histogram': {str(size): count for size, count in sorted(self._histogram.items())},
+            }
@@ -0,0 +1,239 @@
+"""
+水印检测级联
+
+1. 快速门控（十几毫秒）：底部信息条统计、已知模板匹配、极低分辨率下的文字可能性
+   （横排 / 竖排，以及旋转 ±30° / ±45° / ±60° 后的斜向文字）
+   - 模板置信命中：模板 mask 作为级联的起点，候选区域已被覆盖时不再跑检测器
+   - 门控只决定能否跳过昂贵的检测器（OCR / YOLO / Florence），
+     盲水印模型和便宜的检测器（横条、平铺模式）总是运行：门控是启发式的，漏判不能让整张图被跳过
+2. 检测器按开销从低到高依次运行，每一步合并 mask 后检查是否可以提前结束：
+   - 门控找到的候选区域（横条 + 疑似文字块）已被 mask 覆盖 → 检测完整
+   - 便宜的检测器全部跑完仍没有结果、且文字信号很弱 → 判定为空，不再跑昂贵的检测器
+     （文字信号弱时便宜的检测器排在前面，平铺模式检测不区分方向，斜向平铺水印由它兜底）
+   - 覆盖率超过上限 → 之后一定会放弃修复，没必要继续
+"""
+
+import os
+import time
+
+import cv2
+import numpy as np
+
+from fixpic.edge_bands import EdgeBandAnalyzer, band_mask
+from fixpic.image_context import ImageContext
+
+# 门控用的极低分辨率
+GATE_SIDE = 256
+# 疑似文字块面积占比低于该值视为没有文字信号
+TEXT_MIN_RATIO = float(os.environ.get("CASCADE_TEXT_MIN_RATIO", "0.002"))
+# 候选区域被 mask 覆盖的比例达到该值视为检测完整
+COMPLETE_RATIO = 0.9
+# 覆盖率上限（%），与修复前的安全检查一致
+MAX_COVERAGE = 25
+# 斜向文字：把二值图旋转这些角度后再找横排 / 竖排文字（θ 覆盖 -θ 与 90°-θ 方向）
+TEXT_ANGLES = (30, 45, 60)
+# 开销低于该值的检测器视为便宜，文字信号弱时也总是运行
+EXPENSIVE_COST = 1
+
+
+def _line_components(binary, vertical, limit):
+    """闭运算把字符连成词后，保留粗细适中、沿该方向伸展的连通域"""
+    kernel = (7, 1) if vertical else (1, 7)
+    joined = cv2.morphologyEx(binary, cv2.MORPH_CLOSE, np.ones(kernel, np.uint8))
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(joined, connectivity=8)
+    bw, bh = stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT]
+    if vertical:
+        bw, bh = bh, bw
+    area = stats[:, cv2.CC_STAT_AREA]
+    fill = area / np.maximum(bw * bh, 1)
+    keep = (bw >= 2 * bh) & (bh >= 3) & (bh <= limit) & (fill > 0.3) & (fill < 0.95)
+    keep[0] = False
+    return keep[labels].astype(np.uint8) * 255
+
+
+def _rotation(shape, angle):
+    """绕中心旋转 angle 度、画布扩大到容纳整图的仿射矩阵与新尺寸"""
+    h, w = shape
+    m = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+    cos, sin = abs(m[0, 0]), abs(m[0, 1])
+    size = int(h * sin + w * cos) + 1, int(h * cos + w * sin) + 1
+    m[0, 2] += size[0] / 2 - w / 2
+    m[1, 2] += size[1] / 2 - h / 2
+    return m, size
+
+
+def text_candidates(image, side=GATE_SIDE, angles=TEXT_ANGLES):
+    """极低分辨率下的疑似文字块（mask 与原图同比例缩小），返回 (mask, ratio)
+
+    形态学梯度 + Otsu 二值化后分别做水平 / 竖直闭运算，把字符连成词；
+    二值图再按 angles 旋转后重复一遍，结果转回原方向，覆盖斜向文字。
+    """
+    ctx = ImageContext.of(image)
+    small = ctx.downscaled(side)
+    gray = small.gray
+    h, w = gray.shape
+
+    grad = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, np.ones((3, 3), np.uint8))
+    _, binary = cv2.threshold(grad, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+
+    mask = np.zeros_like(gray)
+    for angle in (0,) + tuple(angles):
+        if angle:
+            m, size = _rotation((h, w), angle)
+            rotated = cv2.warpAffine(binary, m, size, flags=cv2.INTER_NEAREST)
+        else:
+            rotated = binary
+        found = _line_components(rotated, False, h * 0.15) | _line_components(rotated, True, w * 0.15)
+        if angle:
+            found = cv2.warpAffine(found, m, (w, h), flags=cv2.INTER_NEAREST | cv2.WARP_INVERSE_MAP)
+        mask |= found
+
+    return mask, float(np.count_nonzero(mask)) / mask.size
+
+
+class CascadeGate:
+    """快速门控结果"""
+
+    def __init__(self, ctx, template_library=None):
+        start = time.time()
+        self.ctx = ImageContext.of(ctx)
+        w, h = self.ctx.size
+
+        # 底部信息条（在门控分辨率上统计，要求与上方画面有明显差异）
+        small = self.ctx.downscaled(GATE_SIDE)
+        self.bands = {'bottom': EdgeBandAnalyzer(small).distinct_bottom_bar()}
+        self.band_mask = band_mask(small.size, self.bands)
+
+        self.text_mask, self.text_ratio = text_candidates(self.ctx)
+
+        self.template_mask, self.template_info = None, {'matched': False}
+        if template_library is not None and len(template_library):
+            self.template_mask, self.template_info = template_library.match(self.ctx)
+
+        self.elapsed = time.time() - start
+
+    @property
+    def has_bands(self):
+        return any(v is not None for v in self.bands.values())
+
+    @property
+    def template_matched(self):
+        return self.template_mask is not None
+
+    @property
+    def clean(self):
+        """三种信号都没有：可以跳过昂贵的检测器（不能据此跳过盲水印模型和便宜的检测器）"""
+        return not self.template_matched and not self.has_bands and self.text_ratio < TEXT_MIN_RATIO
+
+    @property
+    def weak_text(self):
+        return self.text_ratio < TEXT_MIN_RATIO
+
+    def candidate_mask(self):
+        """门控分辨率下需要被检测结果覆盖的候选区域"""
+        return np.maximum(self.band_mask, self.text_mask)
+
+    def info(self):
+        return {
+            'bands': {k: v for k, v in self.bands.items() if v is not None},
+            'text_ratio': round(self.text_ratio, 4),
+            'template': self.template_info,
+            'elapsed': round(self.elapsed, 3),
+        }
+
+
+class DetectorCascade:
+    """按开销排序的检测器级联
+
+    stages 为 [(name, fn, cost, max_coverage)]，fn(ctx) -> (mask, pixels)；
+    max_coverage 不为 None 时，单个检测器覆盖率超过该值的结果视为误检丢弃。
+    sort=False 时保持传入顺序（由 DetectorRegistry 排好）；
+    observer(name, latency, hit, contribution) 接收每个检测器的运行统计。
+    """
+
+    def __init__(self, stages, sort=True, observer=None):
+        self.stages = sorted(stages, key=lambda s: s[2]) if sort else list(stages)
+        self.observer = observer
+
+    def _observe(self, name, latency, hit, contribution):
+        if self.observer is not None:
+            try:
+                self.observer(name, latency, hit, contribution)
+            except Exception as e:
+                print(f"Detector observer error: {e}")
+
+    @staticmethod
+    def _coverage_of(candidates, mask_small):
+        total = np.count_nonzero(candidates)
+        if total == 0:
+            return 1.0
+        return np.count_nonzero(mask_small[candidates > 0]) / total
+
+    def run(self, ctx, gate, initial=None):
+        """返回 (combined uint8 mask 或 None, detection_info)；initial 为已知的 mask（如模板命中）"""
+        ctx = ImageContext.of(ctx)
+        w, h = ctx.size
+        small_size = gate.band_mask.shape[1], gate.band_mask.shape[0]
+        candidates = gate.candidate_mask()
+
+        combined = initial
+        detection_info = {'gate': gate.info(), 'stages': []}
+        stages = self.stages
+        if gate.weak_text:
+            # 文字信号弱时先把便宜的检测器跑完，再决定是否判为空（稳定排序，保持各组内的顺序）
+            stages = sorted(stages, key=lambda s: s[2] >= EXPENSIVE_COST)
+        if initial is not None:
+            mask_small = cv2.resize(initial, small_size, interpolation=cv2.INTER_NEAREST)
+            if self._coverage_of(candidates, mask_small) >= COMPLETE_RATIO:
+                detection_info['early_exit'] = 'complete'
+                stages = []
+
+        for name, fn, cost, max_coverage in stages:
+            # 便宜的检测器都已跑完且没有结果、门控也没有文字信号：判定为空
+            if combined is None and cost >= EXPENSIVE_COST and gate.weak_text:
+                detection_info['early_exit'] = 'empty'
+                break
+
+            start = time.time()
+            try:
+                mask, pixels = fn(ctx)
+            except Exception as e:
+                print(f"{name} detection error: {e}")
+                detection_info[f'{name}_error'] = str(e)
+                continue
+            latency = time.time() - start
+            detection_info['stages'].append(name)
+            print(f"{name} detection: {int(pixels)} pixels in {latency:.2f}s")
+
+            if pixels <= 0:
+                self._observe(name, latency, False, 0.0)
+                continue
+            coverage = 100 * pixels / (h * w)
+            if max_coverage is not None and coverage > max_coverage:
+                print(f"{name} coverage too high ({coverage:.1f}%), ignored")
+                detection_info[f'{name}_ignored'] = round(coverage, 2)
+                self._observe(name, latency, False, 0.0)
+                continue
+
+            mask = np.asarray(mask)
+            if combined is None:
+                added = np.count_nonzero(mask)
+                combined = mask
+            else:
+                added = np.count_nonzero((mask > 0) & (combined == 0))
+                combined = np.maximum(combined, mask)
+            # 边际贡献：新增像素占当前合并 mask 的比例
+            self._observe(name, latency, True, added / max(np.count_nonzero(combined), 1))
+            detection_info[name] = int(pixels)
+
+            total = 100 * np.count_nonzero(combined) / (h * w)
+            if total > MAX_COVERAGE:
+                detection_info['early_exit'] = 'coverage'
+                break
+
+            mask_small = cv2.resize(combined, small_size, interpolation=cv2.INTER_NEAREST)
+            if self._coverage_of(candidates, mask_small) >= COMPLETE_RATIO:
+                detection_info['early_exit'] = 'complete'
+                break
+
+        return combined, detection_info
@@ -0,0 +1,230 @@
+"""
+去除假透明背景（服务端版本）
+
+Lovart、Midjourney 等工具导出的"透明"图片实际是灰白棋盘格。
+从四角用 FFT 自相关检测棋盘格周期和相位，按相位生成期望背景，
+一次向量化计算得到 alpha；检测不到棋盘格时退回前端同款的灰白阈值算法。
+"""
+
+import io
+import os
+import sys
+
+import numpy as np
+from PIL import Image
+
+from fixpic.pool import map_in_pool
+
+# 与期望背景颜色的距离过渡区间（RGB 欧氏距离）
+ALPHA_LOW = 12.0
+ALPHA_HIGH = 36.0
+
+# 棋盘格两种颜色都应接近灰色
+MAX_CHECKER_CHROMA = 25
+
+
+def _autocorrelation(patch):
+    """归一化的二维线性自相关（补零 FFT）"""
+    h, w = patch.shape
+    p = patch - patch.mean()
+    var = float(np.mean(p * p))
+    if var < 1e-6:
+        return None
+
+    spectrum = np.fft.rfft2(p, s=(2 * h, 2 * w))
+    ac = np.fft.irfft2(spectrum * np.conj(spectrum), s=(2 * h, 2 * w))[:h, :w]
+
+    # 按重叠像素数归一化
+    overlap = np.outer(h - np.arange(h), w - np.arange(w))
+    return ac / overlap / var
+
+
+def _boundary_phase(gray, period, axis):
+    """根据梯度峰值所在的余数确定格子边界相位"""
+    grad = np.abs(np.diff(gray, axis=axis)).mean(axis=1 - axis)
+    residues = np.arange(1, len(grad) + 1) % period
+    scores = np.bincount(residues, weights=grad, minlength=period)
+    return int(np.argmax(scores))
+
+
+def _detect_corner(rgb_patch, max_period):
+    """检测单个角落的棋盘格，返回 (边长, x 相位, y 相位, 颜色0, 颜色1) 或 None"""
+    gray = rgb_patch.astype(np.float32).mean(axis=2)
+    ac = _autocorrelation(gray)
+    if ac is None:
+        return None
+
+    # 边长 s 处两个方向都应强负相关，(s, s) 与 (2s, 0) 处强正相关；
+    # 奇数倍边长处同样负相关，取第一个低于 -0.5 的局部极小值
+    row = ac[0, :max_period + 2]
+    minima = np.nonzero((row[2:-1] < -0.5) & (row[2:-1] <= row[1:-2]) & (row[2:-1] <= row[3:]))[0]
+    if len(minima) == 0:
+        return None
+    period = int(minima[0]) + 2
+    if 2 * period >= min(gray.shape):
+        return None
+    if ac[0, period] > -0.5 or ac[period, 0] > -0.5:
+        return None
+    if ac[period, period] < 0.5 or ac[0, 2 * period] < 0.5:
+        return None
+
+    phase_x = _boundary_phase(gray, period, axis=1)
+    phase_y = _boundary_phase(gray, period, axis=0)
+
+    ys, xs = np.indices(gray.shape)
+    parity = (((xs - phase_x) // period) + ((ys - phase_y) // period)) % 2
+    pixels = rgb_patch.reshape(-1, 3).astype(np.float32)
+    color0 = np.median(pixels[parity.ravel() == 0], axis=0)
+    color1 = np.median(pixels[parity.ravel() == 1], axis=0)
+
+    for color in (color0, color1):
+        if color.max() - color.min() > MAX_CHECKER_CHROMA:
+            return None
+    if abs(float(color0.mean()) - float(color1.mean())) < 4:
+        return None
+
+    return period, phase_x, phase_y, color0, color1
+
+
+def detect_checkerboard(rgb):
+    """从四角检测棋盘格，返回图片全局坐标下的参数字典或 None"""
+    h, w = rgb.shape[:2]
+    c = min(128, min(h, w) // 4)
+    if c < 16:
+        return None
+
+    origins = [(0, 0), (w - c, 0), (0, h - c), (w - c, h - c)]
+    found = []
+    for ox, oy in origins:
+        result = _detect_corner(rgb[oy:oy + c, ox:ox + c], max_period=c // 3)
+        if result is None:
+            continue
+        period, phase_x, phase_y, color0, color1 = result
+        # 换算成全局相位，颜色0 对应全局奇偶性 0
+        gx = (phase_x + ox) % period
+        gy = (phase_y + oy) % period
+        if ((phase_x + ox) // period + (phase_y + oy) // period) % 2:
+            color0, color1 = color1, color0
+        found.append((period, gx, gy, color0, color1))
+
+    if not found:
+        return None
+
+    # 多个角落结果不一致时取出现次数最多的边长
+    periods = [f[0] for f in found]
+    period = max(set(periods), key=periods.count)
+    best = next(f for f in found if f[0] == period)
+
+    return {
+        'period': period,
+        'phase_x': best[1],
+        'phase_y': best[2],
+        'colors': np.stack([best[3], best[4]]).astype(np.float32),
+        'corners': len(found),
+    }
+
+
+def checkerboard_alpha(rgb, params):
+    """按检测到的棋盘格参数一次性生成 alpha (uint8)"""
+    h, w = rgb.shape[:2]
+    period = params['period']
+    colors = params['colors']
+
+    x_steps = np.arange(w) - params['phase_x']
+    y_steps = np.arange(h) - params['phase_y']
+    parity = ((y_steps // period) % 2)[:, None] ^ ((x_steps // period) % 2)[None, :]
+
+    pixels = rgb.astype(np.float32)
+    d0 = np.sqrt(np.sum((pixels - colors[0]) ** 2, axis=2))
+    d1 = np.sqrt(np.sum((pixels - colors[1]) ** 2, axis=2))
+    dist = np.where(parity == 0, d0, d1)
+
+    # 格子边界 1px 内允许匹配任一颜色（导出时的抗锯齿）
+    near_x = np.isin(x_steps % period, (0, period - 1))
+    near_y = np.isin(y_steps % period, (0, period - 1))
+    near_edge = near_y[:, None] | near_x[None, :]
+    dist = np.where(near_edge, np.minimum(d0, d1), dist)
+
+    alpha = np.clip((dist - ALPHA_LOW) / (ALPHA_HIGH - ALPHA_LOW), 0.0, 1.0)
+    return (alpha * 255.0 + 0.5).astype(np.uint8)
+
+
+def threshold_alpha(rgb):
+    """前端同款算法：四角采样判断灰色背景，灰白且 RGB 接近的像素设为透明"""
+    h, w = rgb.shape[:2]
+    size = max(1, min(20, min(h, w) // 10))
+    corners = np.concatenate([
+        rgb[:size, :size].reshape(-1, 3),
+        rgb[:size, w - size:].reshape(-1, 3),
+        rgb[h - size:, :size].reshape(-1, 3),
+        rgb[h - size:, w - size:].reshape(-1, 3),
+    ]).astype(np.int16)
+
+    spread = corners.max(axis=1) - corners.min(axis=1)
+    is_gray = spread < 20
+    is_gray_bg = is_gray.mean() > 0.7
+    threshold = max(150, int(corners[is_gray].min()) - 10) if is_gray_bg else 220
+
+    pixels = rgb.astype(np.int16)
+    bright = np.all(pixels > threshold, axis=2)
+    similar = (pixels.max(axis=2) - pixels.min(axis=2)) < 20
+    return np.where(bright & similar, 0, 255).astype(np.uint8)
+
+
+def remove_fake_transparency(image):
+    """去除假透明背景，返回 (RGBA 图片, 检测信息)"""
+    rgb = np.array(image.convert('RGB'))
+
+    params = detect_checkerboard(rgb)
+    if params is not None:
+        alpha = checkerboard_alpha(rgb, params)
+        info = {'method': 'checkerboard', 'period': params['period'], 'corners': params['corners']}
+    else:
+        alpha = threshold_alpha(rgb)
+        info = {'method': 'threshold'}
+
+    output = Image.fromarray(rgb).convert('RGBA')
+    output.putalpha(Image.fromarray(alpha, 'L'))
+    return output, info
+
+
+def _process_bytes(data):
+    """进程池任务：输入图片字节，输出 PNG 字节与检测信息"""
+    image = Image.open(io.BytesIO(data))
+    output, info = remove_fake_transparency(image)
+    buffered = io.BytesIO()
+    output.save(buffered, format='PNG')
+    info.update({'width': output.width, 'height': output.height})
+    return buffered.getvalue(), info
+
+
+def remove_fake_transparency_batch(images_data):
+    """批量处理图片字节列表（进程池并行），返回 [(PNG 字节, 检测信息), ...]"""
+    return map_in_pool(_process_bytes, images_data)
+
+
+def main(argv):
+    """命令行批量处理：python -m fixpic.checkerboard 输出目录 图片..."""
+    if len(argv) < 2:
+        print("Usage: python -m fixpic.checkerboard OUTPUT_DIR IMAGE [IMAGE ...]")
+        return 1
+
+    output_dir, paths = argv[0], argv[1:]
+    os.makedirs(output_dir, exist_ok=True)
+
+    datas = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            datas.append(f.read())
+
+    for path, (png, info) in zip(paths, remove_fake_transparency_batch(datas)):
+        name = os.path.splitext(os.path.basename(path))[0] + '.png'
+        with open(os.path.join(output_dir, name), 'wb') as f:
+            f.write(png)
+        print(f"{path} -> {name} ({info['method']})")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,257 @@
+"""
+图片压缩 / 格式转换（服务端批量版本）
+
+与前端压缩工具参数一致（格式、质量、最大宽度），另外支持"压缩到 N 字节以内"：
+先在缩小的探针图上编码几个质量点建立 体积-质量 曲线，预测目标质量，
+再用全尺寸编码校准，超限时按校准后的曲线下调质量，第一个满足限制的编码即返回，
+避免逐个质量暴力重编码。质量不超过请求 / 预设的质量（默认 80），
+只有达不到下限（min_bytes）时才提高质量。
+"""
+
+import io
+import math
+
+import numpy as np
+from PIL import Image
+
+from fixpic.pool import map_in_pool
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'jpg': ('JPEG', 'image/jpeg'),
+    'png': ('PNG', 'image/png'),
+}
+
+# 电商平台预设（见 docs/product-plan.md 4.2）
+PLATFORM_PRESETS = {
+    'taobao': {'format': 'jpeg', 'max_width': 800, 'max_bytes': 3 * 1024 * 1024},
+    'taobao_white': {'format': 'jpeg', 'max_width': 800, 'min_bytes': 38 * 1024, 'max_bytes': 300 * 1024},
+    'jd': {'format': 'jpeg', 'max_width': 800, 'max_bytes': 2 * 1024 * 1024},
+    'jd_transparent': {'format': 'png', 'max_width': 800, 'max_bytes': 1024 * 1024},
+    'pdd': {'format': 'jpeg', 'max_width': 750, 'max_bytes': 3 * 1024 * 1024},
+    'amazon': {'format': 'jpeg', 'max_width': 2000, 'max_bytes': 10 * 1024 * 1024},
+}
+
+# 探针图最大边长与探针质量点
+PROBE_MAX_SIDE = 512
+PROBE_QUALITIES = (20, 45, 70, 85, 95)
+
+MIN_QUALITY = 10
+MAX_QUALITY = 100
+
+# 每张图最多的全尺寸编码次数 / 降分辨率次数
+MAX_FULL_ENCODES = 6
+MAX_DOWNSCALES = 3
+
+
+def _prepare(image, fmt, max_width):
+    """按目标格式转换颜色模式，并按最大宽度等比缩放"""
+    # 调色板 / 灰度 PNG 的透明度在 info['transparency'] 中，不是单独的 alpha 通道
+    transparent = 'A' in image.getbands() or 'transparency' in image.info
+    if fmt == 'JPEG' and (image.mode != 'RGB' or transparent):
+        # JPEG 不支持透明，透明区域铺白底（电商白底图）
+        rgba = image.convert('RGBA')
+        background = Image.new('RGB', rgba.size, (255, 255, 255))
+        background.paste(rgba, mask=rgba.split()[3])
+        image = background
+    elif image.mode not in ('RGB', 'RGBA') or (image.mode == 'RGB' and transparent):
+        image = image.convert('RGBA' if transparent else 'RGB')
+
+    if max_width and image.width > max_width:
+        height = max(1, round(image.height * max_width / image.width))
+        image = image.resize((max_width, height), Image.Resampling.LANCZOS)
+
+    return image
+
+
+def encode(image, fmt, quality=None):
+    """编码为字节"""
+    buffered = io.BytesIO()
+    if fmt == 'PNG':
+        image.save(buffered, format='PNG', optimize=True)
+    else:
+        image.save(buffered, format=fmt, quality=int(quality))
+    return buffered.getvalue()
+
+
+class _SizeModel:
+    """体积-质量曲线：探针图采样后按 log(体积) 线性插值，用全尺寸编码结果校准比例"""
+
+    def __init__(self, image, fmt):
+        scale = min(1.0, PROBE_MAX_SIDE / max(image.size))
+        if scale < 1.0:
+            probe_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            probe = image.resize(probe_size, Image.Resampling.BILINEAR)
+        else:
+            probe = image
+
+        self.qualities = np.array(PROBE_QUALITIES, dtype=np.float64)
+        sizes = np.array([len(encode(probe, fmt, q)) for q in PROBE_QUALITIES], dtype=np.float64)
+        # 体积随质量单调递增
+        self.log_sizes = np.log(np.maximum.accumulate(sizes))
+        self.log_ratio = math.log(image.width * image.height / (probe.width * probe.height))
+        self.probe_encodes = len(PROBE_QUALITIES)
+
+    def predict_size(self, quality):
+        return math.exp(np.interp(quality, self.qualities, self.log_sizes) + self.log_ratio)
+
+    def predict_quality(self, target_bytes):
+        log_target = math.log(target_bytes) - self.log_ratio
+        return float(np.interp(log_target, self.log_sizes, self.qualities))
+
+    def calibrate(self, quality, actual_bytes):
+        self.log_ratio += math.log(actual_bytes) - math.log(self.predict_size(quality))
+
+
+def _fit_lossy(image, fmt, max_bytes, min_bytes, max_quality=MAX_QUALITY):
+    """找到满足体积限制的质量，返回 (字节, 质量, 全尺寸编码次数, 探针编码次数)
+
+    质量优先不超过 max_quality（请求 / 预设的质量）；设置了 min_bytes 且该质量仍不够大时
+    才继续往上找（最高 MAX_QUALITY）。都不满足时返回最接近 [min_bytes, max_bytes] 的编码。
+    """
+    model = _SizeModel(image, fmt)
+    cap = int(max_quality)
+    hi = MAX_QUALITY if min_bytes else cap
+    lo = min(MIN_QUALITY, cap)
+    best = None
+    closest = None
+    full_encodes = 0
+
+    def distance(size):
+        """与 [min_bytes, max_bytes] 的距离，区间内为 0"""
+        return max(0, (min_bytes or 0) - size, size - max_bytes if max_bytes else 0)
+
+    # 目标取上限略低处，给预测误差留余量
+    target = max_bytes * 0.97 if max_bytes else min_bytes * 1.05
+
+    # 预测最低质量也明显超限时，先编码一次最低质量确认，超限则交给调用方降分辨率
+    if max_bytes and model.predict_size(lo) > max_bytes * 1.5:
+        data = encode(image, fmt, lo)
+        full_encodes += 1
+        model.calibrate(lo, len(data))
+        if len(data) > max_bytes:
+            return data, lo, full_encodes, model.probe_encodes
+        closest = (data, lo)
+        if not distance(len(data)):
+            best = closest
+        lo += 1
+
+    while lo <= hi and full_encodes < MAX_FULL_ENCODES:
+        quality = int(round(model.predict_quality(target)))
+        if not max_bytes:
+            # 只有下限：请求的质量够大就用它，不为贴近下限而降低质量
+            quality = max(quality, cap)
+        quality = min(max(quality, lo), hi)
+        if lo <= cap:
+            quality = min(quality, cap)
+
+        data = encode(image, fmt, quality)
+        full_encodes += 1
+        model.calibrate(quality, len(data))
+
+        if closest is None or distance(len(data)) < distance(len(closest[0])):
+            closest = (data, quality)
+
+        if max_bytes and len(data) > max_bytes:
+            hi = quality - 1
+        elif min_bytes and len(data) < min_bytes:
+            lo = quality + 1
+        else:
+            # 区间内保留最大的编码；预测质量已瞄准上限附近，继续逼近的收益抵不上全尺寸编码
+            if best is None or len(data) > len(best[0]):
+                best = (data, quality)
+            break
+
+    if best is None:
+        best = closest
+    return best[0], best[1], full_encodes, model.probe_encodes
+
+
+def _fit_png(image, max_bytes):
+    """PNG 无损：先 optimize，仍超限时量化到 256 色"""
+    data = encode(image, 'PNG')
+    if not max_bytes or len(data) <= max_bytes:
+        return data, 1
+
+    method = Image.Quantize.FASTOCTREE if image.mode == 'RGBA' else Image.Quantize.MEDIANCUT
+    quantized = image.quantize(colors=256, method=method)
+    return encode(quantized, 'PNG'), 2
+
+
+def compress_image(image, fmt='webp', quality=80, max_width=None, max_bytes=None, min_bytes=None):
+    """压缩单张图片，返回 (字节, 信息字典)"""
+    fmt_name, mime = FORMATS[fmt.lower()]
+    image = _prepare(image, fmt_name, max_width)
+
+    info = {'format': fmt.lower(), 'mime': mime, 'full_encodes': 0, 'probe_encodes': 0}
+
+    if not max_bytes and not min_bytes:
+        data = encode(image, fmt_name, quality)
+        info.update({'quality': None if fmt_name == 'PNG' else int(quality), 'full_encodes': 1})
+    else:
+        for attempt in range(MAX_DOWNSCALES + 1):
+            if fmt_name == 'PNG':
+                data, encodes = _fit_png(image, max_bytes)
+                info['quality'] = None
+            else:
+                data, q, encodes, probes = _fit_lossy(image, fmt_name, max_bytes, min_bytes, quality)
+                info['quality'] = q
+                info['probe_encodes'] += probes
+            info['full_encodes'] += encodes
+
+            if not max_bytes or len(data) <= max_bytes or attempt == MAX_DOWNSCALES:
+                break
+
+            # 最低质量仍超限：按体积比例缩小尺寸后重试
+            scale = math.sqrt(max_bytes / len(data)) * 0.9
+            new_size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+            print(f"Still {len(data)} bytes at lowest quality, downscaling to {new_size[0]}x{new_size[1]}")
+            image = image.resize(new_size, Image.Resampling.LANCZOS)
+
+    size = len(data)
+    info.update({
+        'width': image.width,
+        'height': image.height,
+        'size': size,
+        'within_limits': (not max_bytes or size <= max_bytes) and (not min_bytes or size >= min_bytes),
+    })
+    return data, info
+
+
+def resolve_options(preset=None, **overrides):
+    """合并平台预设与显式参数（显式参数优先，None 表示未指定）"""
+    options = {'fmt': 'webp', 'quality': 80, 'max_width': None, 'max_bytes': None, 'min_bytes': None}
+    if preset:
+        if preset not in PLATFORM_PRESETS:
+            raise ValueError(f"Unknown preset: {preset}")
+        for key, value in PLATFORM_PRESETS[preset].items():
+            options['fmt' if key == 'format' else key] = value
+    for key, value in overrides.items():
+        if value is not None:
+            options[key] = value
+
+    options['fmt'] = str(options['fmt']).lower()
+    if options['fmt'] not in FORMATS:
+        raise ValueError(f"Unsupported format: {options['fmt']} (supported: {', '.join(FORMATS)})")
+    if not 1 <= options['quality'] <= MAX_QUALITY:
+        raise ValueError(f"quality must be between 1 and {MAX_QUALITY}")
+    for key in ('max_width', 'max_bytes', 'min_bytes'):
+        if options[key] is not None and options[key] <= 0:
+            raise ValueError(f"{key} must be positive")
+    return options
+
+
+def _compress_bytes(task):
+    """进程池任务：(图片字节, 参数) -> (输出字节, 信息)"""
+    data, options = task
+    image = Image.open(io.BytesIO(data))
+    image.load()
+    output, info = compress_image(image, **options)
+    info['original_size'] = len(data)
+    return output, info
+
+
+def compress_batch(images_data, options):
+    """批量压缩图片字节列表（进程池并行），返回 [(输出字节, 信息), ...]"""
+    return map_in_pool(_compress_bytes, [(data, options) for data in images_data])
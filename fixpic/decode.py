@@ -0,0 +1,101 @@
+"""
+按需分辨率解码
+
+检测类步骤（OCR 缩到 1500px、SAM 内部 1024px、横条统计等）只需要缩小图。
+JPEG 使用 PIL draft 模式在 DCT 阶段按 1/2、1/4、1/8 缩放解码，直接得到缩小图；
+全分辨率只在最终修复 / 合成真正需要时才解码。
+"""
+
+import io
+import time
+
+import numpy as np
+from PIL import Image
+
+
+class DecodedImage:
+    """延迟解码的上传图片（RGB）"""
+
+    def __init__(self, data=None, image=None):
+        self._data = data
+        self._full = image.convert('RGB') if image is not None else None
+        self._reduced = {}
+        self._arrays = {}
+
+        if self._full is not None:
+            self.size = self._full.size
+            self.format = getattr(image, 'format', None)
+        else:
+            # 只读文件头，不解码像素
+            with Image.open(io.BytesIO(data)) as header:
+                self.size = header.size
+                self.format = header.format
+
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(data=data)
+
+    @classmethod
+    def from_pil(cls, image):
+        return cls(image=image)
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    def full(self):
+        """全分辨率 RGB 图片（首次调用时解码）"""
+        if self._full is None:
+            start = time.time()
+            self._full = Image.open(io.BytesIO(self._data)).convert('RGB')
+            print(f"Full decode {self.width}x{self.height}: {time.time() - start:.2f}s")
+        return self._full
+
+    def scale_for(self, max_side):
+        """缩小到 max_side 时的缩放比例（不放大）"""
+        return min(1.0, max_side / max(self.size))
+
+    def reduced(self, max_side):
+        """长边不超过 max_side 的 RGB 图片"""
+        scale = self.scale_for(max_side)
+        if scale >= 1.0:
+            return self.full()
+
+        if max_side in self._reduced:
+            return self._reduced[max_side]
+
+        target = (max(1, int(self.width * scale)), max(1, int(self.height * scale)))
+
+        if self._full is not None:
+            source = self._full
+        else:
+            source = Image.open(io.BytesIO(self._data))
+            if source.format == 'JPEG':
+                # DCT 缩放解码：得到不小于 target 的最小 1/2^n 尺寸
+                source.draft('RGB', target)
+            source = source.convert('RGB')
+
+        if source.size != target:
+            source = source.resize(target, Image.Resampling.BILINEAR)
+
+        self._reduced[max_side] = source
+        return source
+
+    def array(self, max_side=None):
+        """numpy RGB 数组（缓存），max_side 为空时返回全分辨率"""
+        key = max_side or 0
+        if key not in self._arrays:
+            image = self.reduced(max_side) if max_side else self.full()
+            self._arrays[key] = np.array(image)
+        return self._arrays[key]
+
+
+def as_decoded(image):
+    """PIL 图片或 DecodedImage 统一转换为 DecodedImage"""
+    if isinstance(image, DecodedImage):
+        return image
+    return DecodedImage.from_pil(image)
@@ -0,0 +1,276 @@
+"""
+水印检测器注册表：在线学习各检测器的开销与收益
+
+每个检测器注册时声明预估开销；运行时按来源（source，如某个客户或图库）分别记录：
+- 延迟（EWMA）
+- 命中率：检测到像素的比例
+- 边际贡献：该检测器新增的像素占最终 mask 的比例（EWMA）
+
+排序按 "预期延迟 / 预期收益"，收益长期接近零的检测器自动跳过，
+同时保留少量探索（EXPLORE_RATE）让统计跟上流量变化。
+统计以 JSON 保存在模型 Volume 中（DETECTOR_STATS_PATH），容器重启后继续使用；
+多个容器共用一个文件，保存时先读回文件再合并本容器上次保存后的增量，不会互相覆盖；
+读回失败（如 Volume 上有打开的文件时 reload 报错）时重试，仍失败则本次不写，增量留到下次保存。
+
+source 由客户端传入，只接受 DETECTOR_SOURCES（逗号分隔）中的来源；
+未配置时最多记录 DETECTOR_MAX_SOURCES 个，其余归入 default，统计不会无限增长。
+"""
+
+import json
+import os
+import random
+import threading
+import time
+
+STATS_PATH = os.environ.get("DETECTOR_STATS_PATH", "/models/detector_stats.json")
+EWMA_ALPHA = 0.1
+# 样本数少于该值时按声明的开销排序
+MIN_RUNS = 20
+# 预期收益（命中率 × 边际贡献）低于该值时跳过
+SKIP_YIELD = float(os.environ.get("DETECTOR_SKIP_YIELD", "0.01"))
+EXPLORE_RATE = 0.05
+SAVE_EVERY = 20
+# 保存前 reload 的重试次数与首次重试间隔（秒，之后翻倍）
+RELOAD_ATTEMPTS = 3
+RELOAD_BACKOFF = 0.5
+DEFAULT_SOURCE = 'default'
+ALLOWED_SOURCES = {s.strip().lower() for s in os.environ.get("DETECTOR_SOURCES", "").split(',') if s.strip()}
+MAX_SOURCES = int(os.environ.get("DETECTOR_MAX_SOURCES", "50"))
+MAX_SOURCE_LENGTH = 64
+
+
+class DetectorStats:
+    """单个检测器在某个来源下的统计"""
+
+    def __init__(self, runs=0, hits=0, latency=None, contribution=0.0):
+        self.runs = runs
+        self.hits = hits
+        self.latency = latency
+        self.contribution = contribution
+
+    @property
+    def hit_rate(self):
+        return self.hits / self.runs if self.runs else 0.0
+
+    @property
+    def expected_yield(self):
+        return self.hit_rate * self.contribution
+
+    def update(self, latency, hit, contribution):
+        self.runs += 1
+        self.hits += int(hit)
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += EWMA_ALPHA * (latency - self.latency)
+        if hit:
+            # 边际贡献只在命中时更新，未命中的影响体现在命中率里
+            if self.hits == 1:
+                self.contribution = contribution
+            else:
+                self.contribution += EWMA_ALPHA * (contribution - self.contribution)
+
+    def merge(self, other):
+        """合并另一份统计（延迟按次数、边际贡献按命中数加权）"""
+        runs = self.runs + other.runs
+        hits = self.hits + other.hits
+        if other.latency is not None:
+            if self.latency is None:
+                self.latency = other.latency
+            else:
+                self.latency = (self.latency * self.runs + other.latency * other.runs) / max(runs, 1)
+        if hits:
+            self.contribution = (self.contribution * self.hits + other.contribution * other.hits) / hits
+        self.runs = runs
+        self.hits = hits
+
+    def copy(self):
+        return DetectorStats(**self.to_dict())
+
+    def to_dict(self):
+        return {
+            'runs': self.runs,
+            'hits': self.hits,
+            'latency': self.latency,
+            'contribution': self.contribution,
+        }
+
+    def summary(self):
+        return {
+            'runs': self.runs,
+            'hit_rate': round(self.hit_rate, 4),
+            'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            'contribution': round(self.contribution, 4),
+            'expected_yield': round(self.expected_yield, 4),
+        }
+
+
+class DetectorRegistry:
+    """检测器注册表
+
+    stages 格式与 DetectorCascade 一致：(name, fn, cost, max_coverage)。
+    """
+
+    def __init__(self, path=STATS_PATH, on_save=None, on_reload=None):
+        """on_reload 在读回统计文件前调用（如 volume.reload，看到其他容器提交的统计）"""
+        self.path = path
+        self.on_save = on_save
+        self.on_reload = on_reload
+        self._detectors = {}
+        self._stats = {}
+        self._pending = {}  # 上次保存后本容器新增的统计，保存时合并进文件
+        self._lock = threading.Lock()
+        self._dirty = 0
+        self.load()
+
+    def register(self, name, fn, cost, max_coverage=None):
+        self._detectors[name] = (name, fn, cost, max_coverage)
+
+    def _source_key(self, source):
+        """客户端传入的 source 归一化；不在白名单或超出来源上限的归入 default"""
+        if not isinstance(source, str):
+            return DEFAULT_SOURCE
+        source = source.strip().lower()[:MAX_SOURCE_LENGTH]
+        if not source:
+            return DEFAULT_SOURCE
+        if ALLOWED_SOURCES:
+            return source if source in ALLOWED_SOURCES else DEFAULT_SOURCE
+        if source in self._stats or len(self._stats) < MAX_SOURCES:
+            return source
+        return DEFAULT_SOURCE
+
+    def _get(self, source, name):
+        return self._stats.setdefault(source, {}).setdefault(name, DetectorStats())
+
+    def _order(self, source, explore):
+        """按预期性价比排序；explore=False 时不做随机探索（结果确定）"""
+        scored, skipped = [], []
+        detectors = self._stats.get(source, {})
+        for name, stage in self._detectors.items():
+            stats = detectors.get(name) or DetectorStats()
+            cost = stage[2]
+            if stats.runs < MIN_RUNS:
+                scored.append((cost, stage))
+                continue
+            if stats.expected_yield < SKIP_YIELD and not (explore and random.random() < EXPLORE_RATE):
+                skipped.append(name)
+                continue
+            latency = stats.latency if stats.latency is not None else cost
+            scored.append((latency / max(stats.expected_yield, 1e-3), stage))
+        scored.sort(key=lambda item: item[0])
+        return [stage for _, stage in scored], skipped
+
+    def plan(self, source=None):
+        """返回 (按预期性价比排序的 stages, 被跳过的检测器名)"""
+        with self._lock:
+            return self._order(self._source_key(source), explore=True)
+
+    def record(self, source, name, latency, hit, contribution):
+        with self._lock:
+            source = self._source_key(source)
+            self._get(source, name).update(latency, hit, contribution)
+            self._pending.setdefault(source, {}).setdefault(name, DetectorStats()).update(latency, hit, contribution)
+            self._dirty += 1
+            should_save = self._dirty >= SAVE_EVERY
+        if should_save:
+            self.save()
+
+    def _read(self):
+        """读取统计文件，返回 {source: {name: DetectorStats}}"""
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            data = json.load(f)
+        return {
+            source: {name: DetectorStats(**values) for name, values in detectors.items()}
+            for source, detectors in data.get('sources', {}).items()
+        }
+
+    def load(self):
+        try:
+            stats = self._read()
+        except Exception as e:
+            print(f"Failed to load detector stats: {e}")
+            return
+        with self._lock:
+            self._stats = stats
+        if stats:
+            print(f"Loaded detector stats for {len(stats)} sources from {self.path}")
+
+    def _reload(self):
+        """看到其他容器提交的统计；重试 RELOAD_ATTEMPTS 次后仍失败则抛出"""
+        if self.on_reload is None:
+            return
+        for attempt in range(RELOAD_ATTEMPTS):
+            try:
+                self.on_reload()
+                return
+            except Exception as e:
+                if attempt == RELOAD_ATTEMPTS - 1:
+                    raise
+                print(f"Failed to reload detector stats (attempt {attempt + 1}): {e}")
+                time.sleep(RELOAD_BACKOFF * 2 ** attempt)
+
+    def save(self):
+        """读回文件（其他容器可能已写入），合并本容器的增量后写回
+
+        读回失败时不写文件（否则会用本容器的旧视图覆盖其他容器的统计），增量留到下次保存。
+        返回是否写入。
+        """
+        with self._lock:
+            if not self._dirty:
+                return False
+            pending, self._pending = self._pending, {}
+            self._dirty = 0
+        try:
+            self._reload()
+            merged = self._read()
+            for source, detectors in pending.items():
+                for name, delta in detectors.items():
+                    merged.setdefault(source, {}).setdefault(name, DetectorStats()).merge(delta)
+
+            data = {
+                'updated': time.time(),
+                'sources': {
+                    source: {name: stats.to_dict() for name, stats in detectors.items()}
+                    for source, detectors in merged.items()
+                },
+            }
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+            if self.on_save is not None:
+                self.on_save()
+        except Exception as e:
+            print(f"ERROR: Failed to save detector stats, keeping {sum(map(len, pending.values()))} pending updates: {e}")
+            # 下次保存时重试
+            with self._lock:
+                for source, detectors in pending.items():
+                    for name, delta in detectors.items():
+                        self._pending.setdefault(source, {}).setdefault(name, DetectorStats()).merge(delta)
+                self._dirty += 1
+            return False
+
+        # 本地视图换成合并后的结果（含其他容器的统计），再叠加保存期间新增的增量
+        with self._lock:
+            for source, detectors in self._pending.items():
+                for name, delta in detectors.items():
+                    merged.setdefault(source, {}).setdefault(name, DetectorStats()).merge(delta)
+            self._stats = merged
+        return True
+
+    def snapshot(self):
+        """各来源下每个检测器的统计与当前排序"""
+        with self._lock:
+            sources = {
+                source: {name: stats.summary() for name, stats in detectors.items()}
+                for source, detectors in self._stats.items()
+            }
+            order = {source: [stage[0] for stage in self._order(source, explore=False)[0]] for source in sources}
+        return {
+            'detectors': {name: {'cost': stage[2]} for name, stage in self._detectors.items()},
+            'sources': sources,
+            'order': order,
+        }
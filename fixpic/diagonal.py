@@ -0,0 +1,94 @@
+"""
+斜向文字水印检测（低分辨率 float32 版）
+
+原实现在全分辨率上用 CV_64F 的 Sobel 再做 arctan2 / sqrt，24MP 图片的临时数组
+接近 1GB。这里在长边 WORK_SIDE 的缩小图上用 float32 计算梯度（cartToPolar），
+用幅值加权的方向直方图估计主斜向角度，只把最终 mask 放大回原图。
+"""
+
+import cv2
+import numpy as np
+
+from fixpic.image_context import ImageContext
+
+WORK_SIDE = 1024
+# 斜向角度窗口（±度）与默认中心
+ANGLE_WINDOW = 8
+DEFAULT_ANGLES = (45.0, 135.0)
+# 在默认中心附近搜索直方图峰值的范围
+ANGLE_SEARCH = 12
+# 峰值需高于搜索范围均值的倍数才采用
+PEAK_RATIO = 1.5
+MAGNITUDE_THRESHOLD = 35
+MIN_REGION_AREA = 500  # 原图像素
+MAX_REGION_RATIO = 0.05
+
+
+def orientation_histogram(angle, magnitude, valid):
+    """按 1° 分桶、幅值加权的梯度方向直方图（方向对 180° 取模）"""
+    bins = (angle[valid] % 180).astype(np.int32) % 180
+    return np.bincount(bins, weights=magnitude[valid], minlength=180)
+
+
+def dominant_diagonal_angles(hist):
+    """在 45° / 135° 附近找直方图峰值，峰值不明显时用默认角度"""
+    angles = []
+    for center in DEFAULT_ANGLES:
+        lo, hi = int(center - ANGLE_SEARCH), int(center + ANGLE_SEARCH) + 1
+        window = hist[lo:hi]
+        peak = int(np.argmax(window))
+        if window.mean() > 0 and window[peak] > window.mean() * PEAK_RATIO:
+            angles.append(float(lo + peak) + 0.5)
+        else:
+            angles.append(center)
+    return angles
+
+
+def detect_diagonal_text(image, work_side=WORK_SIDE):
+    """返回 (mask, info)；mask 为原图尺寸的 uint8"""
+    ctx = ImageContext.of(image)
+    w, h = ctx.size
+    small = ctx.downscaled(work_side)
+    sw, sh = small.size
+    scale = sw / w
+
+    gray = small.gray
+    gx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3)
+    magnitude, angle = cv2.cartToPolar(gx, gy, angleInDegrees=True)
+    del gx, gy
+
+    strong = magnitude > MAGNITUDE_THRESHOLD
+    hist = orientation_histogram(angle, magnitude, strong)
+    centers = dominant_diagonal_angles(hist)
+
+    folded = angle % 180
+    diagonal = np.zeros(strong.shape, dtype=bool)
+    for center in centers:
+        diagonal |= np.abs(folded - center) < ANGLE_WINDOW
+    diagonal &= strong
+    del magnitude, angle, folded
+
+    # 膨胀核按缩放比例缩小
+    k = max(1, int(round(5 * scale)))
+    diagonal_mask = cv2.dilate(diagonal.astype(np.uint8) * 255, np.ones((k, k), np.uint8), iterations=2)
+
+    # 只保留适当大小的连通区域（面积阈值按 scale² 换算）
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(diagonal_mask, connectivity=8)
+    area = stats[:, cv2.CC_STAT_AREA]
+    keep = (area > MIN_REGION_AREA * scale * scale) & (area < sw * sh * MAX_REGION_RATIO)
+    keep[0] = False
+    small_mask = keep[labels].astype(np.uint8) * 255
+
+    mask = small_mask
+    if (sw, sh) != (w, h):
+        mask = cv2.resize(small_mask, (w, h), interpolation=cv2.INTER_NEAREST)
+    if np.any(mask):
+        mask = cv2.dilate(mask, np.ones((3, 3), np.uint8), iterations=1)
+
+    info = {
+        'angles': [round(a, 1) for a in centers],
+        'regions': int(np.count_nonzero(keep)),
+        'scale': round(scale, 3),
+    }
+    return mask, info
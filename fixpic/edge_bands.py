@@ -0,0 +1,167 @@
+"""
+边缘横条 / 边栏水印分析
+
+基于积分图（summed-area table）：灰度、灰度平方、饱和度的积分图由 ImageContext
+计算一次，之后任意带状区域的逐行标准差、逐列均值都是 O(1) 查表，
+连续区间用向量化的游程编码（RLE）查找，不再逐行 Python 循环。
+一次分析即可给出底部 / 顶部横条和左 / 右边栏四个候选。
+"""
+
+import numpy as np
+
+from fixpic.image_context import ImageContext
+
+# 横条：逐行灰度标准差阈值
+BAR_STD_THRESHOLD = 25
+EDGE_STD_THRESHOLD = 35
+# 横条与上方区域的平均灰度差
+BAR_CONTRAST = 20
+# 边栏：饱和度低于其余区域均值的比例
+SIDEBAR_SAT_RATIO = 0.7
+
+
+def find_runs(flags):
+    """布尔序列中 True 的连续区间，返回 (starts, lengths)"""
+    flags = np.asarray(flags, dtype=bool)
+    padded = np.concatenate(([False], flags, [False])).astype(np.int8)
+    diff = np.diff(padded)
+    starts = np.flatnonzero(diff == 1)
+    ends = np.flatnonzero(diff == -1)
+    return starts, ends - starts
+
+
+def first_run(flags, min_length):
+    """第一个长度大于 min_length 的 True 区间起点，没有返回 None"""
+    starts, lengths = find_runs(flags)
+    hits = starts[lengths > min_length]
+    return int(hits[0]) if len(hits) else None
+
+
+class EdgeBandAnalyzer:
+    """四条边带的行 / 列统计（积分图查表）"""
+
+    def __init__(self, image):
+        ctx = ImageContext.of(image)
+        self.width, self.height = ctx.size
+        self._sum, self._sqsum = ctx.integral('gray')
+        self._sat = ctx.integral('saturation')
+
+    @staticmethod
+    def _row_sums(table, y0, y1, x0, x1):
+        """[y0, y1) 每一行在 [x0, x1) 上的和"""
+        upper = table[y0:y1, x1] - table[y0:y1, x0]
+        lower = table[y0 + 1:y1 + 1, x1] - table[y0 + 1:y1 + 1, x0]
+        return lower - upper
+
+    @staticmethod
+    def _col_sums(table, x0, x1, y0, y1):
+        """[x0, x1) 每一列在 [y0, y1) 上的和"""
+        left = table[y1, x0:x1] - table[y0, x0:x1]
+        right = table[y1, x0 + 1:x1 + 1] - table[y0, x0 + 1:x1 + 1]
+        return right - left
+
+    @staticmethod
+    def _rect_sum(table, x0, y0, x1, y1):
+        return table[y1, x1] - table[y0, x1] - table[y1, x0] + table[y0, x0]
+
+    def row_std(self, y0, y1):
+        """[y0, y1) 每一行灰度的标准差（与 np.std(gray[y0:y1], axis=1) 一致）"""
+        n = self.width
+        s = self._row_sums(self._sum, y0, y1, 0, n)
+        sq = self._row_sums(self._sqsum, y0, y1, 0, n)
+        mean = s / n
+        return np.sqrt(np.maximum(sq / n - mean * mean, 0.0))
+
+    def band_mean(self, y0, y1):
+        """[y0, y1) 行范围的平均灰度"""
+        area = max((y1 - y0) * self.width, 1)
+        return self._rect_sum(self._sum, 0, y0, self.width, y1) / area
+
+    def col_saturation_mean(self, x0, x1):
+        """[x0, x1) 每一列的平均饱和度"""
+        return self._col_sums(self._sat, x0, x1, 0, self.height) / self.height
+
+    def saturation_mean(self, x0, y0, x1, y1):
+        """矩形区域平均饱和度"""
+        area = max((x1 - x0) * (y1 - y0), 1)
+        return self._rect_sum(self._sat, x0, y0, x1, y1) / area
+
+    def bottom_bar(self, band=0.12, threshold=BAR_STD_THRESHOLD, min_fraction=0.3):
+        """底部纯色横条起点 y：底部 band 区域内第一段长度超过 min_fraction 的均匀行"""
+        h = self.height
+        band_h = int(h * band)
+        if band_h <= 0:
+            return None
+        start = first_run(self.row_std(h - band_h, h) < threshold, band_h * min_fraction)
+        return None if start is None else h - band_h + start
+
+    def distinct_bottom_bar(self, contrast=BAR_CONTRAST, **kwargs):
+        """与上方画面明显不同的底部横条起点 y
+
+        纯色背景的产品图底部同样是均匀行，只有横条颜色和紧挨着的上方区域
+        差异足够大时才算（图库预览的信息条）。
+        """
+        start = self.bottom_bar(**kwargs)
+        if start is None or start <= 0:
+            return None
+        bar_h = self.height - start
+        above = max(0, start - bar_h)
+        if abs(self.band_mean(start, self.height) - self.band_mean(above, start)) < contrast:
+            return None
+        return start
+
+    def candidates(self, threshold=EDGE_STD_THRESHOLD, sat_ratio=SIDEBAR_SAT_RATIO):
+        """一次计算四个边缘候选
+
+        返回 {'bottom': 起点 y, 'top': 终点 y, 'left': 终点 x, 'right': 起点 x}，
+        未检测到的为 None。
+        """
+        w, h = self.width, self.height
+        result = {'bottom': None, 'top': None, 'left': None, 'right': None}
+
+        # 底部横条：均匀行数超过 25% 时从第一条均匀行开始
+        bottom_h = int(h * 0.12)
+        if bottom_h > 0:
+            uniform = self.row_std(h - bottom_h, h) < threshold
+            if np.sum(uniform) > bottom_h * 0.25:
+                result['bottom'] = h - bottom_h + int(np.argmax(uniform))
+
+        # 顶部横条
+        top_h = int(h * 0.08)
+        if top_h > 0:
+            uniform = self.row_std(0, top_h) < threshold
+            if np.sum(uniform) > top_h * 0.25:
+                result['top'] = int(np.argmax(uniform)) + top_h
+
+        # 左 / 右边栏：饱和度明显低于其余部分
+        side_w = int(w * 0.12)
+        if 0 < side_w < w:
+            rest_sat_mean = self.saturation_mean(side_w, 0, w, h)
+            limit = rest_sat_mean * sat_ratio
+
+            low_left = self.col_saturation_mean(0, side_w) < limit
+            if np.sum(low_left) > side_w * 0.3:
+                end = len(low_left) - int(np.argmax(low_left[::-1]))
+                result['left'] = min(int(end * 1.2), w)
+
+            low_right = self.col_saturation_mean(w - side_w, w) < limit
+            if np.sum(low_right) > side_w * 0.3:
+                start = w - side_w + int(np.argmax(low_right))
+                result['right'] = max(int(start * 0.95), 0)
+
+        return result
+
+
+def band_mask(size, bands):
+    """把 candidates() 的结果画成 mask"""
+    w, h = size
+    mask = np.zeros((h, w), dtype=np.uint8)
+    if bands.get('bottom') is not None:
+        mask[bands['bottom']:, :] = 255
+    if bands.get('top') is not None:
+        mask[:bands['top'], :] = 255
+    if bands.get('left') is not None:
+        mask[:, :bands['left']] = 255
+    if bands.get('right') is not None:
+        mask[:, bands['right']:] = 255
+    return mask
@@ -0,0 +1,93 @@
+"""
+Florence-2 批量多提示推理
+
+同一张图的多个提示词（如三种水印 grounding 提示）原本各自调用 model.generate，
+每次都把图片重新过一遍视觉编码器。这里视觉特征只算一次，复制到 batch 维度，
+和各提示词的文本嵌入拼接后一次性交给语言模型 generate。
+
+- FLORENCE_NUM_BEAMS：beam 数，默认 1（贪心）
+- FLORENCE_MAX_NEW_TOKENS：grounding 任务的生成长度上限，默认 256
+"""
+
+import os
+
+NUM_BEAMS = int(os.environ.get("FLORENCE_NUM_BEAMS", "1"))
+MAX_NEW_TOKENS = int(os.environ.get("FLORENCE_MAX_NEW_TOKENS", "256"))
+
+
+def task_of(prompt):
+    """'<CAPTION_TO_PHRASE_GROUNDING>watermark' -> '<CAPTION_TO_PHRASE_GROUNDING>'"""
+    return prompt.split(">")[0] + ">"
+
+
+def _generate_batched(processor, model, image, prompts, device, num_beams, max_new_tokens):
+    """视觉特征只编码一次的批量生成，返回 generated_ids"""
+    import torch
+
+    dtype = next(model.parameters()).dtype
+    inputs = processor(text=prompts, images=[image] * len(prompts), return_tensors="pt", padding=True)
+    input_ids = inputs["input_ids"].to(device)
+    text_mask = inputs["attention_mask"].to(device)
+    pixel_values = inputs["pixel_values"][:1].to(device, dtype)
+
+    with torch.no_grad():
+        image_features = model._encode_image(pixel_values)
+        image_features = image_features.expand(len(prompts), -1, -1)
+
+        text_embeds = model.get_input_embeddings()(input_ids)
+        inputs_embeds = torch.cat([image_features, text_embeds], dim=1)
+        # 图片 token 全部可见，文本部分沿用 tokenizer 的 padding mask
+        image_mask = torch.ones(image_features.shape[:2], dtype=text_mask.dtype, device=device)
+        attention_mask = torch.cat([image_mask, text_mask], dim=1)
+
+        return model.language_model.generate(
+            input_ids=None,
+            inputs_embeds=inputs_embeds,
+            attention_mask=attention_mask,
+            max_new_tokens=max_new_tokens,
+            num_beams=num_beams,
+            do_sample=False,
+        )
+
+
+def _generate_sequential(processor, model, image, prompts, device, num_beams, max_new_tokens):
+    """逐个提示词生成（模型不支持拆分视觉编码时的回退）"""
+    import torch
+
+    dtype = next(model.parameters()).dtype
+    outputs = []
+    for prompt in prompts:
+        inputs = processor(text=prompt, images=image, return_tensors="pt")
+        inputs = {
+            k: v.to(device, dtype) if k == "pixel_values" else v.to(device)
+            for k, v in inputs.items()
+        }
+        with torch.no_grad():
+            outputs.append(model.generate(
+                **inputs,
+                max_new_tokens=max_new_tokens,
+                num_beams=num_beams,
+                do_sample=False,
+            )[0])
+    return outputs
+
+
+def run_prompts(processor, model, image, prompts, device, num_beams=None, max_new_tokens=None):
+    """对同一张图运行多个提示词，返回与 prompts 对齐的 post_process_generation 结果"""
+    num_beams = num_beams or NUM_BEAMS
+    max_new_tokens = max_new_tokens or MAX_NEW_TOKENS
+
+    if hasattr(model, "_encode_image") and hasattr(model, "language_model"):
+        generated_ids = _generate_batched(processor, model, image, prompts, device, num_beams, max_new_tokens)
+    else:
+        generated_ids = _generate_sequential(processor, model, image, prompts, device, num_beams, max_new_tokens)
+
+    results = []
+    for prompt, ids in zip(prompts, generated_ids):
+        text = processor.batch_decode(ids.unsqueeze(0), skip_special_tokens=False)[0]
+        results.append(processor.post_process_generation(
+            text,
+            task=task_of(prompt),
+            image_size=image.size,
+        ))
+    return results
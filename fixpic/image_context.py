@@ -0,0 +1,100 @@
+"""
+单次请求共享的图像上下文
+
+各水印检测器原本各自 np.array(image) 并重复做灰度 / HSV / LAB 转换。
+ImageContext 在请求开始时创建一次，按需计算并缓存 RGB 数组、灰度、HSV、LAB、
+Canny 边缘、积分图和缩小图金字塔，检测器统一从这里读取，同一转换只做一次。
+"""
+
+import cv2
+import numpy as np
+
+from fixpic.decode import DecodedImage, as_decoded
+
+
+class ImageContext:
+    """按需计算并缓存的图像表示"""
+
+    def __init__(self, image):
+        self.source = as_decoded(image)
+        self.size = self.source.size
+        self._cache = {}
+        # 计算记录（调试用：同一个 key 只会出现一次）
+        self.computed = []
+
+    @classmethod
+    def of(cls, image):
+        """已经是 ImageContext 时原样返回，否则包装"""
+        if isinstance(image, ImageContext):
+            return image
+        return cls(image)
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    def _memo(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+            self.computed.append(key)
+        return self._cache[key]
+
+    @property
+    def image(self):
+        """PIL RGB 图片"""
+        return self.source.full()
+
+    @property
+    def rgb(self):
+        return self._memo('rgb', self.source.array)
+
+    @property
+    def gray(self):
+        return self._memo('gray', lambda: cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY))
+
+    @property
+    def hsv(self):
+        return self._memo('hsv', lambda: cv2.cvtColor(self.rgb, cv2.COLOR_RGB2HSV))
+
+    @property
+    def saturation(self):
+        return self.hsv[:, :, 1]
+
+    @property
+    def lab(self):
+        return self._memo('lab', lambda: cv2.cvtColor(self.rgb, cv2.COLOR_RGB2LAB))
+
+    def edges(self, low=30, high=100):
+        """Canny 边缘（按阈值缓存）"""
+        return self._memo(f'edges:{low}:{high}', lambda: cv2.Canny(self.gray, low, high))
+
+    def integral(self, name):
+        """积分图（float64，形状 (h+1, w+1)）
+
+        gray 返回 (sum, sqsum)，saturation / edges 返回 sum。
+        """
+        if name == 'gray':
+            return self._memo('integral:gray', lambda: cv2.integral2(self.gray, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F))
+        if name == 'saturation':
+            return self._memo('integral:saturation', lambda: cv2.integral(self.saturation, sdepth=cv2.CV_64F))
+        if name == 'edges':
+            return self._memo('integral:edges', lambda: cv2.integral((self.edges() > 0).astype(np.uint8), sdepth=cv2.CV_64F))
+        raise KeyError(name)
+
+    def downscaled(self, max_side):
+        """长边不超过 max_side 的子上下文（JPEG 未解码时直接按缩小尺寸解码）"""
+        if self.source.scale_for(max_side) >= 1.0:
+            return self
+        return self._memo(f'downscaled:{max_side}', lambda: ImageContext(DecodedImage.from_pil(self.source.reduced(max_side))))
+
+    def pyramid(self, level):
+        """金字塔第 level 层（每层长边减半）"""
+        return self.downscaled(max(1, max(self.size) >> level))
+
+    def scale_to(self, other):
+        """本上下文到另一上下文的坐标缩放比例"""
+        return other.width / self.width
@@ -0,0 +1,258 @@
+"""
+异步任务：提交后立即返回 job_id，客户端轮询状态或接收 webhook
+
+去水印、AI 换背景这类流程要几十秒，客户端一直挂着 HTTP 连接，断开就白做了。
+改为提交任务 → 后台执行 → 结果按 TTL 保存：
+- 状态：queued → processing → success / failed（与 functions/api/remove-bg/[id].ts 的轮询一致）
+- 提交时可带 webhook_url，任务结束后 POST 任务状态（含结果）
+  - 只接受 https；主机解析到私有 / 回环 / 链路本地等非公网地址时拒绝（防止借 webhook 访问内网）
+  - WEBHOOK_ALLOWED_HOSTS：逗号分隔的主机名白名单，设置后只回调这些主机
+  - WEBHOOK_SECRET：设置后请求带 X-FixPic-Timestamp 和
+    X-FixPic-Signature: sha256=HMAC-SHA256(secret, "<timestamp>.<body>")，接收方据此校验来源
+- 存储是类 dict 对象：默认进程内 dict；多进程（gunicorn）用 DirectoryBackend；
+  Modal 上用 modal.Dict，跨容器共享
+- JOB_TTL_SECONDS：结果保存时长，默认 3600
+"""
+
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+
+JOB_TTL = int(os.environ.get("JOB_TTL_SECONDS", "3600"))
+WEBHOOK_TIMEOUT = 10
+WEBHOOK_RETRIES = 3
+WEBHOOK_ALLOWED_HOSTS = {h.strip().lower() for h in os.environ.get("WEBHOOK_ALLOWED_HOSTS", "").split(",") if h.strip()}
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")
+
+# 返回给客户端的字段（webhook 地址等内部字段不返回）
+PUBLIC_FIELDS = ('id', 'kind', 'status', 'created_at', 'updated_at', 'expires_at', 'result', 'error', 'webhook_status')
+
+
+class DirectoryBackend:
+    """一个任务一个 JSON 文件（同一台机器上的多个 worker 进程共享）"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, f"{key}.json")
+
+    def get(self, key, default=None):
+        try:
+            with open(self._path(key)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return default
+
+    def __setitem__(self, key, value):
+        tmp = f"{self._path(key)}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, 'w') as f:
+            json.dump(value, f)
+        os.replace(tmp, self._path(key))  # 原子替换，读者不会看到写了一半的文件
+
+    def pop(self, key):
+        value = self.get(key)
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            raise KeyError(key)
+        return value
+
+    def keys(self):
+        return [name[:-5] for name in os.listdir(self.root) if name.endswith('.json')]
+
+    def expire(self, ttl):
+        """按文件修改时间删除过期任务（每次更新都会重写文件，无需读取内容）"""
+        cutoff = time.time() - ttl
+        expired = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+                    expired += name.endswith('.json')
+            except FileNotFoundError:
+                pass
+        return expired
+
+
+class JobStore:
+    """任务状态存储（带 TTL）"""
+
+    def __init__(self, backend=None, ttl=JOB_TTL):
+        self._data = {} if backend is None else backend
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def create(self, kind, webhook_url=None):
+        now = time.time()
+        job = {
+            'id': uuid.uuid4().hex,
+            'kind': kind,
+            'status': 'queued',
+            'created_at': now,
+            'updated_at': now,
+            'expires_at': now + self.ttl,
+            'webhook_url': webhook_url,
+        }
+        self._data[job['id']] = job
+        return job
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            job = self._data.get(job_id)
+            if job is None:
+                return None
+            now = time.time()
+            job.update(fields, updated_at=now, expires_at=now + self.ttl)
+            self._data[job_id] = job
+            return job
+
+    def _discard(self, job_id):
+        try:
+            self._data.pop(job_id)
+        except KeyError:
+            pass
+
+    def get(self, job_id):
+        """任务状态（已过期或不存在返回 None）"""
+        if not isinstance(job_id, str) or not job_id.isalnum():
+            return None  # job_id 来自客户端，只接受 uuid hex（也避免 DirectoryBackend 路径穿越）
+        job = self._data.get(job_id)
+        if job is None:
+            return None
+        if job['expires_at'] < time.time():
+            self._discard(job_id)
+            return None
+        return job
+
+    def purge(self):
+        """删除过期任务（modal.Dict 条目另有平台侧的过期清理）"""
+        if hasattr(self._data, 'expire'):
+            return self._data.expire(self.ttl)
+        now = time.time()
+        expired = 0
+        for job_id in list(self._data.keys()):
+            job = self._data.get(job_id)
+            if job is not None and job['expires_at'] < now:
+                self._discard(job_id)
+                expired += 1
+        return expired
+
+    @staticmethod
+    def public(job):
+        return {k: job[k] for k in PUBLIC_FIELDS if job.get(k) is not None}
+
+
+def _failed(result):
+    """接口约定：{'success': False, 'error': ...} 或只有 error 字段表示失败"""
+    return not isinstance(result, dict) or not result.get('success', 'error' not in result)
+
+
+def _public_address(address):
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if getattr(ip, 'ipv4_mapped', None) is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def validate_webhook_url(url, allowed_hosts=None):
+    """检查 webhook 地址，不可用时抛出 ValueError
+
+    主机解析出的所有地址都必须是公网地址；回调时会再检查一次（DNS 可能在提交后变化）。
+    """
+    allowed_hosts = WEBHOOK_ALLOWED_HOSTS if allowed_hosts is None else allowed_hosts
+    if not isinstance(url, str):
+        raise ValueError("webhook_url must be a string")
+    parts = urlsplit(url)
+    if parts.scheme != 'https':
+        raise ValueError("webhook_url must use https")
+    host = (parts.hostname or '').lower()
+    if not host:
+        raise ValueError("webhook_url has no host")
+    if allowed_hosts and host not in allowed_hosts:
+        raise ValueError(f"webhook host {host} is not allowed")
+    try:
+        port = parts.port or 443
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, ValueError) as e:
+        raise ValueError(f"webhook host {host} cannot be resolved: {e}")
+    if not addresses or not all(_public_address(a) for a in addresses):
+        raise ValueError(f"webhook host {host} resolves to a non-public address")
+    return url
+
+
+def sign_webhook(body, timestamp, secret=None):
+    """webhook 签名：HMAC-SHA256(secret, "<timestamp>.<body>")，未配置密钥时返回 None"""
+    secret = WEBHOOK_SECRET if secret is None else secret
+    if not secret:
+        return None
+    message = f"{timestamp}.".encode() + body
+    return 'sha256=' + hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def deliver_webhook(url, payload):
+    """POST 任务状态到 webhook（失败重试），返回 'delivered' 或错误描述"""
+    import requests
+
+    try:
+        validate_webhook_url(url)
+    except ValueError as e:
+        print(f"[jobs] webhook {url} rejected: {e}")
+        return f"rejected: {e}"
+
+    body = json.dumps(payload).encode()
+    timestamp = str(int(time.time()))
+    headers = {'Content-Type': 'application/json', 'X-FixPic-Timestamp': timestamp}
+    signature = sign_webhook(body, timestamp)
+    if signature:
+        headers['X-FixPic-Signature'] = signature
+
+    error = None
+    for attempt in range(WEBHOOK_RETRIES):
+        try:
+            # 不跟随重定向：重定向目标没有经过地址检查
+            response = requests.post(url, data=body, headers=headers, timeout=WEBHOOK_TIMEOUT, allow_redirects=False)
+            if response.status_code < 400:
+                return 'delivered'
+            error = f"HTTP {response.status_code}"
+        except Exception as e:
+            error = str(e)
+        if attempt < WEBHOOK_RETRIES - 1:
+            time.sleep(2 ** attempt)
+    print(f"[jobs] webhook {url} failed: {error}")
+    return f"failed: {error}"
+
+
+def run_job(store, job_id, fn, *args, **kwargs):
+    """执行任务并记录结果；fn 返回接口响应 dict，或 (响应 dict, HTTP 状态码)，状态码 >= 400 记为失败"""
+    store.update(job_id, status='processing')
+    start = time.time()
+    try:
+        result = fn(*args, **kwargs)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        job = store.update(job_id, status='failed', error=str(e))
+    else:
+        status = 200
+        if isinstance(result, tuple):
+            result, status = result
+        if status >= 400 or _failed(result):
+            error = result.get('error') if isinstance(result, dict) else None
+            job = store.update(job_id, status='failed', error=error or (f'HTTP {status}' if status >= 400 else 'failed'))
+        else:
+            job = store.update(job_id, status='success', result=result)
+    print(f"[jobs] {job_id} {job['status'] if job else 'expired'} in {time.time() - start:.2f}s")
+
+    if job is not None and job.get('webhook_url'):
+        store.update(job_id, webhook_status=deliver_webhook(job['webhook_url'], JobStore.public(job)))
+    return job
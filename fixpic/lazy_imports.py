@@ -0,0 +1,47 @@
+"""
+重量级依赖的延迟导入与导入耗时统计
+
+torch / transformers / segment_anything / rembg(onnxruntime) 单独导入就要数秒，
+只在第一次用到的接口（或预热）中导入，并记录每个模块的导入耗时，
+只提供轻量接口的进程启动时完全不加载它们。
+
+更细的逐模块分析可以用 `python -X importtime server.py`。
+"""
+
+import importlib
+import sys
+import threading
+import time
+
+_import_times = {}
+_lock = threading.Lock()
+
+
+def lazy_import(name):
+    """导入模块并记录首次导入耗时
+
+    总是经过 importlib.import_module：另一个线程正在导入时，sys.modules 里已有
+    只初始化了一半的模块，直接返回会拿到缺属性的模块；import_module 会等待模块锁。
+    """
+    loaded = name in sys.modules
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    if loaded:
+        return module
+
+    elapsed = time.perf_counter() - start
+    with _lock:
+        _import_times.setdefault(name, round(elapsed, 3))
+    print(f"[import] {name} imported in {elapsed:.2f}s")
+    return module
+
+
+def import_times():
+    """各延迟导入模块的首次导入耗时（秒）"""
+    with _lock:
+        return dict(_import_times)
+
+
+def heavy_modules_loaded(names=('torch', 'transformers', 'segment_anything', 'rembg', 'onnxruntime')):
+    """当前进程已加载的重量级模块"""
+    return [name for name in names if name in sys.modules]
@@ -0,0 +1,89 @@
+"""
+限制分辨率的抠图：在工作分辨率上预测 alpha，再用引导滤波上采样到原图尺寸
+"""
+
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# 工作分辨率（长边像素），0 表示关闭限制
+DEFAULT_MAX_SIDE = int(os.environ.get("MATTING_MAX_SIDE", "1024"))
+
+
+def guided_upsample_alpha(guide, alpha_low, radius=4, eps=1e-4):
+    """快速引导滤波：在低分辨率上求线性系数，上采样后作用于全分辨率引导图
+
+    guide: 全分辨率灰度图 (H, W)，float32，取值 0-1
+    alpha_low: 低分辨率 alpha (h, w)，float32，取值 0-1
+    radius: 低分辨率上的窗口半径
+    """
+    h, w = guide.shape[:2]
+    lh, lw = alpha_low.shape[:2]
+
+    guide_low = cv2.resize(guide, (lw, lh), interpolation=cv2.INTER_AREA)
+    ksize = (2 * radius + 1, 2 * radius + 1)
+
+    mean_i = cv2.boxFilter(guide_low, -1, ksize)
+    mean_p = cv2.boxFilter(alpha_low, -1, ksize)
+    corr_ii = cv2.boxFilter(guide_low * guide_low, -1, ksize)
+    corr_ip = cv2.boxFilter(guide_low * alpha_low, -1, ksize)
+
+    var_i = corr_ii - mean_i * mean_i
+    cov_ip = corr_ip - mean_i * mean_p
+
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+
+    mean_a = cv2.boxFilter(a, -1, ksize)
+    mean_b = cv2.boxFilter(b, -1, ksize)
+
+    # 只有系数需要上采样，边缘细节来自全分辨率引导图
+    mean_a = cv2.resize(mean_a, (w, h), interpolation=cv2.INTER_LINEAR)
+    mean_b = cv2.resize(mean_b, (w, h), interpolation=cv2.INTER_LINEAR)
+
+    return np.clip(mean_a * guide + mean_b, 0.0, 1.0)
+
+
+def predict_alpha_capped(image, predict_fn, max_side=None):
+    """在工作分辨率上调用 predict_fn 得到 RGBA，返回全分辨率 alpha (uint8)
+
+    predict_fn 接收 PIL 图片，返回带 alpha 的 PIL 图片（如 rembg.remove）。
+    """
+    if max_side is None:
+        max_side = DEFAULT_MAX_SIDE
+
+    w, h = image.size
+    rgb = image.convert('RGB')
+
+    if not max_side or max(w, h) <= max_side:
+        return np.array(predict_fn(rgb).convert('RGBA'))[:, :, 3]
+
+    scale = max_side / max(w, h)
+    small_size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    small = rgb.resize(small_size, Image.Resampling.LANCZOS)
+    print(f"Matting at {small_size[0]}x{small_size[1]} (original {w}x{h})")
+
+    alpha_small = np.array(predict_fn(small).convert('RGBA'))[:, :, 3]
+    alpha_small = alpha_small.astype(np.float32) / 255.0
+
+    guide = cv2.cvtColor(np.array(rgb), cv2.COLOR_RGB2GRAY).astype(np.float32) / 255.0
+    alpha = guided_upsample_alpha(guide, alpha_small)
+
+    return (alpha * 255.0 + 0.5).astype(np.uint8)
+
+
+def remove_background_capped(image, predict_fn, max_side=None):
+    """限制分辨率的去背景，返回与原图同尺寸的 RGBA 图片"""
+    if max_side is None:
+        max_side = DEFAULT_MAX_SIDE
+
+    # 小图直接走原流程
+    if not max_side or max(image.size) <= max_side:
+        return predict_fn(image)
+
+    alpha = predict_alpha_capped(image, predict_fn, max_side)
+    output = image.convert('RGBA')
+    output.putalpha(Image.fromarray(alpha, 'L'))
+    return output
@@ -0,0 +1,306 @@
+"""
+按显存 / 内存预算管理模型驻留
+
+各模型以加载函数注册，按需加载；显存占用超过预算时按最近最少使用（LRU）淘汰：
+- 提供了 move 的模型先卸载到 CPU（下次使用时搬回 GPU，比重新加载快得多）
+- 其余模型直接释放，下次使用时重新加载
+CPU 上的模型同样受内存预算约束，超出时释放最久未用的。
+
+正在使用（use() 上下文内）的模型不会被淘汰。
+
+并发访问（容器同时处理多个请求）：
+- 加载在各模型自己的锁内进行，同一模型只加载一次，也不会阻塞其他已加载模型的请求
+- 内部有可变状态、不能被多个线程同时调用的模型注册为 exclusive，use() 期间独占
+- SamPredictor 这类把图片状态保存在实例上的，用 PredictorPool：多个实例共享同一份权重
+
+- MODEL_GPU_BUDGET_MB：显存预算，默认为显卡总显存的 GPU_BUDGET_RATIO（给推理激活值留出余量）
+- MODEL_CPU_BUDGET_MB：内存预算，默认 8192；0 表示不限制
+- MODEL_EVICT_MODE：offload（默认，先卸载到 CPU）或 unload（直接释放）
+"""
+
+import gc
+import os
+import queue
+import threading
+import time
+from contextlib import contextmanager
+
+MB = 1 << 20
+GPU_BUDGET_RATIO = 0.6
+GPU_BUDGET_MB = int(os.environ.get("MODEL_GPU_BUDGET_MB", "0"))
+CPU_BUDGET_MB = int(os.environ.get("MODEL_CPU_BUDGET_MB", "8192"))
+EVICT_MODE = os.environ.get("MODEL_EVICT_MODE", "offload")
+
+
+def module_bytes(module):
+    """torch 模块参数 + buffer 占用的字节数"""
+    total = 0
+    for tensor in list(module.parameters()) + list(module.buffers()):
+        total += tensor.numel() * tensor.element_size()
+    return total
+
+
+def move_module(obj, device):
+    """模型本身是 torch 模块"""
+    obj.to(device)
+
+
+def move_attr(attr):
+    """搬移 obj.<attr>（如 SamPredictor.model）"""
+    def move(obj, device):
+        getattr(obj, attr).to(device)
+    return move
+
+
+def move_item(index):
+    """搬移 obj[index]（如 (processor, model) 中的 model）"""
+    def move(obj, device):
+        obj[index].to(device)
+    return move
+
+
+class PredictorPool:
+    """共享同一份权重、各自持有请求状态的 predictor 实例池
+
+    SamPredictor 把 set_image 计算的 embedding 保存在实例上，并发请求交错调用
+    set_image / predict 会用错图片；池中每个实例同一时间只借给一个请求。
+    """
+
+    def __init__(self, model, factory, size):
+        self.model = model
+        self.predictors = [factory(model) for _ in range(max(1, size))]
+        self._idle = queue.LifoQueue()
+        for predictor in self.predictors:
+            self._idle.put(predictor)
+
+    @property
+    def size(self):
+        return len(self.predictors)
+
+    @contextmanager
+    def acquire(self):
+        """借出一个空闲实例（全部在用时等待）"""
+        predictor = self._idle.get()
+        try:
+            yield predictor
+        finally:
+            self._idle.put(predictor)
+
+    def to(self, device):
+        """搬移共享的模型，并清空各实例缓存的图片特征"""
+        self.model.to(device)
+        for predictor in self.predictors:
+            predictor.reset_image()
+
+
+def _gpu_allocated():
+    import torch
+    return torch.cuda.memory_allocated() if torch.cuda.is_available() else 0
+
+
+def _default_gpu_budget():
+    import torch
+    if not torch.cuda.is_available():
+        return 0
+    return int(torch.cuda.get_device_properties(0).total_memory * GPU_BUDGET_RATIO)
+
+
+class ManagedModel:
+    """一个受管理的模型及其驻留状态"""
+
+    def __init__(self, name, loader, move=None, estimate_mb=0, exclusive=False):
+        self.name = name
+        self.loader = loader
+        self.move = move
+        self.estimate = int(estimate_mb * MB)
+        self.load_lock = threading.Lock()
+        self.lock = threading.Lock() if exclusive else None
+        self.obj = None
+        self.device = None
+        self.footprint = None
+        self.last_used = 0.0
+        self.refs = 0
+        self.loads = 0
+        self.reloads = 0
+        self.offloads = 0
+        self.evictions = 0
+
+    @property
+    def size(self):
+        """实测占用，加载前使用预估值"""
+        return self.footprint if self.footprint is not None else self.estimate
+
+    def summary(self):
+        return {
+            'resident': self.device,
+            'footprint_mb': round(self.size / MB, 1),
+            'measured': self.footprint is not None,
+            'in_use': self.refs,
+            'exclusive': self.lock is not None,
+            'loads': self.loads,
+            'reloads': self.reloads,
+            'offloads': self.offloads,
+            'evictions': self.evictions,
+            'last_used': self.last_used or None,
+        }
+
+
+class ModelManager:
+    """模型驻留管理器"""
+
+    def __init__(self, device, gpu_budget_mb=None, cpu_budget_mb=None, evict_mode=EVICT_MODE):
+        self.device = device
+        gpu_budget_mb = GPU_BUDGET_MB if gpu_budget_mb is None else gpu_budget_mb
+        cpu_budget_mb = CPU_BUDGET_MB if cpu_budget_mb is None else cpu_budget_mb
+        if device == 'cuda':
+            self.gpu_budget = gpu_budget_mb * MB if gpu_budget_mb else _default_gpu_budget()
+        else:
+            self.gpu_budget = 0
+        self.cpu_budget = cpu_budget_mb * MB
+        self.evict_mode = evict_mode
+        self._models = {}
+        self._lock = threading.RLock()
+
+    def register(self, name, loader, move=None, estimate_mb=0, exclusive=False):
+        """loader() 在 self.device 上加载并返回模型对象（失败返回 None）；
+        move(obj, device) 把已加载的模型搬到另一设备，不支持搬移的模型传 None；
+        exclusive 表示模型不能被多个线程同时调用，use() 期间独占"""
+        self._models[name] = ManagedModel(name, loader, move, estimate_mb, exclusive)
+
+    def _budget(self, device):
+        return self.gpu_budget if device == 'cuda' else self.cpu_budget
+
+    def _used(self, device):
+        return sum(m.size for m in self._models.values() if m.obj is not None and m.device == device)
+
+    def _release(self):
+        gc.collect()
+        if self.device == 'cuda':
+            import torch
+            torch.cuda.empty_cache()
+
+    def _make_room(self, device, needed, keep):
+        """按 LRU 淘汰 device 上的模型，直到放得下 needed 字节"""
+        budget = self._budget(device)
+        if not budget:
+            return
+        candidates = sorted(
+            (m for m in self._models.values()
+             if m.obj is not None and m.device == device and m is not keep and m.refs == 0),
+            key=lambda m: m.last_used,
+        )
+        for m in candidates:
+            if self._used(device) + needed <= budget:
+                return
+            self._evict(m)
+        if self._used(device) + needed > budget:
+            print(f"Model budget exceeded on {device}: "
+                  f"{(self._used(device) + needed) / MB:.0f}MB > {budget / MB:.0f}MB (models in use)")
+
+    def _evict(self, m):
+        if m.device == 'cuda' and self.evict_mode == 'offload' and m.move is not None:
+            self._make_room('cpu', m.size, keep=m)
+            m.move(m.obj, 'cpu')
+            m.device = 'cpu'
+            m.offloads += 1
+            print(f"Model {m.name} offloaded to CPU")
+        else:
+            m.obj = None
+            m.device = None
+            m.evictions += 1
+            print(f"Model {m.name} evicted")
+        self._release()
+
+    def _load(self, m):
+        """在模型自己的锁内调用（不持有管理器锁，加载期间其他模型照常服务）"""
+        before = _gpu_allocated() if self.device == 'cuda' else 0
+        obj = m.loader()
+        if obj is None:
+            return None
+
+        with self._lock:
+            m.obj = obj
+            m.device = self.device
+            m.loads += 1
+
+            # 实测占用：GPU 上取显存增量（并发时可能计入其他请求的激活值，仅作近似），
+            # CPU 上尽量统计 torch 模块
+            if self.device == 'cuda':
+                m.footprint = max(_gpu_allocated() - before, 0) or m.footprint
+            elif hasattr(obj, 'parameters'):
+                m.footprint = module_bytes(obj)
+        return obj
+
+    def _acquire(self, name, pin):
+        """取得模型（必要时加载或搬回 GPU），pin 时引用计数 + 1"""
+        m = self._models[name]
+        with self._lock:
+            m.last_used = time.time()
+            if m.obj is not None and m.device == self.device:
+                m.refs += int(pin)
+                return m.obj
+
+        # 同一模型的加载 / 搬回只由一个线程执行，其余线程等待后直接使用
+        with m.load_lock:
+            with self._lock:
+                if m.obj is not None and m.device == self.device:
+                    m.refs += int(pin)
+                    return m.obj
+
+                self._make_room(self.device, m.size, keep=m)
+                if m.obj is not None:
+                    m.move(m.obj, self.device)
+                    m.device = self.device
+                    m.reloads += 1
+                    m.refs += int(pin)
+                    print(f"Model {name} moved back to {self.device}")
+                    return m.obj
+
+            obj = self._load(m)
+            if obj is not None:
+                with self._lock:
+                    m.refs += int(pin)
+            return obj
+
+    def get(self, name):
+        """取得模型（必要时加载或搬回 GPU），更新最近使用时间；
+        并发场景下请用 use()，否则模型可能在使用中被淘汰"""
+        return self._acquire(name, pin=False)
+
+    @contextmanager
+    def use(self, name):
+        """使用期间固定在当前设备上，不会被淘汰；exclusive 模型同时独占"""
+        obj = self._acquire(name, pin=True)
+        m = self._models[name]
+        try:
+            if m.lock is None or obj is None:
+                yield obj
+            else:
+                with m.lock:
+                    yield obj
+        finally:
+            if obj is not None:
+                with self._lock:
+                    m.refs -= 1
+
+    def loaded(self, name):
+        m = self._models.get(name)
+        return m is not None and m.obj is not None
+
+    def evict(self, name):
+        """主动淘汰（卸载到 CPU 或释放）"""
+        with self._lock:
+            m = self._models[name]
+            if m.obj is not None and m.refs == 0:
+                self._evict(m)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'device': self.device,
+                'gpu_budget_mb': round(self.gpu_budget / MB),
+                'gpu_used_mb': round(self._used('cuda') / MB, 1),
+                'cpu_budget_mb': round(self.cpu_budget / MB),
+                'cpu_used_mb': round(self._used('cpu') / MB, 1),
+                'models': {name: m.summary() for name, m in self._models.items()},
+            }
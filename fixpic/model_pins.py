@@ -0,0 +1,22 @@
+"""
+模型权重的固定版本（由 python -m fixpic.model_registry --root ./models pin 根据锁文件生成）
+
+- revision：Hugging Face 仓库的 commit，同步时按该 commit 下载
+- sha256 / md5：下载文件的校验值，不一致时同步失败
+- files：目录模型（EasyOCR）各文件的 sha256
+
+未列出的模型不会被同步，require() 也拒绝使用。新增模型时在能联网的环境执行
+sync --allow-unpinned <名称>，再执行 pin 把锁文件中的值固定到这里并提交。
+"""
+
+PINS = {
+    # 文件名后缀 01ec64 是官方发布的 md5 前缀
+    'sam_vit_b': {
+        'sha256': 'ec2df62732614e57411cdcf32a23ffdf28910380d03139ee0f4fcbe91eb8c912',
+        'md5': '01ec64d29a2fca3f0661936605ae66f8',
+    },
+    # rembg 发布的校验值
+    'u2net': {
+        'md5': '60024c5c889badc19c04ad937298a77b',
+    },
+}
@@ -0,0 +1,508 @@
+"""
+模型权重清单与预同步
+
+所有模型权重在这里集中声明，由同步命令预先下载到模型目录（Modal Volume 或本地 models/），
+加载路径只读本地文件，不再在请求中下载：
+
+- 每个模型都要在 fixpic.model_pins 中固定：单文件的 sha256 / md5、Hugging Face 仓库的 commit、
+  EasyOCR 目录各文件的 sha256。同步时与固定值比对，不一致报错；require() 拒绝没有固定值
+  或锁文件与固定值不一致的模型，不会使用"首次下载到什么就信什么"的文件
+- 新增模型时在能联网的环境执行 sync --allow-unpinned <名称>（解析当前 commit、记录校验值到锁文件），
+  再执行 pin 把锁文件中的值写回 model_pins 并提交
+- pickle 格式的 state_dict（SAM、盲水印模型、只有 pytorch_model.bin 的 HF 仓库）
+  同步时转成 safetensors，加载时 mmap 零拷贝（见 fixpic.weights）
+- configure_offline() 打开 HF_HUB_OFFLINE，并把 LaMa / rembg 指向同步好的文件
+- status() 给出每个模型是否就绪
+
+同步：
+    modal run modal_app_v2.py::sync_models
+    python -m fixpic.model_registry --root ./models sync [名称 ...]
+    python -m fixpic.model_registry --root ./models status
+    python -m fixpic.model_registry --root ./models sync --allow-unpinned 名称
+    python -m fixpic.model_registry --root ./models pin
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+MODEL_ROOT = os.environ.get("FIXPIC_MODEL_DIR", "/models")
+LOCK_NAME = "models.lock.json"
+HASH_CHUNK = 1 << 20
+HF_KINDS = ('hf_file', 'hf_repo')
+
+
+class ModelNotAvailable(FileNotFoundError):
+    """模型尚未同步到模型目录"""
+
+
+class ModelNotPinned(ModelNotAvailable):
+    """模型没有固定的校验值 / commit，或已同步的文件与固定值不一致"""
+
+
+class Artifact:
+    """一个模型权重
+
+    kind:
+    - url：单个文件，直接下载
+    - hf_file：Hugging Face 仓库中的单个文件
+    - hf_repo：整个 Hugging Face 仓库（from_pretrained 使用的目录）
+    - easyocr：EasyOCR 检测 + 识别模型目录
+    sha256 / md5 为固定的校验值（url / hf_file），revision 为固定的 Hugging Face commit，
+    files 为目录模型各文件的 sha256（easyocr），均由 fixpic.model_pins 填入。
+    safetensors=True 表示单文件 state_dict，同步时额外生成同名 .safetensors 供 mmap 加载。
+    """
+
+    def __init__(self, name, kind, source, path, filename=None, revision=None, sha256=None,
+                 md5=None, files=None, safetensors=False, used_by=()):
+        self.name = name
+        self.kind = kind
+        self.source = source
+        self.path = path
+        self.filename = filename
+        self.revision = revision
+        self.sha256 = sha256
+        self.md5 = md5
+        self.files = files
+        self.safetensors = safetensors
+        self.used_by = tuple(used_by)
+
+    @property
+    def is_dir(self):
+        return self.kind in ('hf_repo', 'easyocr')
+
+    @property
+    def pinned(self):
+        """是否有足以校验内容的固定值"""
+        if self.kind == 'hf_repo':
+            return bool(self.revision)
+        if self.kind == 'easyocr':
+            return bool(self.files)
+        return bool(self.sha256 or self.md5)
+
+
+ARTIFACTS = {a.name: a for a in [
+    Artifact('sam_vit_b', 'url',
+             'https://dl.fbaipublicfiles.com/segment_anything/sam_vit_b_01ec64.pth',
+             'sam_vit_b.pth', safetensors=True, used_by=('sam_segment',)),
+    Artifact('segformer_clothes', 'hf_repo', 'mattmdjaga/segformer_b2_clothes',
+             'hf/segformer_b2_clothes', used_by=('clothes_parse', 'clothes_segment')),
+    Artifact('florence2_base', 'hf_repo', 'microsoft/Florence-2-base',
+             'hf/florence2_base', used_by=('watermark_florence',)),
+    Artifact('clip_vit_b32', 'hf_repo', 'openai/clip-vit-base-patch32',
+             'hf/clip_vit_b32', used_by=('change_bg_ai',)),
+    Artifact('yolo_watermark', 'hf_file', 'mnemic/watermarks_yolov8',
+             'yolo', filename='watermarks_yolov8s.pt', used_by=('watermark_yolo',)),
+    Artifact('blind_watermark', 'hf_file', 'foduucom/Watermark_Removal',
+             'blind', filename='watermark_remover.pth', safetensors=True,
+             used_by=('auto_remove_watermark',)),
+    Artifact('lama', 'url',
+             'https://github.com/enesmsahin/simple-lama-inpainting/releases/download/v0.1.0/big-lama.pt',
+             'lama/big-lama.pt', used_by=('inpaint',)),
+    Artifact('u2net', 'url',
+             'https://github.com/danielgatis/rembg/releases/download/v0.0.0/u2net.onnx',
+             'u2net/u2net.onnx', used_by=('remove_bg', 'change_bg')),
+    Artifact('easyocr', 'easyocr', ['en', 'ch_sim'], 'easyocr', used_by=('watermark_ocr',)),
+]}
+
+
+def _apply_pins(artifacts, pins):
+    for name, pin in pins.items():
+        artifact = artifacts.get(name)
+        if artifact is None:
+            print(f"Pinned model {name} is not declared")
+            continue
+        artifact.revision = pin.get('revision', artifact.revision)
+        artifact.sha256 = pin.get('sha256', artifact.sha256)
+        artifact.md5 = pin.get('md5', artifact.md5)
+        artifact.files = pin.get('files', artifact.files)
+
+
+def _load_pins():
+    from fixpic.model_pins import PINS
+    return PINS
+
+
+_apply_pins(ARTIFACTS, _load_pins())
+
+
+def sha256_of(path, algorithm='sha256'):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ModelRegistry:
+    """模型目录 + 锁文件"""
+
+    def __init__(self, root=MODEL_ROOT, artifacts=None):
+        self.root = root
+        self.artifacts = artifacts or ARTIFACTS
+        self.lock_path = os.path.join(root, LOCK_NAME)
+        self._lock = threading.Lock()
+        self.lock = self._read_lock()
+
+    def _read_lock(self):
+        if not os.path.exists(self.lock_path):
+            return {}
+        try:
+            with open(self.lock_path) as f:
+                return json.load(f).get('artifacts', {})
+        except Exception as e:
+            print(f"Failed to read model lockfile: {e}")
+            return {}
+
+    def _write_lock(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.lock_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'updated': time.time(), 'artifacts': self.lock}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.lock_path)
+
+    def path(self, name):
+        """模型在模型目录中的路径（单文件模型为文件路径，其余为目录）"""
+        artifact = self.artifacts[name]
+        if artifact.kind == 'hf_file':
+            return os.path.join(self.root, artifact.path, artifact.filename)
+        return os.path.join(self.root, artifact.path)
+
+    def weights(self, name):
+        """加载用的权重文件：已转换时为 .safetensors，否则为原始检查点"""
+        path = self.path(name)
+        if self.artifacts[name].safetensors:
+            converted = os.path.splitext(path)[0] + '.safetensors'
+            if os.path.exists(converted):
+                return converted
+        return path
+
+    def synced(self, name):
+        """文件存在且锁文件中有记录"""
+        return name in self.lock and os.path.exists(self.path(name))
+
+    def _pin_error(self, name):
+        """锁文件记录与固定值不一致（或没有固定值）时返回原因，否则返回 None"""
+        artifact = self.artifacts[name]
+        if not artifact.pinned:
+            return (f"Model '{name}' has no pin in fixpic.model_pins; "
+                    f"run 'sync --allow-unpinned {name}' and 'pin' where the network is available")
+        entry = self.lock.get(name, {})
+        for key in ('revision', 'sha256', 'md5'):
+            expected = getattr(artifact, key)
+            if expected and entry.get(key) != expected:
+                return f"Model '{name}' was synced with {key}={entry.get(key)}, pinned {expected}; run 'sync --force {name}'"
+        for rel, digest in (artifact.files or {}).items():
+            if entry.get('files', {}).get(rel) != digest:
+                return f"Model '{name}' file {rel} does not match its pin; run 'sync --force {name}'"
+        return None
+
+    def ready(self, name):
+        """已同步且与固定值一致"""
+        return self.synced(name) and self._pin_error(name) is None
+
+    def require(self, name):
+        """返回本地路径；未同步时抛出 ModelNotAvailable，没有固定值或与固定值不一致时抛出
+        ModelNotPinned，不会尝试下载"""
+        if not self.synced(name):
+            raise ModelNotAvailable(f"Model '{name}' is not synced to {self.root}; run the model sync first")
+        error = self._pin_error(name)
+        if error:
+            raise ModelNotPinned(error)
+        return self.path(name)
+
+    def status(self):
+        """每个模型的就绪状态"""
+        result = {}
+        for name, artifact in self.artifacts.items():
+            entry = self.lock.get(name, {})
+            result[name] = {
+                'ready': self.ready(name),
+                'pinned': artifact.pinned,
+                'size': entry.get('size'),
+                'synced_at': entry.get('synced_at'),
+                'used_by': list(artifact.used_by),
+            }
+        return result
+
+    def configure_offline(self):
+        """加载前调用：禁止 Hugging Face 联网，LaMa / rembg 使用同步好的文件"""
+        os.environ['HF_HUB_OFFLINE'] = '1'
+        os.environ['TRANSFORMERS_OFFLINE'] = '1'
+        if self.ready('lama'):
+            os.environ['LAMA_MODEL'] = self.path('lama')
+        if self.ready('u2net'):
+            os.environ['U2NET_HOME'] = os.path.dirname(self.path('u2net'))
+
+    # ---- 同步 ----
+
+    def _revision(self, name, artifact):
+        """Hugging Face 模型下载用的 commit：固定值 > 锁文件 > 解析当前 commit（仅 --allow-unpinned）"""
+        if artifact.kind not in HF_KINDS:
+            return None
+        revision = artifact.revision or self.lock.get(name, {}).get('revision')
+        if revision is None:
+            from huggingface_hub import HfApi
+            revision = HfApi().model_info(artifact.source).sha
+            print(f"Model {name} is not pinned, using {artifact.source}@{revision}")
+        return revision
+
+    def _download(self, artifact, target, revision=None):
+        if artifact.kind == 'url':
+            import urllib.request
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            part = target + '.part'
+            urllib.request.urlretrieve(artifact.source, part)
+            os.replace(part, target)
+        elif artifact.kind == 'hf_file':
+            from huggingface_hub import hf_hub_download
+            hf_hub_download(
+                repo_id=artifact.source,
+                filename=artifact.filename,
+                revision=revision,
+                local_dir=os.path.dirname(target),
+            )
+        elif artifact.kind == 'hf_repo':
+            from huggingface_hub import snapshot_download
+            snapshot_download(repo_id=artifact.source, revision=revision, local_dir=target)
+        elif artifact.kind == 'easyocr':
+            import easyocr
+            os.makedirs(target, exist_ok=True)
+            easyocr.Reader(
+                artifact.source,
+                gpu=False,
+                model_storage_directory=target,
+                user_network_directory=target,
+                download_enabled=True,
+            )
+        else:
+            raise ValueError(f"Unknown artifact kind: {artifact.kind}")
+
+    @staticmethod
+    def _conversion(artifact, target):
+        """(原始检查点, 转换后的 safetensors)，不需要转换时返回 None"""
+        if artifact.safetensors:
+            return target, os.path.splitext(target)[0] + '.safetensors'
+        if artifact.kind == 'hf_repo':
+            # transformers 优先读取 model.safetensors；分片的 .bin 保持原样
+            source = os.path.join(target, 'pytorch_model.bin')
+            if os.path.exists(source):
+                return source, os.path.join(target, 'model.safetensors')
+        return None
+
+    def _convert(self, artifact, target):
+        """pickle 权重转 safetensors，返回是否新生成了文件"""
+        from fixpic.weights import to_safetensors
+
+        conversion = self._conversion(artifact, target)
+        if conversion is None or os.path.exists(conversion[1]):
+            return False
+        print(f"Converting {artifact.name} to safetensors...")
+        to_safetensors(*conversion)
+        return True
+
+    def _artifact_checksums(self, artifact, target):
+        checksums = self._checksums(target, artifact.is_dir)
+        if artifact.safetensors:
+            converted = self._conversion(artifact, target)[1]
+            if os.path.exists(converted):
+                checksums['safetensors_sha256'] = sha256_of(converted)
+        return checksums
+
+    @staticmethod
+    def _checksums(target, is_dir):
+        if not is_dir:
+            return {'sha256': sha256_of(target), 'size': os.path.getsize(target)}
+        files, size = {}, 0
+        for base, dirs, names in os.walk(target):
+            # huggingface_hub 的本地缓存元数据不参与校验
+            dirs[:] = [d for d in dirs if d != '.cache']
+            for n in sorted(names):
+                path = os.path.join(base, n)
+                files[os.path.relpath(path, target)] = sha256_of(path)
+                size += os.path.getsize(path)
+        return {'files': files, 'size': size}
+
+    def _check_pinned(self, name, artifact, target, checksums):
+        """与 model_pins 中固定的校验值比对，md5 校验通过时记入 checksums"""
+        if artifact.sha256:
+            self._check(name, {'sha256': artifact.sha256}, checksums)
+        if artifact.files:
+            self._check(name, {'files': artifact.files}, checksums)
+        if artifact.md5 and not artifact.is_dir:
+            md5 = sha256_of(target, 'md5')
+            if md5 != artifact.md5:
+                raise ValueError(f"Checksum mismatch for {name} (md5): {md5} != {artifact.md5}")
+            checksums['md5'] = md5
+
+    def _check(self, name, expected, actual):
+        for key in ('sha256', 'safetensors_sha256'):
+            if expected.get(key) and expected[key] != actual.get(key):
+                raise ValueError(f"Checksum mismatch for {name} ({key}): {actual.get(key)} != {expected[key]}")
+        for rel, digest in expected.get('files', {}).items():
+            if actual.get('files', {}).get(rel) != digest:
+                raise ValueError(f"Checksum mismatch for {name}/{rel}")
+
+    def sync(self, names=None, force=False, allow_unpinned=False):
+        """下载缺失的模型并写入锁文件，返回本次同步的模型名
+
+        没有固定值的模型默认跳过（报错日志）；allow_unpinned=True 时照常下载，
+        之后用 pin 把锁文件中的值固定下来。
+        """
+        names = names or list(self.artifacts)
+        synced = []
+        with self._lock:
+            for name in names:
+                artifact = self.artifacts[name]
+                target = self.path(name)
+                if not artifact.pinned and not allow_unpinned:
+                    print(f"ERROR: {self._pin_error(name)}")
+                    continue
+                if os.path.exists(target) and name in self.lock and not force:
+                    # 早于 safetensors 转换同步的模型只补做转换；锁文件与固定值不一致时重新校验文件
+                    converted = self._convert(artifact, target)
+                    if converted or self._pin_error(name):
+                        checksums = self._artifact_checksums(artifact, target)
+                        self._check_pinned(name, artifact, target, checksums)
+                        self.lock[name].update(checksums)
+                        self._write_lock()
+                        synced.append(name)
+                    continue
+
+                start = time.time()
+                revision = self._revision(name, artifact)
+                print(f"Syncing model {name} from {artifact.source}" + (f"@{revision}" if revision else "") + "...")
+                if force and os.path.exists(target):
+                    if artifact.is_dir:
+                        shutil.rmtree(target)
+                    else:
+                        os.remove(target)
+                        converted = self._conversion(artifact, target)
+                        if converted and os.path.exists(converted[1]):
+                            os.remove(converted[1])
+                if not os.path.exists(target):
+                    self._download(artifact, target, revision)
+
+                # 目录模型的校验值包含转换出的文件，需先转换
+                self._convert(artifact, target)
+                checksums = self._artifact_checksums(artifact, target)
+                self._check_pinned(name, artifact, target, checksums)
+                # 固定的 commit 变了（更新 pin 后 --force）时以新下载的文件为准
+                if name in self.lock and self.lock[name].get('revision') == revision:
+                    self._check(name, self.lock[name], checksums)
+
+                self.lock[name] = {
+                    'source': artifact.source,
+                    'revision': revision,
+                    'synced_at': time.time(),
+                    **checksums,
+                }
+                self._write_lock()
+                synced.append(name)
+                print(f"Model {name} synced in {time.time() - start:.1f}s")
+        return synced
+
+    def verify(self, names=None):
+        """按锁文件与固定值重新计算校验值，返回 {名称: 是否一致}"""
+        result = {}
+        for name in names or list(self.artifacts):
+            if not self.synced(name):
+                result[name] = False
+                continue
+            try:
+                artifact = self.artifacts[name]
+                checksums = self._artifact_checksums(artifact, self.path(name))
+                self._check_pinned(name, artifact, self.path(name), checksums)
+                self._check(name, self.lock[name], checksums)
+                result[name] = True
+            except ValueError as e:
+                print(e)
+                result[name] = False
+        return result
+
+    def pins(self):
+        """由锁文件生成固定版本：Hugging Face 模型的 commit、单文件模型的 sha256、
+        EasyOCR 各文件的 sha256（保留已有的 md5）"""
+        pins = {}
+        for name, artifact in self.artifacts.items():
+            entry = self.lock.get(name, {})
+            pin = {}
+            revision = entry.get('revision') or artifact.revision
+            if revision:
+                pin['revision'] = revision
+            sha256 = entry.get('sha256') or artifact.sha256
+            if sha256:
+                pin['sha256'] = sha256
+            if artifact.md5:
+                pin['md5'] = artifact.md5
+            files = entry.get('files') or artifact.files
+            if artifact.kind == 'easyocr' and files:
+                pin['files'] = files
+            if pin:
+                pins[name] = pin
+        return pins
+
+
+def write_pins(pins, path=None):
+    """把固定版本写回 fixpic/model_pins.py（保留文件头的说明）"""
+    import pprint
+
+    path = path or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_pins.py')
+    with open(path) as f:
+        header = f.read().split('PINS = ', 1)[0]
+    with open(path, 'w') as f:
+        f.write(header + 'PINS = ' + pprint.pformat(pins, indent=4, sort_dicts=True) + '\n')
+    return path
+
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def get_model_registry(root=MODEL_ROOT):
+    """按模型目录缓存的注册表"""
+    with _registries_lock:
+        if root not in _registries:
+            _registries[root] = ModelRegistry(root)
+        return _registries[root]
+
+
+def main(argv=None):
+    import argparse
+
+    parser = argparse.ArgumentParser(description="FixPic 模型权重同步")
+    parser.add_argument('--root', default=MODEL_ROOT, help="模型目录")
+    sub = parser.add_subparsers(dest='command', required=True)
+    sync_parser = sub.add_parser('sync', help="下载缺失的模型并写入锁文件")
+    sync_parser.add_argument('names', nargs='*')
+    sync_parser.add_argument('--force', action='store_true', help="重新下载并与锁文件比对")
+    sync_parser.add_argument('--allow-unpinned', action='store_true', help="下载没有固定值的模型（之后执行 pin）")
+    sub.add_parser('status', help="各模型就绪状态")
+    verify_parser = sub.add_parser('verify', help="按锁文件校验")
+    verify_parser.add_argument('names', nargs='*')
+    sub.add_parser('pin', help="把锁文件中的 commit / 校验值写入 fixpic/model_pins.py")
+    args = parser.parse_args(argv)
+
+    registry = ModelRegistry(args.root)
+    if args.command == 'sync':
+        registry.sync(args.names or None, force=args.force, allow_unpinned=args.allow_unpinned)
+        status = registry.status()
+        print(json.dumps(status, indent=2))
+        return 0 if all(status[name]['ready'] for name in args.names or status) else 1
+    elif args.command == 'status':
+        print(json.dumps(registry.status(), indent=2))
+    elif args.command == 'verify':
+        result = registry.verify(args.names or None)
+        print(json.dumps(result, indent=2))
+        return 0 if all(result.values()) else 1
+    elif args.command == 'pin':
+        pins = registry.pins()
+        print(f"Pinned {len(pins)} models in {write_pins(pins)}")
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
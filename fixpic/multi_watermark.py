@@ -0,0 +1,287 @@
+"""
+同源批量图片的水印联合估计与去除
+
+同一图库的一批预览图，水印（半透明、位置固定）完全相同，而画面内容各不相同。
+参考 "On the Effectiveness of Visible Watermarks"（Dekel 等，CVPR 2017）的思路：
+
+1. 按尺寸分组，每组至少 MIN_GROUP 张
+2. 水印区域：各图梯度的逐像素中位数足够强，且大多数图片在该点的梯度方向一致
+   （画面内容的梯度方向各不相同，水印边缘在每张图上方向都相同），闭运算连成笔画后填充内部
+3. 每张图的水印区域由周围修补得到背景估计 B；水印颜色 c 在白 / 黑中取拟合残差小的，
+   alpha = (J - B) / (c - B) 取各图逐像素中位数，单张修补误差互相抵消
+4. 置信度检查：反解后的图应比原图更接近背景估计，整体改善不足则放弃（由调用方逐张处理）；
+   个别图片不含该水印（同尺寸但来源不同）则剔除后重新估计
+5. 每张图按 J = alpha * c + (1 - alpha) * I 逐像素反解 I，
+   只有 alpha 过高或像素已饱和（信息丢失）的残留才用 inpaint 修补
+
+整批只做一次估计，单张图的开销只是几次数组运算。
+"""
+
+import cv2
+import numpy as np
+
+MIN_GROUP = 3
+# 中位数梯度强度下限（Sobel 3x3，约相当于 15 个灰度级的边缘）
+GRADIENT_MIN = 60.0
+# 梯度方向一致的图片比例下限；小批量时画面内容偶然一致的概率高，至少要 MIN_CONSISTENT 张
+CONSISTENCY = 0.5
+MIN_CONSISTENT = 4
+# 水印区域面积上限（超过视为没有公共水印）
+MAX_REGION_RATIO = 0.15
+MIN_COMPONENT_RATIO = 0.0002
+ALPHA_MAX = 0.95
+# 区域内 alpha 中位数低于该值视为没有可去除的水印
+MIN_ALPHA = 0.08
+# alpha 超过该值时反解噪声过大，改用 inpaint
+SATURATED_ALPHA = 0.85
+# |c - B| 小于该值的通道不参与 alpha 估计
+MIN_CONTRAST = 20.0
+# 反解后与背景估计的差 / 原图与背景估计的差（各图中位数），超过该值视为估计不可信
+MAX_RESIDUAL_RATIO = 0.6
+# 单张图的水印强度低于该值（见 _watermark_scales），或反解后离背景估计更远，视为不含该水印
+MIN_SCALE = 0.5
+CHUNK_ROWS = 256
+COLORS = (255.0, 0.0)
+
+
+def group_by_size(images):
+    """按尺寸分组，返回 {(w, h): [索引, ...]}"""
+    groups = {}
+    for i, image in enumerate(images):
+        groups.setdefault(image.size, []).append(i)
+    return groups
+
+
+def _median_stack(arrays):
+    """逐像素中位数（按行分块，避免一次性生成 N 倍大小的临时数组）"""
+    h = arrays[0].shape[0]
+    out = np.empty(arrays[0].shape, dtype=np.float32)
+    for y in range(0, h, CHUNK_ROWS):
+        chunk = np.stack([a[y:y + CHUNK_ROWS] for a in arrays])
+        out[y:y + CHUNK_ROWS] = np.median(chunk, axis=0)
+    return out
+
+
+def _watermark_region(grays):
+    """梯度强且方向一致的像素构成水印区域（uint8 0/255），没有明显公共结构时返回 None"""
+    gxs = [cv2.Sobel(g, cv2.CV_32F, 1, 0, ksize=3) for g in grays]
+    gys = [cv2.Sobel(g, cv2.CV_32F, 0, 1, ksize=3) for g in grays]
+    gx = _median_stack(gxs)
+    gy = _median_stack(gys)
+    magnitude = cv2.magnitude(gx, gy)
+
+    # 各图梯度在中位数方向上的投影至少达到一半强度，才算方向一致
+    ux = gx / np.maximum(magnitude, 1e-6)
+    uy = gy / np.maximum(magnitude, 1e-6)
+    aligned = np.zeros(magnitude.shape, dtype=np.int32)
+    for gxk, gyk in zip(gxs, gys):
+        aligned += (gxk * ux + gyk * uy) > 0.5 * magnitude
+    need = max(min(len(grays), MIN_CONSISTENT), int(np.ceil(CONSISTENCY * len(grays))))
+    edges = ((magnitude > GRADIENT_MIN) & (aligned >= need)).astype(np.uint8) * 255
+
+    # 闭运算把笔画两侧的边缘连成块，再去掉零散小点
+    region = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, np.ones((7, 7), np.uint8))
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(region, connectivity=8)
+    min_area = region.size * MIN_COMPONENT_RATIO
+    keep = stats[:, cv2.CC_STAT_AREA] >= min_area
+    keep[0] = False
+    region = keep[labels].astype(np.uint8) * 255
+
+    # 梯度只在笔画边缘，填上被轮廓包围的笔画内部
+    outside = np.zeros((region.shape[0] + 2, region.shape[1] + 2), dtype=np.uint8)
+    filled = region.copy()
+    cv2.floodFill(filled, outside, (0, 0), 255)
+    region = region | cv2.bitwise_not(filled)
+    region = cv2.dilate(region, np.ones((3, 3), np.uint8), iterations=1)
+
+    ratio = np.count_nonzero(region) / region.size
+    if ratio == 0 or ratio > MAX_REGION_RATIO:
+        return None
+    return region
+
+
+def _alpha_for(color, rgbs, backgrounds, inside):
+    """给定水印颜色，逐像素 alpha = (J - B) / (c - B)（按通道对比度加权）取各图中位数"""
+    alphas = []
+    for rgb, background in zip(rgbs, backgrounds):
+        diff = rgb[inside] - background[inside]
+        contrast = color - background[inside]
+        weight = np.where(np.abs(contrast) > MIN_CONTRAST, np.abs(contrast), 0.0)
+        safe = np.where(weight > 0, contrast, 1.0)
+        weight_sum = weight.sum(axis=1)
+        alpha_k = (diff / safe * weight).sum(axis=1) / np.maximum(weight_sum, 1e-6)
+        # 没有可用通道的像素记为 NaN，不参与中位数
+        alphas.append(np.where(weight_sum > 0, alpha_k, np.nan))
+    return np.clip(np.nan_to_num(np.nanmedian(np.stack(alphas), axis=0)), 0.0, ALPHA_MAX)
+
+
+def _residual_ratios(alpha, color, rgbs, backgrounds, inside):
+    """每张图：|反解结果 - B| / |J - B|（区域内平均），越小说明水印解释得越好"""
+    a = alpha[:, None]
+    ratios = []
+    for rgb, background in zip(rgbs, backgrounds):
+        j = rgb[inside]
+        b = background[inside]
+        restored = np.clip((j - a * color) / (1.0 - a), 0, 255)
+        before = np.abs(j - b).mean()
+        ratios.append(np.abs(restored - b).mean() / max(before, 1e-6))
+    return np.array(ratios)
+
+
+def _watermark_scales(alpha, color, rgbs, backgrounds, inside):
+    """每张图中水印的强度：J - B 在 alpha * (c - B) 上的最小二乘系数，
+    带该水印的图约为 1，不含的约为 0；背景接近水印颜色、无法判断的记为 NaN"""
+    a = alpha[:, None]
+    scales = []
+    for rgb, background in zip(rgbs, backgrounds):
+        b = background[inside]
+        expected = a * (color - b)
+        energy = float((expected ** 2).sum())
+        if energy < (MIN_CONTRAST * MIN_ALPHA) ** 2 * expected.size:
+            scales.append(np.nan)
+            continue
+        scales.append(float(((rgb[inside] - b) * expected).sum()) / energy)
+    return np.array(scales)
+
+
+class WatermarkEstimate:
+    """一组图片共享的水印：区域、alpha matte、颜色，以及参与估计的图片"""
+
+    def __init__(self, region, alpha, color, members=None, confidence=None):
+        self.region = region
+        self.alpha = alpha
+        self.color = color
+        self.members = members
+        self.confidence = confidence
+
+    @classmethod
+    def estimate(cls, images):
+        """从同尺寸的一组 PIL 图片估计水印，估计失败或不可信返回 None；
+        members 为确实带有该水印的图片下标"""
+        if len(images) < MIN_GROUP:
+            return None
+
+        rgbs = [np.asarray(im.convert('RGB')) for im in images]
+        members = list(range(len(images)))
+        for attempt in range(2):
+            # 重新估计时沿用第一次的区域（剔除的图片只会削弱区域检测）
+            region = None if attempt == 0 else estimate.region
+            estimate = cls._estimate([rgbs[i] for i in members], region)
+            if estimate is None:
+                return None
+            kept = [members[i] for i in estimate.members]
+            if len(kept) < MIN_GROUP:
+                return None
+            # 剔除不含该水印的图片后重新估计一次
+            done = len(kept) == len(members) or attempt > 0
+            members = kept
+            if done:
+                break
+        estimate.members = members
+        return estimate
+
+    @classmethod
+    def _estimate(cls, rgbs, region=None):
+        if region is None:
+            region = _watermark_region([cv2.cvtColor(a, cv2.COLOR_RGB2GRAY) for a in rgbs])
+            if region is None:
+                return None
+
+        # 每张图把水印区域从周围修补出来作为该图的背景估计；单张修补误差较大，
+        # 但逐像素 alpha 取各图中位数后误差互相抵消
+        inside = region > 0
+        backgrounds = [cv2.inpaint(a, region, 5, cv2.INPAINT_TELEA).astype(np.float32) for a in rgbs]
+        rgbs = [a.astype(np.float32) for a in rgbs]
+
+        # 水印颜色取白 / 黑中反解残差更小的
+        best = None
+        for value in COLORS:
+            color = np.full(3, value, dtype=np.float32)
+            alpha_in = _alpha_for(color, rgbs, backgrounds, inside)
+            ratios = _residual_ratios(alpha_in, color, rgbs, backgrounds, inside)
+            if best is None or np.median(ratios) < np.median(best[2]):
+                best = (color, alpha_in, ratios)
+        color, alpha_in, ratios = best
+
+        # 画面内容偶然一致的连通块估出的 alpha 接近 0，去掉后只保留真正的水印
+        count, labels = cv2.connectedComponents(region)
+        alpha_sum = np.bincount(labels[inside], weights=alpha_in, minlength=count)
+        pixels = np.bincount(labels[inside], minlength=count)
+        keep = alpha_sum >= MIN_ALPHA * np.maximum(pixels, 1)
+        keep[0] = False
+        if not keep.any():
+            print("Shared watermark estimate rejected: no component with visible alpha")
+            return None
+        kept = keep[labels[inside]]
+        if not kept.all():
+            region = keep[labels].astype(np.uint8) * 255
+            inside = region > 0
+            alpha_in = alpha_in[kept]
+            ratios = _residual_ratios(alpha_in, color, rgbs, backgrounds, inside)
+
+        # 置信度只看带该水印的图片，混入的其他来源图片另行剔除
+        scales = _watermark_scales(alpha_in, color, rgbs, backgrounds, inside)
+        members = [i for i, (scale, ratio) in enumerate(zip(scales, ratios))
+                   if not scale < MIN_SCALE and ratio < 1.0]
+        confidence = float(np.median(ratios[members])) if members else np.inf
+        if np.median(alpha_in) < MIN_ALPHA or confidence > MAX_RESIDUAL_RATIO:
+            print(f"Shared watermark estimate rejected: median alpha {np.median(alpha_in):.3f}, "
+                  f"residual ratio {confidence:.2f}")
+            return None
+
+        alpha = np.zeros(region.shape, dtype=np.float32)
+        alpha[inside] = alpha_in
+        alpha = cv2.GaussianBlur(alpha, (3, 3), 0)
+        return cls(region, alpha, color, members, round(confidence, 3))
+
+    def remove(self, image):
+        """逐像素反解去除水印，返回 (PIL 图片, info)"""
+        from PIL import Image
+
+        rgb = np.asarray(image.convert('RGB')).astype(np.float32)
+        alpha = self.alpha[:, :, None]
+
+        restored = (rgb - alpha * self.color) / (1.0 - alpha)
+
+        # 残留：alpha 过高，或像素已经饱和到水印颜色（原值不可恢复）
+        saturated = np.all(np.abs(rgb - self.color) < 2, axis=2) & (self.alpha > 0.05)
+        residue = ((self.alpha > SATURATED_ALPHA) | saturated).astype(np.uint8) * 255
+
+        restored = np.clip(restored, 0, 255).astype(np.uint8)
+        residue_pixels = int(np.count_nonzero(residue))
+        if residue_pixels:
+            residue = cv2.dilate(residue, np.ones((3, 3), np.uint8), iterations=1)
+            restored = cv2.inpaint(restored, residue, 3, cv2.INPAINT_TELEA)
+
+        info = {
+            'watermark_pixels': int(np.count_nonzero(self.region)),
+            'residue_pixels': residue_pixels,
+            'confidence': self.confidence,
+        }
+        return Image.fromarray(restored), info
+
+
+def remove_batch_watermarks(images):
+    """批量去除同源水印
+
+    返回与 images 对齐的列表，元素为 (PIL 图片, info)；
+    所在尺寸组不足 MIN_GROUP 张、估计不可信或该图不含组内公共水印的为 (None, info)，由调用方逐张处理。
+    """
+    results = [(None, {'method': 'single'}) for _ in images]
+    for size, indices in group_by_size(images).items():
+        if len(indices) < MIN_GROUP:
+            continue
+
+        estimate = WatermarkEstimate.estimate([images[i] for i in indices])
+        if estimate is None:
+            print(f"No shared watermark found for {len(indices)} images of {size}")
+            continue
+
+        members = [indices[k] for k in estimate.members]
+        coverage = 100 * np.count_nonzero(estimate.region) / estimate.region.size
+        print(f"Shared watermark for {len(members)}/{len(indices)} images of {size}: coverage {coverage:.2f}%")
+        for i in members:
+            image, info = estimate.remove(images[i])
+            info.update({'method': 'multi-image', 'group_size': len(members), 'coverage': round(float(coverage), 2)})
+            results[i] = (image, info)
+    return results
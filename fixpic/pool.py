@@ -0,0 +1,35 @@
+"""
+批量 CPU 任务共用的进程池
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+# 进程数，默认使用全部 CPU 核心
+POOL_WORKERS = int(os.environ.get("FIXPIC_POOL_WORKERS", "0")) or os.cpu_count() or 1
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """延迟创建进程池（spawn 方式，避免 fork 已加载模型的父进程）"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(
+                    max_workers=POOL_WORKERS,
+                    mp_context=multiprocessing.get_context('spawn'),
+                )
+    return _pool
+
+
+def map_in_pool(fn, items):
+    """批量执行 fn，单个任务时直接在当前进程运行"""
+    items = list(items)
+    if len(items) <= 1 or POOL_WORKERS <= 1:
+        return [fn(item) for item in items]
+    return list(get_process_pool().map(fn, items))
@@ -0,0 +1,110 @@
+"""
+纯色/浅灰棚拍商品图的快速去背景（不走神经网络）
+
+思路与前端去假透明一致：从四边和四角采样估计背景颜色与一致性，
+置信度足够高时用颜色距离 + 边界连通区域 + alpha 羽化直接抠图，
+置信度不足时返回 None，由调用方回退到 rembg / Pixelbin。
+"""
+
+import os
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# 低于该置信度时回退到神经网络模型（设为 >1 可关闭快速路径）
+MIN_CONFIDENCE = float(os.environ.get("FAST_BG_MIN_CONFIDENCE", "0.9"))
+
+# 背景颜色容差（RGB 欧氏距离）
+COLOR_TOLERANCE = 18.0
+
+# 背景需接近灰白色：最大通道差
+MAX_BG_CHROMA = 30
+
+
+def _border_width(h, w):
+    return max(2, min(h, w) // 50)
+
+
+def classify_uniform_background(rgb, tolerance=COLOR_TOLERANCE):
+    """估计背景一致性，返回 (置信度 0-1, 背景颜色)"""
+    h, w = rgb.shape[:2]
+    b = _border_width(h, w)
+
+    border = np.concatenate([
+        rgb[:b].reshape(-1, 3),
+        rgb[-b:].reshape(-1, 3),
+        rgb[b:-b, :b].reshape(-1, 3),
+        rgb[b:-b, -b:].reshape(-1, 3),
+    ]).astype(np.float32)
+
+    bg_color = np.median(border, axis=0)
+    dist = np.sqrt(np.sum((border - bg_color) ** 2, axis=1))
+    uniformity = float(np.mean(dist < tolerance))
+
+    # 四角颜色必须一致（排除渐变或单侧阴影背景）
+    c = max(b, min(h, w) // 20)
+    corners = [rgb[:c, :c], rgb[:c, -c:], rgb[-c:, :c], rgb[-c:, -c:]]
+    corner_medians = np.array([np.median(p.reshape(-1, 3), axis=0) for p in corners], dtype=np.float32)
+    corner_spread = float(np.max(np.sqrt(np.sum((corner_medians - bg_color) ** 2, axis=1))))
+
+    chroma = float(bg_color.max() - bg_color.min())
+
+    confidence = uniformity
+    if corner_spread > tolerance or chroma > MAX_BG_CHROMA:
+        confidence = 0.0
+
+    return confidence, bg_color
+
+
+def key_uniform_background(rgb, bg_color, tolerance=COLOR_TOLERANCE, feather=1.5):
+    """颜色距离 + 从边界出发的连通区域抠图，返回 alpha (uint8)"""
+    h, w = rgb.shape[:2]
+
+    diff = rgb.astype(np.float32) - bg_color.astype(np.float32)
+    dist = np.sqrt(np.sum(diff * diff, axis=2))
+
+    # 宽松阈值的候选背景，只保留与图片边界连通的部分（相当于从四边 flood fill）
+    candidate = (dist < tolerance * 2).astype(np.uint8)
+    _, labels = cv2.connectedComponents(candidate, connectivity=4)
+    edge_labels = np.unique(np.concatenate([labels[0], labels[-1], labels[:, 0], labels[:, -1]]))
+    edge_labels = edge_labels[edge_labels != 0]
+    bg_region = np.isin(labels, edge_labels)
+
+    # 背景区域内按颜色距离过渡，得到柔和的边缘
+    lo, hi = tolerance * 0.5, tolerance * 2
+    ramp = np.clip((dist - lo) / (hi - lo), 0.0, 1.0)
+    alpha = np.where(bg_region, ramp, 1.0).astype(np.float32)
+
+    if feather > 0:
+        alpha = cv2.GaussianBlur(alpha, (0, 0), feather)
+
+    return (alpha * 255.0 + 0.5).astype(np.uint8)
+
+
+def try_remove_uniform_background(image, min_confidence=None):
+    """纯色背景快速抠图，置信度不足或结果异常时返回 None"""
+    if min_confidence is None:
+        min_confidence = MIN_CONFIDENCE
+
+    rgb = np.array(image.convert('RGB'))
+    h, w = rgb.shape[:2]
+    if min(h, w) < 32:
+        return None
+
+    confidence, bg_color = classify_uniform_background(rgb)
+    print(f"Uniform background confidence: {confidence:.2f}, color={bg_color.astype(int).tolist()}")
+    if confidence < min_confidence:
+        return None
+
+    alpha = key_uniform_background(rgb, bg_color)
+
+    # 前景过小或过大说明背景判断有误，交给模型处理
+    fg_ratio = float(np.mean(alpha > 127))
+    if fg_ratio < 0.01 or fg_ratio > 0.95:
+        print(f"Foreground ratio {fg_ratio:.2f} out of range, escalating to model")
+        return None
+
+    output = Image.fromarray(rgb).convert('RGBA')
+    output.putalpha(Image.fromarray(alpha, 'L'))
+    return output
@@ -0,0 +1,30 @@
+"""
+远程 API 调用的有限并发
+
+异步接口里多张背景的 SDXL 生成等远程调用在事件循环中并发等待；
+同时进行的调用数受 limit 限制（远程 API 有速率限制），单个调用失败不影响其余调用。
+"""
+
+import asyncio
+
+
+async def gather_limited(fn, items, limit):
+    """并发执行 fn(index, item) 协程（同时最多 limit 个）
+
+    返回与 items 对齐的结果列表；抛出异常的调用记为 None 并打印错误。
+    """
+    semaphore = asyncio.Semaphore(max(1, limit))
+
+    async def run(index, item):
+        async with semaphore:
+            return await fn(index, item)
+
+    outcomes = await asyncio.gather(*(run(i, item) for i, item in enumerate(items)), return_exceptions=True)
+
+    results = []
+    for index, outcome in enumerate(outcomes):
+        if isinstance(outcome, Exception):
+            print(f"  Remote call {index + 1} failed: {outcome}")
+            outcome = None
+        results.append(outcome)
+    return results
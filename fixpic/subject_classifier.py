@@ -0,0 +1,130 @@
+"""
+AI 换背景的主体分类（product / person / food / general）
+
+原先对每个主体跑 Florence-2 详细描述，再用关键词判断类别；这里改为 CLIP 零样本分类：
+- 各类别的文本描述只编码一次，之后每张图只需一次图像编码 + 点积
+- 结果按图片哈希缓存（LRU），同一张图重复换背景不再重新推理
+- 最高分低于 MIN_CONFIDENCE 时归为 general
+
+SUBJECT_CLASSIFIER_MODEL 指定模型（默认 openai/clip-vit-base-patch32）。
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+MODEL_ID = os.environ.get("SUBJECT_CLASSIFIER_MODEL", "openai/clip-vit-base-patch32")
+MIN_CONFIDENCE = float(os.environ.get("SUBJECT_CLASSIFIER_MIN_CONFIDENCE", "0.4"))
+CACHE_SIZE = 256
+DEFAULT_CATEGORY = 'general'
+
+# 每个类别多条描述，取平均文本嵌入
+CATEGORY_PROMPTS = {
+    'product': [
+        "a product photo of an item",
+        "a bottle, box or package on a plain background",
+        "a consumer product for an online store",
+    ],
+    'person': [
+        "a photo of a person",
+        "a portrait of a man or a woman",
+        "a person wearing clothes",
+    ],
+    'food': [
+        "a photo of food",
+        "a dish or a meal",
+        "fruit or vegetables",
+    ],
+    'general': [
+        "a photo of an object",
+        "a photo of an animal",
+        "a photo of a scene",
+    ],
+}
+
+
+def image_key(image):
+    """图片内容哈希（用于缓存）"""
+    digest = hashlib.sha1(image.tobytes())
+    digest.update(f"{image.mode}{image.size}".encode())
+    return digest.hexdigest()
+
+
+class SubjectClassifier:
+    """CLIP 零样本主体分类器（模型延迟加载，线程安全）"""
+
+    def __init__(self, device="cpu", model_id=MODEL_ID):
+        self.device = device
+        self.model_id = model_id
+        self.model = None
+        self.processor = None
+        self._categories = list(CATEGORY_PROMPTS)
+        self._text_embeds = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self):
+        """加载 CLIP 并计算各类别文本嵌入"""
+        import torch
+        from transformers import CLIPModel, CLIPProcessor
+        from fixpic.weights import timed_load
+
+        print(f"Loading subject classifier ({self.model_id})...")
+        with timed_load('clip_vit_b32'):
+            self.processor = CLIPProcessor.from_pretrained(self.model_id)
+            self.model = CLIPModel.from_pretrained(self.model_id, low_cpu_mem_usage=True).to(self.device).eval()
+
+        # 类别文本嵌入只计算一次
+        embeds = []
+        with torch.no_grad():
+            for category in self._categories:
+                inputs = self.processor(text=CATEGORY_PROMPTS[category], return_tensors="pt", padding=True)
+                inputs = {k: v.to(self.device) for k, v in inputs.items()}
+                features = self.model.get_text_features(**inputs)
+                features = features / features.norm(dim=-1, keepdim=True)
+                mean = features.mean(dim=0)
+                embeds.append(mean / mean.norm())
+        self._text_embeds = torch.stack(embeds)
+        print("Subject classifier loaded!")
+
+    @staticmethod
+    def _flatten(image):
+        """透明主体合成到白底（CLIP 不理解 alpha 通道）"""
+        from PIL import Image
+
+        if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+            rgba = image.convert('RGBA')
+            background = Image.new('RGBA', rgba.size, (255, 255, 255, 255))
+            return Image.alpha_composite(background, rgba).convert('RGB')
+        return image.convert('RGB')
+
+    def classify(self, image, key=None):
+        """返回 (类别, {类别: 概率})；key 为缓存键，默认使用图片内容哈希"""
+        import torch
+
+        key = key or image_key(image)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+            if self.model is None:
+                self.load()
+
+            inputs = self.processor(images=self._flatten(image), return_tensors="pt")
+            with torch.no_grad():
+                features = self.model.get_image_features(pixel_values=inputs["pixel_values"].to(self.device))
+                features = features / features.norm(dim=-1, keepdim=True)
+                logits = self.model.logit_scale.exp() * features @ self._text_embeds.T
+                probs = logits.softmax(dim=-1)[0].tolist()
+
+            scores = {c: round(p, 4) for c, p in zip(self._categories, probs)}
+            best = max(scores, key=scores.get)
+            category = best if scores[best] >= MIN_CONFIDENCE else DEFAULT_CATEGORY
+            result = (category, scores)
+
+            self._cache[key] = result
+            if len(self._cache) > CACHE_SIZE:
+                self._cache.popitem(last=False)
+            return result
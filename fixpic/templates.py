@@ -0,0 +1,413 @@
+"""
+已知图库水印模板匹配
+
+Shutterstock、Adobe Stock、Dreamstime、Alamy、Freepik 的水印 logo 和版式固定，
+没必要每次都跑三遍整图 OCR。模板库保存在 Volume（WATERMARK_TEMPLATE_DIR，
+默认 /models/watermark_templates），manifest.json 记录每个模板：
+
+    {"source": "dreamstime", "role": "anchor", "file": "dreamstime/bar_logo.png",
+     "width_ratio": 0.17, "side_ratio": 0.17}
+
+- role=anchor：版式中位置固定的标识（底部横条 logo、左侧竖排文字），用来确认来源
+- role=tile：平铺在画面中的半透明 logo，确认来源后逐个定位
+- width_ratio：截取时模板宽度 / 原图宽度，匹配时据此换算期望尺寸
+- side_ratio：模板宽度 / 原图长边（有则优先使用）：图库按长边缩放预览图，
+  横图和竖图上的标识大小相同，按宽度换算会差出一截
+- threshold：该模板的匹配阈值（可选，默认按 role 取 MATCH_THRESHOLD / TILE_THRESHOLD）
+- origin：模板的来历（截取自哪张预览图，或按字标渲染）
+
+匹配在长边 WORK_SIDE 的缩小图上进行：灰度去掉低频（高通）后用
+TM_CCOEFF_NORMED 做归一化互相关（OpenCV 对大模板走 DFT），模板的多尺度版本
+按固定尺度阶梯预先生成并缓存。置信匹配生成的 mask 作为检测的起点，
+其余检测器只需补上模板没有覆盖的部分。
+
+整理好的模板随代码发布在 fixpic/template_assets/（同样的 manifest.json 格式），
+seed 把其中尚未登记的模板复制到 Volume 上的模板库（modal_app_v2.py::sync_models 自动执行）。
+维护发布的模板时把 WATERMARK_TEMPLATE_DIR 指向 fixpic/template_assets：
+    python -m fixpic.templates seed
+    python -m fixpic.templates add SOURCE ROLE IMAGE X Y W H
+    python -m fixpic.templates wordmark SOURCE ROLE TEXT SIDE_RATIO FONT [ANGLE]
+    python -m fixpic.templates list
+
+阈值在留出集上验证（tests/test_templates.py）：截取模板用的预览图不参与验证，
+正例为同图库的其他预览图和按不同字重叠加字标的合成预览图，反例为无水印的图片。
+"""
+
+import json
+import os
+import sys
+import threading
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from fixpic.image_context import ImageContext
+
+TEMPLATE_DIR = os.environ.get("WATERMARK_TEMPLATE_DIR", "/models/watermark_templates")
+WORK_SIDE = 1024
+# 留出集上：dreamstime 真实标识 0.81，其他图片最高 0.61（文字密集的设计稿）
+MATCH_THRESHOLD = float(os.environ.get("WATERMARK_TEMPLATE_THRESHOLD", "0.7"))
+# 平铺 logo 的匹配阈值（半透明，相关性更弱）
+TILE_THRESHOLD = 0.4
+MAX_TILES = 200
+# 期望尺寸附近搜索的相对尺度
+SCALE_STEPS = (0.8, 0.9, 1.0, 1.1, 1.25)
+# 预生成模板宽度的阶梯（相邻约 8%）
+WIDTH_LADDER = np.unique(np.round(12 * 1.08 ** np.arange(50)).astype(int))
+HIGHPASS_SIGMA = 8
+# 候选位置的局部方差低于模板方差的该比例时不计分
+MIN_VARIANCE_RATIO = 0.2
+MASK_PADDING = 0.15
+
+# 版式：anchor 出现的区域（相对坐标 x0, y0, x1, y1）、底部横条高度比例、是否有平铺 logo
+LAYOUT_PROFILES = {
+    'shutterstock': {'anchor_region': (0.0, 0.85, 0.5, 1.0), 'bar': 0.09, 'tiled': True},
+    'adobe': {'anchor_region': (0.0, 0.0, 0.15, 1.0), 'bar': 0.0, 'tiled': True},
+    'dreamstime': {'anchor_region': (0.0, 0.85, 0.4, 1.0), 'bar': 0.08, 'tiled': True},
+    'alamy': {'anchor_region': (0.0, 0.88, 0.4, 1.0), 'bar': 0.07, 'tiled': True},
+    'freepik': {'anchor_region': (0.0, 0.0, 1.0, 1.0), 'bar': 0.0, 'tiled': True},
+}
+
+# 随代码发布的模板
+ASSET_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'template_assets')
+# 渲染字标时的灰度：背景 128，文字亮 WORDMARK_CONTRAST（接近半透明白色水印叠在中间调上的反差）
+WORDMARK_CONTRAST = 48
+
+
+def highpass(gray):
+    """去掉低频背景，只保留水印的轮廓结构（对半透明叠加更稳定）"""
+    gray = gray.astype(np.float32)
+    return gray - cv2.GaussianBlur(gray, (0, 0), HIGHPASS_SIGMA)
+
+
+class WatermarkTemplate:
+    """单个模板及其预生成的多尺度版本"""
+
+    def __init__(self, source, role, gray, alpha, width_ratio, name='', side_ratio=None, threshold=None):
+        self.source = source
+        self.role = role
+        self.name = name
+        self.width_ratio = width_ratio
+        self.side_ratio = side_ratio
+        if threshold is None:
+            threshold = MATCH_THRESHOLD if role == 'anchor' else TILE_THRESHOLD
+        self.threshold = threshold
+        self.aspect = gray.shape[0] / gray.shape[1]
+        self._gray = gray
+        self._alpha = alpha
+        self._variants = {}
+
+    @staticmethod
+    def ladder_width(width):
+        """把任意宽度归到最近的阶梯宽度"""
+        idx = int(np.argmin(np.abs(WIDTH_LADDER - width)))
+        return int(WIDTH_LADDER[idx])
+
+    def variant(self, width):
+        """阶梯宽度下的 (高通模板, alpha)"""
+        width = self.ladder_width(width)
+        if width not in self._variants:
+            height = max(4, int(round(width * self.aspect)))
+            gray = cv2.resize(self._gray, (width, height), interpolation=cv2.INTER_AREA)
+            alpha = cv2.resize(self._alpha, (width, height), interpolation=cv2.INTER_NEAREST)
+            self._variants[width] = (highpass(gray), alpha)
+        return self._variants[width]
+
+    def expected_width(self, work_w, work_h):
+        """工作图上模板的期望宽度"""
+        if self.side_ratio:
+            return self.side_ratio * max(work_w, work_h)
+        return self.width_ratio * work_w
+
+    def precompute(self, work_sizes):
+        """按常见工作图尺寸预生成所有尺度"""
+        for work_w, work_h in work_sizes:
+            for step in SCALE_STEPS:
+                self.variant(self.expected_width(work_w, work_h) * step)
+
+
+class TemplateLibrary:
+    """按来源分组的模板集合"""
+
+    def __init__(self, templates):
+        self.by_source = {}
+        for t in templates:
+            self.by_source.setdefault(t.source, []).append(t)
+
+    def __len__(self):
+        return sum(len(v) for v in self.by_source.values())
+
+    @classmethod
+    def load(cls, directory=TEMPLATE_DIR):
+        manifest_path = os.path.join(directory, 'manifest.json')
+        if not os.path.exists(manifest_path):
+            print(f"No watermark templates at {directory}")
+            return cls([])
+
+        with open(manifest_path) as f:
+            entries = json.load(f)
+
+        templates = []
+        for entry in entries:
+            try:
+                img = Image.open(os.path.join(directory, entry['file']))
+                gray = np.array(img.convert('L'))
+                if img.mode in ('RGBA', 'LA'):
+                    alpha = np.array(img.getchannel('A'))
+                else:
+                    alpha = np.full(gray.shape, 255, dtype=np.uint8)
+                t = WatermarkTemplate(entry['source'], entry.get('role', 'anchor'), gray, alpha,
+                                      float(entry['width_ratio']), name=entry['file'],
+                                      side_ratio=entry.get('side_ratio'), threshold=entry.get('threshold'))
+                # 工作图长边固定为 WORK_SIDE，常见宽度为横图 / 方图 / 竖图三档
+                t.precompute([(WORK_SIDE, WORK_SIDE), (WORK_SIDE, WORK_SIDE * 3 // 4), (WORK_SIDE * 2 // 3, WORK_SIDE)])
+                templates.append(t)
+            except Exception as e:
+                print(f"Failed to load watermark template {entry}: {e}")
+
+        print(f"Loaded {len(templates)} watermark templates from {directory}")
+        return cls(templates)
+
+    def _match(self, work, template, region, max_hits, threshold=None):
+        """在 region 内匹配模板的各个尺度，返回 [(score, x, y, w, h, alpha)]"""
+        if threshold is None:
+            threshold = template.threshold
+        work_h, work_w = work.shape
+        x0, y0 = int(region[0] * work_w), int(region[1] * work_h)
+        x1, y1 = int(region[2] * work_w), int(region[3] * work_h)
+        area = work[y0:y1, x0:x1]
+
+        best = []
+        for step in SCALE_STEPS:
+            tmpl, alpha = template.variant(template.expected_width(work_w, work_h) * step)
+            th, tw = tmpl.shape
+            if th >= area.shape[0] or tw >= area.shape[1]:
+                continue
+            scores = cv2.matchTemplate(area, tmpl, cv2.TM_CCOEFF_NORMED)
+            # 平坦区域（纯色横条）上归一化相关的分母接近 0，得分没有意义
+            ones = np.ones_like(tmpl)
+            n = tmpl.size
+            local_mean = cv2.matchTemplate(area, ones, cv2.TM_CCORR) / n
+            local_var = cv2.matchTemplate(area * area, ones, cv2.TM_CCORR) / n - local_mean ** 2
+            scores[local_var < MIN_VARIANCE_RATIO * tmpl.var()] = -1
+            hits = []
+            for _ in range(max_hits):
+                _, score, _, (px, py) = cv2.minMaxLoc(scores)
+                if score < threshold:
+                    break
+                hits.append((float(score), x0 + px, y0 + py, tw, th, alpha))
+                # 非极大值抑制：清掉该位置附近
+                scores[max(0, py - th // 2):py + th // 2 + 1, max(0, px - tw // 2):px + tw // 2 + 1] = -1
+            # 按最高分选尺度（按总分选会偏向误检更多的尺度）
+            if hits and (not best or hits[0][0] > best[0][0]):
+                best = hits
+        return best
+
+    def match(self, image):
+        """返回 (mask, info)，没有置信匹配时 mask 为 None"""
+        ctx = ImageContext.of(image)
+        w, h = ctx.size
+        info = {'matched': False}
+        if not self.by_source:
+            return None, info
+
+        small = ctx.downscaled(WORK_SIDE)
+        work = highpass(small.gray)
+        scale = w / small.width
+
+        for source, templates in self.by_source.items():
+            profile = LAYOUT_PROFILES.get(source, {'anchor_region': (0.0, 0.0, 1.0, 1.0), 'bar': 0.0, 'tiled': True})
+            anchors = [t for t in templates if t.role == 'anchor']
+            tiles = [t for t in templates if t.role == 'tile']
+
+            anchor_hits = []
+            for t in anchors:
+                anchor_hits = self._match(work, t, profile['anchor_region'], 1)
+                if anchor_hits:
+                    break
+
+            # 有 anchor 模板但没命中时不必再找平铺 logo
+            if anchors and not anchor_hits:
+                continue
+
+            tile_hits = []
+            if profile.get('tiled'):
+                for t in tiles:
+                    tile_hits.extend(self._match(work, t, (0.0, 0.0, 1.0, 1.0), MAX_TILES))
+
+            # 置信：anchor 命中，或没有 anchor 模板时平铺 logo 至少出现 3 次
+            confident = bool(anchor_hits) or (not anchors and len(tile_hits) >= 3)
+            if not confident:
+                continue
+
+            mask = np.zeros((h, w), dtype=np.uint8)
+            for _, x, y, tw, th, alpha in anchor_hits + tile_hits:
+                pad_x, pad_y = int(tw * MASK_PADDING), int(th * MASK_PADDING)
+                fx0, fy0 = int((x - pad_x) * scale), int((y - pad_y) * scale)
+                fx1, fy1 = int((x + tw + pad_x) * scale), int((y + th + pad_y) * scale)
+                fx0, fy0, fx1, fy1 = max(fx0, 0), max(fy0, 0), min(fx1, w), min(fy1, h)
+                if fx1 <= fx0 or fy1 <= fy0:
+                    continue
+                padded = cv2.copyMakeBorder(alpha, pad_y, pad_y, pad_x, pad_x, cv2.BORDER_CONSTANT, value=0)
+                padded = cv2.dilate(padded, np.ones((3, 3), np.uint8), iterations=max(1, min(pad_x, pad_y)))
+                piece = cv2.resize(padded, (fx1 - fx0, fy1 - fy0), interpolation=cv2.INTER_NEAREST)
+                mask[fy0:fy1, fx0:fx1] = np.maximum(mask[fy0:fy1, fx0:fx1], piece)
+
+            if profile.get('bar') and anchor_hits:
+                mask[int(h * (1 - profile['bar'])):, :] = 255
+
+            info = {
+                'matched': True,
+                'source': source,
+                'anchor_score': round(anchor_hits[0][0], 3) if anchor_hits else None,
+                'tiles': len(tile_hits),
+            }
+            return mask, info
+
+        return None, info
+
+
+_library = None
+_library_lock = threading.Lock()
+
+
+def get_template_library(directory=TEMPLATE_DIR):
+    """进程内共享的模板库（首次调用时加载）"""
+    global _library
+    if _library is None:
+        with _library_lock:
+            if _library is None:
+                _library = TemplateLibrary.load(directory)
+    return _library
+
+
+def _load_manifest(directory):
+    manifest_path = os.path.join(directory, 'manifest.json')
+    if not os.path.exists(manifest_path):
+        return []
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def _register(directory, entry, image):
+    """保存模板图片并登记到 manifest.json，返回文件名"""
+    os.makedirs(os.path.join(directory, entry['source']), exist_ok=True)
+    entries = _load_manifest(directory)
+
+    file_name = f"{entry['source']}/{entry['role']}_{len(entries)}.png"
+    image.save(os.path.join(directory, file_name))
+    entries.append({**entry, 'file': file_name})
+    with open(os.path.join(directory, 'manifest.json'), 'w') as f:
+        json.dump(entries, f, indent=2, ensure_ascii=False)
+    return file_name
+
+
+def add_template(directory, source, role, image_path, box, seed=None):
+    """从样例图截取模板并登记到 manifest.json（样例图带透明通道时保留 alpha）"""
+    x, y, bw, bh = box
+    img = Image.open(image_path)
+    has_alpha = img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info)
+    img = img.convert('LA' if has_alpha else 'L')
+    crop = img.crop((x, y, x + bw, y + bh))
+
+    entry = {
+        'source': source,
+        'role': role,
+        'width_ratio': round(bw / img.width, 5),
+        'side_ratio': round(bw / max(img.size), 5),
+        'origin': f"crop of {os.path.basename(image_path)} at {list(box)}",
+    }
+    if seed is not None:
+        entry['seed'] = seed
+    return _register(directory, entry, crop)
+
+
+def render_wordmark(text, font_path, height=48, angle=0):
+    """把字标渲染成 LA 模板：灰度为中间调上的亮字，alpha 为字形"""
+    from PIL import ImageDraw, ImageFont
+
+    font = ImageFont.truetype(font_path, height)
+    x0, y0, x1, y1 = font.getbbox(text)
+    pad = height // 4
+    size = (x1 - x0 + 2 * pad, y1 - y0 + 2 * pad)
+    gray = Image.new('L', size, 128)
+    alpha = Image.new('L', size, 0)
+    ImageDraw.Draw(gray).text((pad - x0, pad - y0), text, fill=128 + WORDMARK_CONTRAST, font=font)
+    ImageDraw.Draw(alpha).text((pad - x0, pad - y0), text, fill=255, font=font)
+    image = Image.merge('LA', (gray, alpha))
+    return image.rotate(angle, expand=True) if angle else image
+
+
+def add_wordmark(directory, source, role, text, side_ratio, font_path, angle=0, threshold=None, seed=None):
+    """渲染图库字标作为模板（没有可截取的预览图时使用）；side_ratio 为模板宽度 / 预览图长边"""
+    image = render_wordmark(text, font_path, angle=angle)
+    entry = {
+        'source': source,
+        'role': role,
+        'width_ratio': side_ratio,
+        'side_ratio': side_ratio,
+        'origin': f"rendered wordmark {text!r} ({os.path.basename(font_path)}, angle {angle})",
+    }
+    if threshold is not None:
+        entry['threshold'] = threshold
+    if seed is not None:
+        entry['seed'] = seed
+    return _register(directory, entry, image)
+
+
+def seed_templates(directory=TEMPLATE_DIR, asset_dir=ASSET_DIR):
+    """把发布的模板中尚未登记的复制到模板库（按 seed 去重），返回新增的文件名"""
+    seeded = {entry.get('seed') for entry in _load_manifest(directory)}
+    added = []
+    for entry in _load_manifest(asset_dir):
+        if entry.get('seed') in seeded:
+            continue
+        image = Image.open(os.path.join(asset_dir, entry['file']))
+        image.load()
+        fields = {k: v for k, v in entry.items() if k != 'file'}
+        added.append(_register(directory, fields, image))
+    return added
+
+
+def main(argv):
+    """命令行维护模板库"""
+    directory = TEMPLATE_DIR
+    if len(argv) >= 1 and argv[0] == 'list':
+        library = TemplateLibrary.load(directory)
+        for source, templates in library.by_source.items():
+            for t in templates:
+                print(f"{source:14s} {t.role:7s} {t.name} width_ratio={t.width_ratio} threshold={t.threshold}")
+        return 0
+
+    if len(argv) in (1, 2) and argv[0] == 'seed':
+        added = seed_templates(directory, *argv[1:])
+        print(f"Seeded {len(added)} templates into {directory}")
+        return 0
+
+    if len(argv) in (6, 7, 8) and argv[0] in ('add', 'wordmark') and argv[2] not in ('anchor', 'tile'):
+        print("ROLE must be 'anchor' or 'tile'")
+        return 1
+
+    if len(argv) == 8 and argv[0] == 'add':
+        _, source, role, image_path, *box = argv
+        name = add_template(directory, source, role, image_path, [int(v) for v in box])
+        print(f"Added {name} to {directory}")
+        return 0
+
+    if len(argv) in (6, 7) and argv[0] == 'wordmark':
+        _, source, role, text, side_ratio, font_path, *angle = argv
+        name = add_wordmark(directory, source, role, text, float(side_ratio), font_path,
+                            angle=int(angle[0]) if angle else 0, seed=f"{source}/{role}/{text}")
+        print(f"Added {name} to {directory}")
+        return 0
+
+    print("Usage: python -m fixpic.templates seed [ASSET_DIR]")
+    print("       python -m fixpic.templates add SOURCE ROLE IMAGE X Y W H")
+    print("       python -m fixpic.templates wordmark SOURCE ROLE TEXT SIDE_RATIO FONT [ANGLE]")
+    print("       python -m fixpic.templates list")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
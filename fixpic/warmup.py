@@ -0,0 +1,105 @@
+"""
+模型预热与就绪状态
+
+首个真实请求不再承担模型加载、CUDA 上下文初始化和 cuDNN 自动调优：
+启动时按 WARMUP_MODELS 加载选中的模型，并各跑一次假数据推理。
+
+- WARMUP_MODELS：逗号分隔的模型名，all 表示全部，空字符串表示不预热；
+  未设置时使用各应用的默认列表
+- 每个模型的状态：pending → warming → ready / failed
+- 模型分必需和可选（optional，如加载函数允许返回 None 的检测模型）：
+  - warming：预热中
+  - failed：有必需模型失败
+  - degraded：只有可选模型失败，核心接口可用
+  - ok：全部就绪
+  health 只在 warming / failed 时返回 503（负载均衡不会把请求发给缺核心模型的实例），
+  可选模型的失败在响应体中列出
+"""
+
+import os
+import threading
+import time
+
+WARMUP_ENV = "WARMUP_MODELS"
+
+
+def selected_models(default, available):
+    """按 WARMUP_MODELS（未设置时用 default）选出要预热的模型，保持 available 中的顺序"""
+    value = os.environ.get(WARMUP_ENV, default).strip()
+    if value == 'all':
+        return list(available)
+    names = [n.strip() for n in value.split(',') if n.strip()]
+    unknown = [n for n in names if n not in available]
+    if unknown:
+        print(f"Unknown warm-up models ignored: {', '.join(unknown)}")
+    return [n for n in available if n in names]
+
+
+class Warmup:
+    """预热进度与各模型就绪状态"""
+
+    def __init__(self, names, optional=()):
+        self._lock = threading.Lock()
+        self._states = {name: {'state': 'pending'} for name in names}
+        self.optional = set(optional)
+        self.thread = None
+
+    def _set(self, name, **values):
+        with self._lock:
+            self._states[name] = values
+
+    def run(self, steps):
+        """依次执行 steps[name]()（加载 + 假数据推理），单个模型失败不影响其余模型"""
+        total_start = time.time()
+        for name in list(self._states):
+            self._set(name, state='warming')
+            start = time.time()
+            try:
+                steps[name]()
+                self._set(name, state='ready', seconds=round(time.time() - start, 3))
+                print(f"[warmup] {name} ready in {time.time() - start:.2f}s")
+            except Exception as e:
+                self._set(name, state='failed', error=str(e), seconds=round(time.time() - start, 3))
+                print(f"[warmup] {name} failed: {e}")
+        if self._states:
+            print(f"[warmup] finished in {time.time() - total_start:.2f}s")
+
+    def start(self, steps):
+        """后台线程预热（HTTP 服务先启动，health 在预热完成前返回 503）"""
+        self.thread = threading.Thread(target=self.run, args=(steps,), name="warmup", daemon=True)
+        self.thread.start()
+        return self.thread
+
+    def _failed(self, optional):
+        return [name for name, s in self._states.items()
+                if s['state'] == 'failed' and (name in self.optional) == optional]
+
+    def _state(self):
+        states = [s['state'] for s in self._states.values()]
+        if any(state in ('pending', 'warming') for state in states):
+            return 'warming'
+        if self._failed(optional=False):
+            return 'failed'
+        return 'degraded' if 'failed' in states else 'ok'
+
+    @property
+    def state(self):
+        """warming（预热中）/ failed（必需模型失败）/ degraded（只有可选模型失败）/ ok（全部就绪）"""
+        with self._lock:
+            return self._state()
+
+    @property
+    def ready(self):
+        """必需模型都预热成功（可选模型失败不影响）"""
+        return self.state in ('ok', 'degraded')
+
+    def status(self):
+        with self._lock:
+            state = self._state()
+            return {
+                'state': state,
+                'ready': state in ('ok', 'degraded'),
+                'failed': self._failed(optional=False),
+                'optional_failed': self._failed(optional=True),
+                'models': {name: dict(s, optional=name in self.optional) for name, s in self._states.items()},
+            }
@@ -0,0 +1,158 @@
+"""
+模型权重的快速加载与冷启动计时
+
+- to_safetensors()：同步时把 pickle 格式的 state_dict（.pth / .bin）转成 safetensors
+- load_module()：构建模型时参数一注册就换成 meta 张量（随机初始化在 meta 上是空操作、不分配内存），
+  buffer 照常创建——非持久 buffer（如 SAM 的 pixel_mean / pixel_std）不在权重文件里，值来自构建；
+  权重以 mmap 方式读取后通过 load_state_dict(assign=True) 直接挂到模型上，没有整份拷贝。
+  权重文件与模型结构对不上（缺少 / 多出的键）时报错，不静默忽略
+- timed_load()：记录每个模型的加载耗时，日志和 health 接口中按模型给出冷启动开销
+"""
+
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+_load_times = {}
+_load_lock = threading.Lock()
+
+
+@contextmanager
+def timed_load(name):
+    """记录一个模型的加载耗时"""
+    start = time.time()
+    yield
+    elapsed = time.time() - start
+    with _load_lock:
+        _load_times[name] = round(elapsed, 3)
+    print(f"[cold-start] {name} loaded in {elapsed:.2f}s")
+
+
+def load_times():
+    """各模型加载耗时（秒）"""
+    with _load_lock:
+        return dict(_load_times)
+
+
+def _unwrap_state_dict(state):
+    """部分检查点把 state_dict 包在 'state_dict' / 'model' 键下"""
+    for key in ('state_dict', 'model'):
+        if isinstance(state, dict) and isinstance(state.get(key), dict):
+            return state[key]
+    return state
+
+
+def read_state_dict(path):
+    """读取 state_dict：safetensors 用 mmap，pickle 检查点尽量用 mmap"""
+    import torch
+
+    if path.endswith('.safetensors'):
+        from safetensors.torch import load_file
+        return load_file(path, device='cpu')
+
+    try:
+        state = torch.load(path, map_location='cpu', weights_only=True, mmap=True)
+    except TypeError:
+        # 旧版本 torch 不支持 mmap
+        state = torch.load(path, map_location='cpu')
+    return _unwrap_state_dict(state)
+
+
+def to_safetensors(src, dst):
+    """把 pickle 格式的 state_dict 转成 safetensors，共享存储的张量各自复制一份"""
+    import torch
+    from safetensors.torch import save_file
+
+    state = _unwrap_state_dict(torch.load(src, map_location='cpu', weights_only=True))
+    tensors, seen = {}, set()
+    for name, tensor in state.items():
+        if not isinstance(tensor, torch.Tensor):
+            continue
+        ptr = tensor.untyped_storage().data_ptr()
+        if ptr in seen:
+            tensor = tensor.clone()
+        seen.add(ptr)
+        tensors[name] = tensor.contiguous()
+
+    part = dst + '.part'
+    save_file(tensors, part)
+    os.replace(part, dst)
+    return dst
+
+
+def _has_meta(module):
+    return any(t.is_meta for t in module.parameters()) or any(t.is_meta for t in module.buffers())
+
+
+# 只在调用 load_module 的线程内把参数换成 meta：其他线程可能同时在常规加载别的模型
+_meta_params = threading.local()
+_patch_lock = threading.Lock()
+_original_register_parameter = None
+
+
+def _install_parameter_hook():
+    """包装 nn.Module.register_parameter（只安装一次，未开启的线程行为不变）"""
+    global _original_register_parameter
+    import torch
+
+    with _patch_lock:
+        if _original_register_parameter is not None:
+            return
+        original = torch.nn.Module.register_parameter
+
+        def register_parameter(module, name, param):
+            original(module, name, param)
+            if param is not None and getattr(_meta_params, 'enabled', False) and not param.is_meta:
+                module._parameters[name] = torch.nn.Parameter(param.to('meta'), requires_grad=param.requires_grad)
+
+        torch.nn.Module.register_parameter = register_parameter
+        _original_register_parameter = original
+
+
+@contextmanager
+def parameters_on_meta():
+    """构建期间参数注册后立即换成 meta 张量，buffer 照常在内存中创建"""
+    _install_parameter_hook()
+    previous = getattr(_meta_params, 'enabled', False)
+    _meta_params.enabled = True
+    try:
+        yield
+    finally:
+        _meta_params.enabled = previous
+
+
+def non_persistent_buffers(module):
+    """模型中所有非持久 buffer 的完整名称（不在 state_dict / 权重文件中）"""
+    return {
+        f"{prefix}.{name}" if prefix else name
+        for prefix, sub in module.named_modules()
+        for name in sub._non_persistent_buffers_set
+    }
+
+
+def load_module(build, path, device=None):
+    """build() 构建模型结构，权重从 path 零拷贝加载
+
+    返回 eval 模式的模型；device 不为 None 时移动到对应设备。
+    """
+    state = read_state_dict(path)
+
+    with parameters_on_meta():
+        model = build()
+    result = model.load_state_dict(state, strict=False, assign=True)
+
+    expected = non_persistent_buffers(model)
+    missing = sorted(set(result.missing_keys) - expected)
+    unexpected = sorted(set(result.unexpected_keys) - expected)
+    if missing or unexpected:
+        raise RuntimeError(
+            f"Weights {os.path.basename(path)} do not match the model: "
+            f"missing {missing[:10]}, unexpected {unexpected[:10]}"
+        )
+    if _has_meta(model):
+        raise RuntimeError(f"Weights {os.path.basename(path)} left uninitialized tensors")
+
+    if device is not None:
+        model.to(device)
+    return model.eval()
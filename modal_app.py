@@ -33,6 +33,7 @@ image = (
         # 预下载 rembg 模型（不需要GPU）
         "python -c 'from rembg import new_session; new_session(\"u2net\")' || true",
     )
+    .add_local_python_source("fixpic")  # 公共图像处理库
 )
 
 # 创建 Modal App
@@ -42,6 +43,12 @@ app = modal.App("fixpic-api", image=image)
 volume = modal.Volume.from_name("fixpic-models", create_if_missing=True)
 MODEL_DIR = "/models"
 
+# SAM 输入解码分辨率（SAM 内部按 1024px 处理）
+SAM_INPUT_SIDE = 1024
+
+# 启动时预热的模型（WARMUP_MODELS 覆盖，all 表示全部）
+WARMUP_DEFAULT = "sam_vit_b,segformer_clothes,easyocr"
+
 # 服装分割类别
 CLOTHES_LABELS_CN = {
     0: '背景', 1: '帽子', 2: '头发', 3: '太阳镜', 4: '上衣',
@@ -115,6 +122,15 @@ class FixPicAPI:
     @modal.enter()
     def setup(self):
         """容器启动时加载模型"""
+        import time
+        from fixpic.model_registry import get_model_registry
+
+        setup_start = time.time()
+
+        # 模型只从 Volume 读取（由 modal_app_v2.py::sync_models 预先同步）
+        self.models = get_model_registry(MODEL_DIR)
+        self.models.configure_offline()
+
         import torch
         import os
 
@@ -138,28 +154,51 @@ class FixPicAPI:
         self.clothes_model = None
         self.ocr_reader = None
 
+        # 预热：加载选中的模型并各跑一次假数据推理
+        from fixpic.warmup import Warmup, selected_models
+
+        steps = self._warmup_steps()
+        self.warmup = Warmup(selected_models(WARMUP_DEFAULT, steps))
+        self.warmup.run(steps)
+
+        self.setup_seconds = round(time.time() - setup_start, 3)
+        print(f"[cold-start] setup in {self.setup_seconds:.2f}s")
+
+    def _warmup_steps(self):
+        """各模型的预热函数：加载 + 一次假数据推理"""
+        import numpy as np
+        import torch
+        from PIL import Image
+
+        def sam():
+            predictor = self._get_sam_predictor()
+            predictor.set_image(np.zeros((SAM_INPUT_SIDE, SAM_INPUT_SIDE, 3), dtype=np.uint8))
+            predictor.predict(point_coords=np.array([[512, 512]]), point_labels=np.array([1]))
+            predictor.reset_image()
+
+        def clothes():
+            processor, model = self._get_clothes_model()
+            inputs = processor(images=Image.new('RGB', (512, 512)), return_tensors="pt")
+            with torch.no_grad():
+                model(**{k: v.to(self.device) for k, v in inputs.items()})
+
+        def ocr():
+            self._get_ocr_reader().readtext(np.full((64, 256, 3), 255, dtype=np.uint8))
+
+        return {'sam_vit_b': sam, 'segformer_clothes': clothes, 'easyocr': ocr}
+
     def _get_sam_predictor(self):
         """延迟加载 SAM 模型"""
         if self.sam_predictor is None:
-            import torch
             from segment_anything import sam_model_registry, SamPredictor
-            import urllib.request
-            import os
-
-            sam_path = f"{MODEL_DIR}/sam_vit_b.pth"
+            from fixpic.weights import load_module, timed_load
 
-            # 如果模型不存在，下载它
-            if not os.path.exists(sam_path):
-                print("Downloading SAM model...")
-                url = "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_b_01ec64.pth"
-                urllib.request.urlretrieve(url, sam_path)
-                volume.commit()
-                print("SAM model downloaded!")
+            self.models.require('sam_vit_b')
 
             print("Loading SAM model...")
-            sam = sam_model_registry["vit_b"](checkpoint=sam_path)
-            sam.to(self.device)
-            self.sam_predictor = SamPredictor(sam)
+            with timed_load('sam_vit_b'):
+                sam = load_module(sam_model_registry["vit_b"], self.models.weights('sam_vit_b'), self.device)
+                self.sam_predictor = SamPredictor(sam)
             print("SAM model loaded!")
 
         return self.sam_predictor
@@ -168,15 +207,17 @@ class FixPicAPI:
         """延迟加载服装分割模型"""
         if self.clothes_model is None:
             from transformers import SegformerImageProcessor, AutoModelForSemanticSegmentation
+            from fixpic.weights import timed_load
+
+            model_path = self.models.require('segformer_clothes')
 
             print("Loading clothes segmentation model...")
-            self.clothes_processor = SegformerImageProcessor.from_pretrained(
-                "mattmdjaga/segformer_b2_clothes"
-            )
-            self.clothes_model = AutoModelForSemanticSegmentation.from_pretrained(
-                "mattmdjaga/segformer_b2_clothes"
-            )
-            self.clothes_model.to(self.device)
+            with timed_load('segformer_clothes'):
+                self.clothes_processor = SegformerImageProcessor.from_pretrained(model_path)
+                self.clothes_model = AutoModelForSemanticSegmentation.from_pretrained(
+                    model_path, low_cpu_mem_usage=True
+                )
+                self.clothes_model.to(self.device)
             print("Clothes model loaded!")
 
         return self.clothes_processor, self.clothes_model
@@ -186,7 +227,17 @@ class FixPicAPI:
         if self.ocr_reader is None:
             import easyocr
             print("Loading EasyOCR (en, ch_sim)...")
-            self.ocr_reader = easyocr.Reader(['en', 'ch_sim'], gpu=True)
+            from fixpic.weights import timed_load
+
+            storage = self.models.path('easyocr') if self.models.ready('easyocr') else None
+            with timed_load('easyocr'):
+                self.ocr_reader = easyocr.Reader(
+                    ['en', 'ch_sim'],
+                    gpu=True,
+                    model_storage_directory=storage,
+                    user_network_directory=storage,
+                    download_enabled=False,
+                )
             print("EasyOCR loaded!")
         return self.ocr_reader
 
@@ -195,25 +246,23 @@ class FixPicAPI:
         import numpy as np
         from PIL import Image
         import cv2
+        from fixpic.image_context import ImageContext
 
-        image_np = np.array(image)
-        h, w = image_np.shape[:2]
+        ctx = ImageContext.of(image)
+        source = ctx.source
+        w, h = ctx.size
         print(f"Image size: {w}x{h}")
 
         # 创建空白 mask
         mask = np.zeros((h, w), dtype=np.uint8)
 
-        # 如果图片太大，先缩小再检测，然后映射回原尺寸
+        # 大图直接按缩小尺寸解码（JPEG DCT 缩放），检测后映射回原尺寸
         max_dim = 1200
-        scale = 1.0
-        if max(h, w) > max_dim:
-            scale = max_dim / max(h, w)
-            new_w, new_h = int(w * scale), int(h * scale)
-            image_small = cv2.resize(image_np, (new_w, new_h))
-            print(f"Resized to {new_w}x{new_h} for OCR (scale={scale:.2f})")
-        else:
-            image_small = image_np
-            new_h, new_w = h, w
+        scale = source.scale_for(max_dim)
+        image_small = source.array(max_dim)
+        new_h, new_w = image_small.shape[:2]
+        if scale < 1.0:
+            print(f"Decoded at {new_w}x{new_h} for OCR (scale={scale:.2f})")
 
         reader = self._get_ocr_reader()
 
@@ -295,47 +344,18 @@ class FixPicAPI:
         """简化的横条水印检测 - 只检测底部/顶部的纯色横条"""
         import numpy as np
         from PIL import Image
-        import cv2
+        from fixpic.edge_bands import EdgeBandAnalyzer
+        from fixpic.image_context import ImageContext
 
-        image_np = np.array(image)
-        h, w = image_np.shape[:2]
+        ctx = ImageContext.of(image)
+        w, h = ctx.size
         mask = np.zeros((h, w), dtype=np.uint8)
 
-        # 只检测底部横条（最常见）
-        bottom_height = int(h * 0.12)
-        bottom_region = image_np[h - bottom_height:, :]
-        bottom_gray = cv2.cvtColor(bottom_region, cv2.COLOR_RGB2GRAY)
-
-        # 检测每行的颜色标准差
-        row_std = np.std(bottom_gray, axis=1)
-
-        # 找到连续的低标准差区域（纯色横条）
-        uniform_threshold = 25
-        uniform_rows = row_std < uniform_threshold
-
-        # 需要连续的多行才算横条
-        consecutive_count = 0
-        bar_start = -1
-
-        for i, is_uniform in enumerate(uniform_rows):
-            if is_uniform:
-                consecutive_count += 1
-                if bar_start == -1:
-                    bar_start = i
-            else:
-                if consecutive_count > bottom_height * 0.3:  # 需要占底部区域30%以上
-                    actual_start = h - bottom_height + bar_start
-                    mask[actual_start:, :] = 255
-                    print(f"Detected bottom bar: y={actual_start} to {h}")
-                    break
-                consecutive_count = 0
-                bar_start = -1
-
-        # 检查最后的连续区域
-        if consecutive_count > bottom_height * 0.3 and bar_start != -1:
-            actual_start = h - bottom_height + bar_start
-            mask[actual_start:, :] = 255
-            print(f"Detected bottom bar: y={actual_start} to {h}")
+        # 只检测底部横条（最常见）：底部 12% 内连续低标准差行占 30% 以上
+        bar_start = EdgeBandAnalyzer(ctx).bottom_bar()
+        if bar_start is not None:
+            mask[bar_start:, :] = 255
+            print(f"Detected bottom bar: y={bar_start} to {h}")
 
         watermark_pixels = np.sum(mask > 0)
         return Image.fromarray(mask), watermark_pixels
@@ -344,95 +364,19 @@ class FixPicAPI:
         """检测边缘水印（底部/顶部横条、左右边栏）- 改进版"""
         import numpy as np
         from PIL import Image
-        import cv2
+        from fixpic.edge_bands import EdgeBandAnalyzer, band_mask
+        from fixpic.image_context import ImageContext
 
-        image_np = np.array(image)
-        h, w = image_np.shape[:2]
+        ctx = ImageContext.of(image)
+        w, h = ctx.size
 
-        mask = np.zeros((h, w), dtype=np.uint8)
-
-        # ====== 底部横条检测 ======
-        bottom_region_height = int(h * 0.12)
-        bottom_region = image_np[h - bottom_region_height:, :]
-        bottom_gray = cv2.cvtColor(bottom_region, cv2.COLOR_RGB2GRAY)
-        row_std = np.std(bottom_gray, axis=1)
-
-        # 如果某些行颜色非常一致（标准差低），可能是水印横条
-        uniform_rows = row_std < 35
-        if np.sum(uniform_rows) > bottom_region_height * 0.25:
-            for i, is_uniform in enumerate(uniform_rows):
-                if is_uniform:
-                    start_y = h - bottom_region_height + i
-                    mask[start_y:, :] = 255
-                    print(f"Detected bottom bar at y={start_y}")
-                    break
-
-        # ====== 顶部横条检测 ======
-        top_region_height = int(h * 0.08)
-        top_region = image_np[:top_region_height, :]
-        top_gray = cv2.cvtColor(top_region, cv2.COLOR_RGB2GRAY)
-        top_row_std = np.std(top_gray, axis=1)
-
-        uniform_top_rows = top_row_std < 35
-        if np.sum(uniform_top_rows) > top_region_height * 0.25:
-            for i, is_uniform in enumerate(uniform_top_rows):
-                if is_uniform:
-                    mask[:i + top_region_height, :] = 255
-                    print(f"Detected top bar at y={i + top_region_height}")
-                    break
-
-        # ====== 左侧边栏检测（Adobe Stock 风格）- 改进版 ======
-        # 使用饱和度检测：水印区域通常饱和度较低
-        left_region_width = int(w * 0.12)  # 增大检测区域
-        left_region = image_np[:, :left_region_width]
-
-        # 转换到 HSV 检测饱和度变化
-        left_hsv = cv2.cvtColor(left_region, cv2.COLOR_RGB2HSV)
-        left_saturation = left_hsv[:, :, 1]
-
-        # 计算每列的平均饱和度
-        col_sat_mean = np.mean(left_saturation, axis=0)
-
-        # 如果左侧区域饱和度明显低于图片其他部分，可能有水印
-        rest_region = image_np[:, left_region_width:]
-        rest_hsv = cv2.cvtColor(rest_region, cv2.COLOR_RGB2HSV)
-        rest_sat_mean = np.mean(rest_hsv[:, :, 1])
-
-        # 检测饱和度显著降低的列
-        low_sat_cols = col_sat_mean < rest_sat_mean * 0.7
-
-        if np.sum(low_sat_cols) > left_region_width * 0.3:
-            # 找到水印区域的边界
-            watermark_end = 0
-            for i in range(left_region_width - 1, -1, -1):
-                if low_sat_cols[i]:
-                    watermark_end = i + 1
-                    break
-
-            if watermark_end > 0:
-                # 扩展一点边界
-                watermark_end = min(int(watermark_end * 1.2), w)
-                mask[:, :watermark_end] = 255
-                print(f"Detected left sidebar watermark (saturation) ending at x={watermark_end}")
-
-        # ====== 右侧边栏检测 ======
-        right_region_width = int(w * 0.12)
-        right_region = image_np[:, w - right_region_width:]
-        right_hsv = cv2.cvtColor(right_region, cv2.COLOR_RGB2HSV)
-        right_saturation = right_hsv[:, :, 1]
-        right_col_sat_mean = np.mean(right_saturation, axis=0)
-
-        low_sat_right_cols = right_col_sat_mean < rest_sat_mean * 0.7
-        if np.sum(low_sat_right_cols) > right_region_width * 0.3:
-            watermark_start = w
-            for i in range(right_region_width):
-                if low_sat_right_cols[i]:
-                    watermark_start = w - right_region_width + i
-                    break
-            if watermark_start < w:
-                watermark_start = max(int(watermark_start * 0.95), 0)
-                mask[:, watermark_start:] = 255
-                print(f"Detected right sidebar watermark starting at x={watermark_start}")
+        # 积分图一次查出四个候选：底部/顶部横条（逐行标准差低）、
+        # 左/右边栏（Adobe Stock 风格，饱和度明显低于其余部分）
+        bands = EdgeBandAnalyzer(ctx).candidates()
+        for side, pos in bands.items():
+            if pos is not None:
+                print(f"Detected {side} edge watermark at {pos}")
+        mask = band_mask(ctx.size, bands)
 
         watermark_pixels = np.sum(mask > 0)
         print(f"Edge detection watermark pixels: {watermark_pixels} ({100*watermark_pixels/(h*w):.2f}%)")
@@ -440,103 +384,24 @@ class FixPicAPI:
         return Image.fromarray(mask), watermark_pixels
 
     def _detect_repeated_patterns(self, image):
-        """检测重复平铺的水印（改进版：使用多种方法）"""
+        """检测重复平铺的水印（向量化：连通域统计 + 网格亮度/边缘密度）"""
         import numpy as np
         from PIL import Image
         import cv2
+        from fixpic.image_context import ImageContext
+        from fixpic.patterns import grid_anomaly_mask, repeated_contour_mask
 
-        image_np = np.array(image)
-        h, w = image_np.shape[:2]
-
-        gray = cv2.cvtColor(image_np, cv2.COLOR_RGB2GRAY)
-        mask = np.zeros((h, w), dtype=np.uint8)
-
-        # ====== 方法1: 检测半透明覆盖（水印通常是半透明白色/灰色）======
-        # 转换到 LAB 色彩空间，检测 L 通道异常
-        lab = cv2.cvtColor(image_np, cv2.COLOR_RGB2LAB)
-        l_channel = lab[:, :, 0]
+        ctx = ImageContext.of(image)
+        w, h = ctx.size
 
-        # 使用局部对比度检测：水印区域的局部对比度通常较低
-        # 计算局部标准差
-        kernel_size = 15
-        local_mean = cv2.blur(l_channel.astype(np.float32), (kernel_size, kernel_size))
-        local_sq_mean = cv2.blur((l_channel.astype(np.float32) ** 2), (kernel_size, kernel_size))
-        local_std = np.sqrt(np.maximum(local_sq_mean - local_mean ** 2, 0))
-
-        # 低对比度区域可能是水印
-        low_contrast = local_std < 15
-        # 排除太暗或太亮的区域（这些可能是图片本身的特征）
-        mid_brightness = (l_channel > 50) & (l_channel < 200)
-        potential_watermark = low_contrast & mid_brightness
+        # ====== 方法1: 大小相近的重复轮廓 ======
+        mask, repeats = repeated_contour_mask(ctx)
+        if repeats:
+            print(f"Detected {repeats} repeated pattern contours")
 
-        # ====== 方法2: 边缘检测找重复轮廓 ======
-        edges = cv2.Canny(gray, 30, 100)  # 降低阈值以检测更多边缘
-        kernel = np.ones((3, 3), np.uint8)
-        edges_dilated = cv2.dilate(edges, kernel, iterations=1)
-
-        contours, _ = cv2.findContours(edges_dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        # 分析轮廓
-        watermark_contours = []
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if 50 < area < h * w * 0.05:  # 调整大小范围
-                x, y, bw, bh = cv2.boundingRect(contour)
-                aspect_ratio = bw / max(bh, 1)
-                # 水印文字通常是扁长形
-                if 0.5 < aspect_ratio < 15:
-                    watermark_contours.append((contour, area, x, y, bw, bh))
-
-        # 检测重复模式
-        if len(watermark_contours) > 5:
-            areas = [c[1] for c in watermark_contours]
-
-            # 聚类找相似大小的轮廓
-            areas_sorted = sorted(areas)
-            median_area = areas_sorted[len(areas_sorted) // 2]
-
-            # 选择大小在中位数附近的轮廓
-            similar_contours = [c for c in watermark_contours
-                               if median_area * 0.3 < c[1] < median_area * 3]
-
-            if len(similar_contours) > 5:
-                print(f"Detected {len(similar_contours)} repeated pattern contours")
-                for contour, area, x, y, bw, bh in similar_contours:
-                    padding = max(5, int(min(bw, bh) * 0.3))
-                    x1 = max(0, x - padding)
-                    y1 = max(0, y - padding)
-                    x2 = min(w, x + bw + padding)
-                    y2 = min(h, y + bh + padding)
-                    mask[y1:y2, x1:x2] = 255
-
-        # ====== 方法3: 检测规则间隔的亮度异常 ======
-        # Shutterstock 水印通常有规则的间隔
-        # 对图片进行网格分析
-        grid_h, grid_w = 8, 8
-        cell_h, cell_w = h // grid_h, w // grid_w
-
-        brightness_grid = np.zeros((grid_h, grid_w))
-        for i in range(grid_h):
-            for j in range(grid_w):
-                cell = gray[i*cell_h:(i+1)*cell_h, j*cell_w:(j+1)*cell_w]
-                brightness_grid[i, j] = np.mean(cell)
-
-        # 检测亮度异常的格子
-        mean_brightness = np.mean(brightness_grid)
-        std_brightness = np.std(brightness_grid)
-
-        for i in range(grid_h):
-            for j in range(grid_w):
-                # 如果某个格子亮度明显偏离平均值
-                if abs(brightness_grid[i, j] - mean_brightness) > std_brightness * 0.5:
-                    # 进一步检查这个区域是否有水印特征
-                    cell_region = gray[i*cell_h:(i+1)*cell_h, j*cell_w:(j+1)*cell_w]
-                    cell_edges = cv2.Canny(cell_region, 30, 100)
-                    edge_density = np.sum(cell_edges > 0) / (cell_h * cell_w)
-
-                    # 如果边缘密度适中（文字通常有一定边缘但不太密集）
-                    if 0.02 < edge_density < 0.15:
-                        mask[i*cell_h:(i+1)*cell_h, j*cell_w:(j+1)*cell_w] = 255
+        # ====== 方法2: 检测规则间隔的亮度异常 ======
+        # Shutterstock 水印通常有规则的间隔，8x8 网格中亮度偏离且边缘密度适中的格子
+        mask = np.maximum(mask, grid_anomaly_mask(ctx))
 
         # 膨胀并平滑 mask
         if np.sum(mask > 0) > 0:
@@ -554,54 +419,18 @@ class FixPicAPI:
         """专门检测对角线文字水印（如 Adobe Stock、Shutterstock 斜向文字）- 保守版"""
         import numpy as np
         from PIL import Image
-        import cv2
-
-        image_np = np.array(image)
-        h, w = image_np.shape[:2]
-        gray = cv2.cvtColor(image_np, cv2.COLOR_RGB2GRAY)
-
-        mask = np.zeros((h, w), dtype=np.uint8)
-
-        # 使用 Sobel 算子检测不同方向的边缘
-        sobelx = cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3)
-        sobely = cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3)
-
-        gradient_angle = np.arctan2(sobely, sobelx) * 180 / np.pi
-        gradient_magnitude = np.sqrt(sobelx**2 + sobely**2)
+        from fixpic.diagonal import detect_diagonal_text
+        from fixpic.image_context import ImageContext
 
-        # 更严格的对角线角度范围（45±8° 和 135±8°）
-        diagonal_45 = ((gradient_angle > 37) & (gradient_angle < 53)) | \
-                      ((gradient_angle > -143) & (gradient_angle < -127))
-        diagonal_135 = ((gradient_angle > 127) & (gradient_angle < 143)) | \
-                       ((gradient_angle > -53) & (gradient_angle < -37))
+        ctx = ImageContext.of(image)
+        w, h = ctx.size
 
-        # 更高的梯度阈值
-        strong_edges = gradient_magnitude > 35
-        diagonal_watermark = (diagonal_45 | diagonal_135) & strong_edges
-
-        diagonal_mask = diagonal_watermark.astype(np.uint8) * 255
-
-        # 较小的膨胀
-        kernel = np.ones((5, 5), np.uint8)
-        diagonal_mask = cv2.dilate(diagonal_mask, kernel, iterations=2)
-
-        # 只保留适当大小的连通区域（不太小也不太大）
-        contours, _ = cv2.findContours(diagonal_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        total_area = h * w
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            # 区域大小在 500 到图片面积 5% 之间
-            if 500 < area < total_area * 0.05:
-                cv2.drawContours(mask, [contour], -1, 255, -1)
-
-        # 轻微膨胀
-        if np.sum(mask > 0) > 0:
-            kernel = np.ones((3, 3), np.uint8)
-            mask = cv2.dilate(mask, kernel, iterations=1)
+        # 缩小图上 float32 梯度 + 方向直方图估计主斜向角度，只放大最终 mask
+        mask, info = detect_diagonal_text(ctx)
 
         watermark_pixels = np.sum(mask > 0)
         coverage = 100 * watermark_pixels / (h * w)
-        print(f"Diagonal text detection: {watermark_pixels} pixels ({coverage:.2f}%)")
+        print(f"Diagonal text detection: {watermark_pixels} pixels ({coverage:.2f}%), {info}")
 
         # 安全检查：如果检测超过 30% 的图片，认为是误检测，返回空 mask
         if coverage > 30:
@@ -621,20 +450,18 @@ class FixPicAPI:
         import numpy as np
         from PIL import Image
         import cv2
+        from fixpic.image_context import ImageContext
 
-        image_np = np.array(image)
-        h, w = image_np.shape[:2]
+        ctx = ImageContext.of(image)
+        w, h = ctx.size
         mask = np.zeros((h, w), dtype=np.uint8)
 
         # 提取左侧边缘区域（更窄，只取 12%）
         left_width = int(w * 0.12)
-        left_region = image_np[:, :left_width]
 
         # 将左侧区域旋转 90 度，让垂直文字变成水平文字便于 OCR 识别
-        left_rotated = cv2.rotate(left_region, cv2.ROTATE_90_CLOCKWISE)
-
-        # 增强对比度（水印通常是半透明的）
-        left_gray = cv2.cvtColor(left_rotated, cv2.COLOR_RGB2GRAY)
+        # 增强对比度（水印通常是半透明的），灰度直接取共享上下文
+        left_gray = cv2.rotate(ctx.gray[:, :left_width], cv2.ROTATE_90_CLOCKWISE)
 
         # 使用 CLAHE 增强对比度
         clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
@@ -652,7 +479,7 @@ class FixPicAPI:
         # 水印关键词
         watermark_keywords = ['adobe', 'stock', '©', '#']
 
-        rotated_h, rotated_w = left_rotated.shape[:2]
+        rotated_h, rotated_w = left_gray.shape[:2]
         mask_rotated = np.zeros((rotated_h, rotated_w), dtype=np.uint8)
 
         for (bbox, text, confidence) in results:
@@ -700,18 +527,17 @@ class FixPicAPI:
         import numpy as np
         from PIL import Image
         import cv2
+        from fixpic.image_context import ImageContext
 
-        image_np = np.array(image)
-        h, w = image_np.shape[:2]
+        ctx = ImageContext.of(image)
+        w, h = ctx.size
         mask = np.zeros((h, w), dtype=np.uint8)
 
         # 只分析左侧 15% 区域
         left_width = int(w * 0.15)
-        left_region = image_np[:, :left_width]
 
-        # 转换到 LAB 色彩空间
-        left_lab = cv2.cvtColor(left_region, cv2.COLOR_RGB2LAB)
-        left_l = left_lab[:, :, 0].astype(np.float32)
+        # LAB 色彩空间 L 通道
+        left_l = ctx.lab[:, :left_width, 0].astype(np.float32)
 
         # 高通滤波，突出局部变化
         kernel_size = 15
@@ -908,19 +734,22 @@ asyncio.run(upload())
 
     @modal.fastapi_endpoint(method="POST")
     def remove_bg(self, request: RemoveBgRequest):
-        """自动抠图 - 去除背景（优先使用 Pixelbin，fallback 到 rembg）"""
+        """自动抠图 - 去除背景（纯色背景走快速路径，其余优先 Pixelbin，fallback 到 rembg）"""
         from PIL import Image
         from rembg import remove
+        from fixpic.matting import remove_background_capped
+        from fixpic.product_bg import try_remove_uniform_background
 
         # 解码图片
         image_data = base64.b64decode(request.image_base64)
         input_image = Image.open(io.BytesIO(image_data))
 
-        # 优先尝试 Pixelbin API
-        output_image = None
-        method_used = "rembg"
+        # 纯色棚拍背景直接用颜色抠图，不占用 Pixelbin / GPU
+        output_image = try_remove_uniform_background(input_image)
+        method_used = "classical" if output_image is not None else "rembg"
 
-        if self.pixelbin_api_secret:
+        # 尝试 Pixelbin API
+        if output_image is None and self.pixelbin_api_secret:
             try:
                 print("Trying Pixelbin erase.bg API...")
                 output_image = self._remove_bg_pixelbin(input_image.convert('RGB'))
@@ -933,7 +762,7 @@ asyncio.run(upload())
         # Fallback 到 rembg
         if output_image is None:
             print("Using rembg fallback...")
-            output_image = remove(input_image)
+            output_image = remove_background_capped(input_image, remove)
 
         # 编码结果
         buffered = io.BytesIO()
@@ -953,6 +782,7 @@ asyncio.run(upload())
         """换背景"""
         from PIL import Image
         from rembg import remove
+        from fixpic.matting import remove_background_capped
 
         # 解码原图
         image_data = base64.b64decode(request.image_base64)
@@ -968,7 +798,7 @@ asyncio.run(upload())
 
         # Fallback 到 rembg
         if fg_image is None:
-            fg_image = remove(input_image)
+            fg_image = remove_background_capped(input_image, remove)
 
         if request.bg_type == "transparent":
             output_image = fg_image
@@ -1008,34 +838,39 @@ asyncio.run(upload())
     def sam_segment(self, request: SamSegmentRequest):
         """SAM 点击分割"""
         import numpy as np
+        import cv2
         from PIL import Image
+        from fixpic.decode import DecodedImage
 
-        # 解码图片
+        # 解码图片：SAM 内部按 1024px 处理，直接解码缩小图
         image_data = base64.b64decode(request.image_base64)
-        input_image = Image.open(io.BytesIO(image_data)).convert('RGB')
-        image_array = np.array(input_image)
+        source = DecodedImage.from_bytes(image_data)
+        image_array = source.array(SAM_INPUT_SIDE)
+        scale = image_array.shape[1] / source.width
 
         # 获取 SAM 预测器
         predictor = self._get_sam_predictor()
         predictor.set_image(image_array)
 
-        # 准备点击点和标签
-        input_points = np.array([[p.x, p.y] for p in request.points])
+        # 准备点击点和标签（坐标同比缩放）
+        input_points = np.array([[p.x * scale, p.y * scale] for p in request.points])
         input_labels = np.array([p.label for p in request.points])
 
         # 预测分割掩码
         masks, scores, _ = predictor.predict(
             point_coords=input_points,
             point_labels=input_labels,
-            multimask_output=True
+            multimask_output=True,
+            return_logits=True
         )
 
-        # 选择得分最高的掩码
+        # 选择得分最高的掩码，logits 上采样到原图尺寸后再阈值化
         best_idx = np.argmax(scores)
-        mask = masks[best_idx]
+        logits = cv2.resize(masks[best_idx].astype(np.float32), source.size, interpolation=cv2.INTER_LINEAR)
+        mask = logits > predictor.model.mask_threshold
 
-        # 应用掩码
-        input_rgba = np.array(input_image.convert('RGBA'))
+        # 应用掩码（全分辨率）
+        input_rgba = np.array(source.full().convert('RGBA'))
         output_array = np.zeros_like(input_rgba)
         output_array[mask] = input_rgba[mask]
         output_image = Image.fromarray(output_array, 'RGBA')
@@ -1210,33 +1045,49 @@ asyncio.run(upload())
         import numpy as np
         from PIL import Image
         import traceback
+        from fixpic.decode import DecodedImage
+        from fixpic.image_context import ImageContext
+        from fixpic.templates import get_template_library
 
         try:
-            # 解码图片
+            # 解码图片，所有检测器共享同一个图像上下文
             image_data = base64.b64decode(request.image_base64)
-            input_image = Image.open(io.BytesIO(image_data)).convert('RGB')
+            ctx = ImageContext(DecodedImage.from_bytes(image_data))
+            input_image = ctx.image
 
             print(f"Processing image: {input_image.size}")
 
             masks = []
             detection_info = {}
 
-            # OCR 文字检测
+            # 已知图库水印模板匹配：命中的模板 mask 与其他检测结果合并
+            template_mask, template_info = None, {}
             try:
-                print("OCR detection...")
-                ocr_mask, ocr_pixels = self._detect_watermark_mask_ocr(input_image, aggressive=True)
-                if ocr_pixels > 0:
-                    masks.append(ocr_mask)
-                    detection_info['ocr'] = int(ocr_pixels)
-                    print(f"  OCR: {ocr_pixels} pixels")
+                template_mask, template_info = get_template_library().match(ctx)
             except Exception as e:
-                print(f"OCR error: {e}")
-                detection_info['ocr_error'] = str(e)
+                print(f"Template matching error: {e}")
+            if template_mask is not None:
+                masks.append(Image.fromarray(template_mask))
+                detection_info['template'] = template_info
+
+            # 模板只覆盖登记过的标识；已定位平铺 logo 时才跳过 OCR，横条 / Adobe Stock 检测开销小，始终运行
+            if template_mask is None or not template_info.get('tiles'):
+                # OCR 文字检测
+                try:
+                    print("OCR detection...")
+                    ocr_mask, ocr_pixels = self._detect_watermark_mask_ocr(ctx, aggressive=True)
+                    if ocr_pixels > 0:
+                        masks.append(ocr_mask)
+                        detection_info['ocr'] = int(ocr_pixels)
+                        print(f"  OCR: {ocr_pixels} pixels")
+                except Exception as e:
+                    print(f"OCR error: {e}")
+                    detection_info['ocr_error'] = str(e)
 
             # 底部横条检测
             try:
                 print("Bar detection...")
-                bar_mask, bar_pixels = self._detect_bar_watermarks_simple(input_image)
+                bar_mask, bar_pixels = self._detect_bar_watermarks_simple(ctx)
                 if bar_pixels > 0:
                     masks.append(bar_mask)
                     detection_info['bar'] = int(bar_pixels)
@@ -1248,7 +1099,7 @@ asyncio.run(upload())
             # Adobe Stock 左侧水印检测
             try:
                 print("Adobe Stock detection...")
-                adobe_mask, adobe_pixels = self._detect_adobe_stock_watermark(input_image)
+                adobe_mask, adobe_pixels = self._detect_adobe_stock_watermark(ctx)
                 if adobe_pixels > 0:
                     masks.append(adobe_mask)
                     detection_info['adobe_stock'] = int(adobe_pixels)
@@ -1339,8 +1190,22 @@ asyncio.run(upload())
 
     @modal.fastapi_endpoint(method="GET")
     def health(self):
-        """健康检查"""
-        return {'status': 'ok'}
+        """健康检查：预热中或必需模型预热失败时返回 503；含各模型同步 / 预热状态和冷启动耗时"""
+        from fastapi.responses import JSONResponse
+        from fixpic.weights import load_times
+
+        warmup = self.warmup.status()
+        ready = warmup['ready']
+        body = {
+            'status': warmup['state'],
+            'ready': ready,
+            'failed': warmup['failed'],
+            'optional_failed': warmup['optional_failed'],
+            'warmup': warmup['models'],
+            'models': self.models.status(),
+            'cold_start': {'setup': self.setup_seconds, 'models': load_times()},
+        }
+        return body if ready else JSONResponse(status_code=503, content=body)
 
 
 
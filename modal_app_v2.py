@@ -28,6 +28,7 @@ image = (
         "opencv-python-headless",
         "replicate",
         "requests",
+        "httpx",  # 异步接口的 HTTP 客户端
         "easyocr",
         "ultralytics",
         "huggingface_hub",
@@ -43,6 +44,8 @@ image = (
         "python -c 'from simple_lama_inpainting import SimpleLama; SimpleLama()' || true",
         "echo 'Image v2.6 ready with EasyOCR + LaMa inpainting'",
     )
+    .add_local_python_source("fixpic")  # 公共图像处理库
+    .add_local_dir("fixpic/template_assets", remote_path="/root/fixpic/template_assets")  # 发布的水印模板
 )
 
 # 创建 Modal App with Pixelbin secret
@@ -50,8 +53,35 @@ app = modal.App("fixpic-api", image=image)
 
 # Volume
 volume = modal.Volume.from_name("fixpic-models", create_if_missing=True)
+# 异步任务状态（跨容器共享，结果按 JOB_TTL_SECONDS 保存）
+jobs_dict = modal.Dict.from_name("fixpic-jobs", create_if_missing=True)
 MODEL_DIR = "/models"
 
+# 检测阶段的解码分辨率（长边像素）
+SAM_INPUT_SIDE = 1024
+YOLO_MAX_SIDE = 1280
+BAR_MAX_SIDE = 1024
+FLORENCE_MAX_SIDE = 1024
+# 是否把 Florence-2 grounding 加入检测器级联（排在最后，由调度器按收益决定是否运行）
+FLORENCE_DETECTOR = os.environ.get("FLORENCE_DETECTOR", "1") == "1"
+# 单个容器同时处理的请求数；SAM 按此数量准备 predictor 实例（共享权重）
+MAX_CONCURRENT_INPUTS = int(os.environ.get("MAX_CONCURRENT_INPUTS", "4"))
+# 异步接口等待远程 API 时不占用线程，容器可以接收更多请求（GPU 模型仍由锁 / 池限制并发）；
+# 自动扩容按 MAX_CONCURRENT_INPUTS 计算，突发时最多接收 MAX_INPUTS 个
+MAX_INPUTS = int(os.environ.get("MAX_INPUTS", "16"))
+# 盲水印的 256x256 tile 单批上限单独设置（动态批处理的其余参数见 fixpic.batcher）。
+# 显存预算只计权重，激活值随批大小线性增长，默认与 BATCH_MAX_SIZE 一致取 8，显存充裕时再调大
+BLIND_TILE_BATCH = int(os.environ.get("BLIND_TILE_BATCH", "8"))
+# 异步接口中同时等待的远程调用（Replicate）数量上限
+REMOTE_CONCURRENCY = int(os.environ.get("REMOTE_CONCURRENCY", "4"))
+SDXL_MODEL = "stability-ai/sdxl:7762fd07cf82c948538e41f63f77d685e02b063e37e496e96eefd46c929f9bdc"
+# 启动时预热的模型（WARMUP_MODELS 覆盖，all 表示全部）
+WARMUP_DEFAULT = "sam_vit_b,segformer_clothes,easyocr,lama"
+# 可选模型：预热失败时容器仍然接收请求（health 返回 200 并列出失败的模型），相应检测器跳过
+WARMUP_OPTIONAL = os.environ.get("WARMUP_OPTIONAL", "florence2_base,clip_vit_b32,yolo_watermark,blind_watermark")
+# 平铺水印检测结果的最大覆盖率（%），超过视为误检
+PATTERN_MAX_COVERAGE = float(os.environ.get("PATTERN_MAX_COVERAGE", "15"))
+
 # 服装分割类别
 CLOTHES_LABELS_CN = {
     0: '背景', 1: '帽子', 2: '头发', 3: '太阳镜', 4: '上衣',
@@ -107,6 +137,13 @@ class InpaintRequest(BaseModel):
 
 class AutoRemoveWatermarkRequest(BaseModel):
     image_base64: str
+    source: Optional[str] = None  # 流量来源（客户 / 图库），检测器调度按来源学习
+
+
+class AutoRemoveWatermarkBatchRequest(BaseModel):
+    """批量去水印请求（同一图库的多张预览图）"""
+    images_base64: List[str]
+    source: Optional[str] = None
 
 
 class ChangeBgAIRequest(BaseModel):
@@ -115,6 +152,36 @@ class ChangeBgAIRequest(BaseModel):
     num_backgrounds: int = 5
 
 
+class JobSubmitRequest(BaseModel):
+    """异步任务提交：kind 为接口名，request 为该接口的请求体"""
+    kind: str
+    request: dict
+    webhook_url: Optional[str] = None  # 任务结束后 POST 任务状态（仅 https 公网地址）
+
+
+class RemoveFakeTransparencyRequest(BaseModel):
+    """去假透明背景请求（支持批量）"""
+    images_base64: List[str]
+
+
+class CompressRequest(BaseModel):
+    """批量压缩 / 格式转换请求"""
+    images_base64: List[str]
+    preset: Optional[str] = None  # 平台预设，如 taobao_white / jd
+    format: Optional[str] = None  # webp / png / jpeg
+    quality: Optional[int] = None
+    max_width: Optional[int] = None
+    max_bytes: Optional[int] = None  # 压缩到 N 字节以内
+    min_bytes: Optional[int] = None
+
+
+# 支持异步任务的接口及其请求体
+JOB_KINDS = {
+    'auto_remove_watermark': AutoRemoveWatermarkRequest,
+    'change_bg_ai': ChangeBgAIRequest,
+}
+
+
 @app.cls(
     gpu="T4",
     volumes={MODEL_DIR: volume},
@@ -125,12 +192,26 @@ class ChangeBgAIRequest(BaseModel):
         modal.Secret.from_name("pixelbin-api-key"),  # Pixelbin 去水印 API
     ],
 )
+@modal.concurrent(max_inputs=max(MAX_INPUTS, MAX_CONCURRENT_INPUTS), target_inputs=MAX_CONCURRENT_INPUTS)
 class FixPicAPI:
     """FixPic API 服务类 V2"""
 
     @modal.enter()
     def setup(self):
         """容器启动时初始化"""
+        import threading
+        import time
+        from fixpic.model_registry import get_model_registry
+
+        setup_start = time.time()
+
+        # 模型只从 Volume 读取（由 sync_models 预先同步），加载时不联网
+        self.models = get_model_registry(MODEL_DIR)
+        self.models.configure_offline()
+        missing = [name for name, s in self.models.status().items() if not s['ready']]
+        if missing:
+            print(f"Models not synced or not pinned (run sync_models / model_registry pin): {', '.join(missing)}")
+
         import torch
 
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
@@ -142,165 +223,285 @@ class FixPicAPI:
             print("Replicate API token configured")
 
 
-        # 延迟加载模型
-        self.sam_predictor = None
-        self.clothes_processor = None
-        self.clothes_model = None
-        self.florence_model = None
-        self.florence_processor = None
-        self.ocr_reader = None
-
-    def _get_sam_predictor(self):
-        """延迟加载 SAM 模型"""
-        if self.sam_predictor is None:
-            import torch
-            from segment_anything import sam_model_registry, SamPredictor
-            import urllib.request
-
-            sam_path = f"{MODEL_DIR}/sam_vit_b.pth"
-
-            if not os.path.exists(sam_path):
-                print("Downloading SAM model...")
-                url = "https://dl.fbaipublicfiles.com/segment_anything/sam_vit_b_01ec64.pth"
-                urllib.request.urlretrieve(url, sam_path)
-                volume.commit()
-                print("SAM model downloaded!")
-
-            print("Loading SAM model...")
-            sam = sam_model_registry["vit_b"](checkpoint=sam_path)
-            sam.to(self.device)
-            self.sam_predictor = SamPredictor(sam)
-            print("SAM model loaded!")
-
-        return self.sam_predictor
-
-    def _get_clothes_model(self):
-        """延迟加载服装分割模型"""
-        if self.clothes_model is None:
-            from transformers import SegformerImageProcessor, AutoModelForSemanticSegmentation
-
-            print("Loading clothes segmentation model...")
-            self.clothes_processor = SegformerImageProcessor.from_pretrained(
-                "mattmdjaga/segformer_b2_clothes"
-            )
-            self.clothes_model = AutoModelForSemanticSegmentation.from_pretrained(
-                "mattmdjaga/segformer_b2_clothes"
-            )
-            self.clothes_model.to(self.device)
-            print("Clothes model loaded!")
+        # 模型按需加载，由 ModelManager 按显存 / 内存预算管理驻留
+        self._init_model_manager()
+        self._init_batchers()
+        self.detector_registry = None
+        self._registry_lock = threading.Lock()
+        self.http_client = None  # 异步接口共用的 httpx.AsyncClient（首次使用时创建）
+
+        from fixpic.jobs import JobStore
+
+        self.jobs = JobStore(jobs_dict)
+
+        # 预热：加载选中的模型并各跑一次假数据推理（Modal 在 setup 完成后才分配请求）
+        from fixpic.warmup import Warmup, selected_models
+
+        steps = self._warmup_steps()
+        self.warmup = Warmup(selected_models(WARMUP_DEFAULT, steps),
+                             optional=[n.strip() for n in WARMUP_OPTIONAL.split(',') if n.strip()])
+        self.warmup.run(steps)
+
+        self.setup_seconds = round(time.time() - setup_start, 3)
+        print(f"[cold-start] setup in {self.setup_seconds:.2f}s")
 
-        return self.clothes_processor, self.clothes_model
+    def _init_model_manager(self):
+        """注册各模型的加载函数（预估占用单位 MB，加载后按实测值）
 
-    def _get_florence_model(self):
-        """延迟加载 Florence-2 模型"""
-        if self.florence_model is None:
-            from transformers import AutoProcessor, AutoModelForCausalLM
-            import torch
+        并发请求下：SAM 为 predictor 池（各实例持有自己的图片 embedding）；
+        EasyOCR / YOLO / LaMa / Florence（分词器）内部状态不可并发，注册为 exclusive；
+        Segformer / 盲水印 / CLIP 只做无状态 forward（CLIP 分类器自带锁），可以并发使用。
+        """
+        from fixpic.model_manager import ModelManager, move_item, move_module
 
-            print("Loading Florence-2 model...")
-            model_id = "microsoft/Florence-2-base"
+        self.model_manager = ModelManager(self.device)
+        mm = self.model_manager
 
-            self.florence_processor = AutoProcessor.from_pretrained(
+        def move_sam(pool, device):
+            pool.to(device)  # 同时释放各实例缓存的图像特征
+
+        # 大模型支持卸载到 CPU；EasyOCR / YOLO / LaMa / CLIP 内部记录了设备，直接释放
+        mm.register('sam_vit_b', self._load_sam_predictor, move_sam, estimate_mb=400)
+        mm.register('segformer_clothes', self._load_clothes_model, move_item(1), estimate_mb=120)
+        mm.register('florence2_base', self._load_florence_model, move_item(1), estimate_mb=500, exclusive=True)
+        mm.register('clip_vit_b32', self._load_subject_classifier, estimate_mb=600)
+        mm.register('yolo_watermark', self._load_yolo_watermark_model, estimate_mb=50, exclusive=True)
+        mm.register('blind_watermark', self._load_blind_watermark_model, move_module, estimate_mb=130)
+        mm.register('easyocr', self._load_ocr_reader, estimate_mb=150, exclusive=True)
+        mm.register('lama', self._load_lama, estimate_mb=200, exclusive=True)
+
+    def _init_batchers(self):
+        """并发请求的动态批处理：Segformer 输入统一缩放到 512x512，盲水印按 256x256 tile，
+        同形状的输入合并为一次 forward"""
+        from fixpic.batcher import DynamicBatcher
+
+        self.clothes_batcher = DynamicBatcher('segformer_clothes', self._clothes_forward)
+        self.blind_batcher = DynamicBatcher('blind_watermark', self._blind_forward, max_batch=BLIND_TILE_BATCH)
+
+    def _clothes_forward(self, batch):
+        """一批 Segformer pixel_values → 各自的 logits（仍在 GPU 上）"""
+        import torch
+
+        with self.model_manager.use('segformer_clothes') as (_, model):
+            with torch.no_grad():
+                logits = model(pixel_values=torch.stack(batch).to(self.device)).logits
+        return list(logits)
+
+    def _blind_forward(self, batch):
+        """一批 256x256 RGB tile（uint8）→ 模型输出（float，0~1）"""
+        import numpy as np
+        import torch
+
+        with self.model_manager.use('blind_watermark') as model:
+            tensor = torch.from_numpy(np.stack(batch)).permute(0, 3, 1, 2).float() / 255.0
+            with torch.no_grad():
+                output = model(tensor.to(self.device))
+        return list(output.permute(0, 2, 3, 1).cpu().numpy())
+
+    def _segment_clothes(self, image):
+        """服装分割 logits [1, 类别数, h, w]；并发请求经批处理器合并推理"""
+        with self.model_manager.use('segformer_clothes') as (processor, _):
+            pixel_values = processor(images=image, return_tensors="pt")["pixel_values"][0]
+        logits = self.clothes_batcher.submit(pixel_values, key=tuple(pixel_values.shape))
+        return logits.unsqueeze(0)
+
+    def _warmup_steps(self):
+        """各模型的预热函数：加载 + 一次假数据推理（触发 CUDA 初始化与 cuDNN 自动调优）"""
+        import numpy as np
+        import torch
+        from PIL import Image
+
+        def sam():
+            with self.model_manager.use('sam_vit_b') as pool, pool.acquire() as predictor:
+                predictor.set_image(np.zeros((SAM_INPUT_SIDE, SAM_INPUT_SIDE, 3), dtype=np.uint8))
+                predictor.predict(point_coords=np.array([[512, 512]]), point_labels=np.array([1]))
+                predictor.reset_image()
+
+        def clothes():
+            with self.model_manager.use('segformer_clothes') as (processor, model):
+                inputs = processor(images=Image.new('RGB', (512, 512)), return_tensors="pt")
+                with torch.no_grad():
+                    model(**{k: v.to(self.device) for k, v in inputs.items()})
+
+        def florence():
+            from fixpic.florence import run_prompts
+
+            with self.model_manager.use('florence2_base') as (processor, model):
+                run_prompts(processor, model, Image.new('RGB', (768, 768)),
+                            ["<CAPTION_TO_PHRASE_GROUNDING>watermark"], self.device, max_new_tokens=8)
+
+        def clip():
+            with self.model_manager.use('clip_vit_b32') as classifier:
+                classifier.classify(Image.new('RGB', (224, 224)), key='warmup')
+
+        def yolo():
+            with self.model_manager.use('yolo_watermark') as model:
+                if model is None:
+                    raise RuntimeError("YOLOv8 watermark model not available")
+                model.predict(np.zeros((640, 640, 3), dtype=np.uint8), verbose=False)
+
+        def blind():
+            with self.model_manager.use('blind_watermark') as model:
+                if model is None:
+                    raise RuntimeError("Blind watermark model not available")
+                with torch.no_grad():
+                    model(torch.zeros(1, 3, 256, 256, device=self.device))
+
+        def ocr():
+            with self.model_manager.use('easyocr') as reader:
+                reader.readtext(np.full((64, 256, 3), 255, dtype=np.uint8))
+
+        def lama():
+            with self.model_manager.use('lama') as model:
+                model(Image.new('RGB', (512, 512)), Image.new('L', (512, 512)))
+
+        return {
+            'sam_vit_b': sam,
+            'segformer_clothes': clothes,
+            'florence2_base': florence,
+            'clip_vit_b32': clip,
+            'yolo_watermark': yolo,
+            'blind_watermark': blind,
+            'easyocr': ocr,
+            'lama': lama,
+        }
+
+    def _load_sam_predictor(self):
+        """加载 SAM 模型（MAX_CONCURRENT_INPUTS 个 predictor 共享同一份权重）"""
+        from segment_anything import sam_model_registry, SamPredictor
+        from fixpic.model_manager import PredictorPool
+        from fixpic.weights import load_module, timed_load
+
+        self.models.require('sam_vit_b')
+
+        print("Loading SAM model...")
+        with timed_load('sam_vit_b'):
+            # 参数在 meta 上构建（pixel_mean / pixel_std 等非持久 buffer 照常创建），safetensors 权重 mmap 后直接挂载
+            sam = load_module(sam_model_registry["vit_b"], self.models.weights('sam_vit_b'), self.device)
+            pool = PredictorPool(sam, SamPredictor, MAX_CONCURRENT_INPUTS)
+        print(f"SAM model loaded! ({pool.size} predictors)")
+        return pool
+
+    def _load_clothes_model(self):
+        """加载服装分割模型"""
+        from transformers import SegformerImageProcessor, AutoModelForSemanticSegmentation
+        from fixpic.weights import timed_load
+
+        model_path = self.models.require('segformer_clothes')
+
+        print("Loading clothes segmentation model...")
+        with timed_load('segformer_clothes'):
+            processor = SegformerImageProcessor.from_pretrained(model_path)
+            model = AutoModelForSemanticSegmentation.from_pretrained(
+                model_path, low_cpu_mem_usage=True
+            )
+            model.to(self.device)
+        print("Clothes model loaded!")
+        return processor, model
+
+    def _load_florence_model(self):
+        """加载 Florence-2 模型"""
+        from transformers import AutoProcessor, AutoModelForCausalLM
+        import torch
+        from fixpic.weights import timed_load
+
+        print("Loading Florence-2 model...")
+        model_id = self.models.require('florence2_base')
+
+        with timed_load('florence2_base'):
+            processor = AutoProcessor.from_pretrained(
                 model_id, trust_remote_code=True
             )
-            self.florence_model = AutoModelForCausalLM.from_pretrained(
+            model = AutoModelForCausalLM.from_pretrained(
                 model_id,
                 trust_remote_code=True,
                 torch_dtype=torch.float16 if self.device == "cuda" else torch.float32
             ).to(self.device)
-            print("Florence-2 model loaded!")
+        print("Florence-2 model loaded!")
+        return processor, model
 
-        return self.florence_processor, self.florence_model
+    def _load_subject_classifier(self):
+        """加载主体分类器（AI 换背景用）"""
+        from fixpic.subject_classifier import SubjectClassifier
 
-    def _get_yolo_watermark_model(self):
-        """延迟加载 YOLOv8 水印检测模型 (可选)"""
-        if not hasattr(self, 'yolo_watermark_model'):
-            self.yolo_watermark_model = None
+        classifier = SubjectClassifier(self.device, self.models.require('clip_vit_b32'))
+        classifier.load()
+        return classifier
 
-        if self.yolo_watermark_model is None:
-            try:
-                from ultralytics import YOLO
-                from huggingface_hub import hf_hub_download
-
-                print("Attempting to load YOLOv8 watermark detection model...")
-                model_path = hf_hub_download(
-                    repo_id="mnemic/watermarks_yolov8",
-                    filename="watermarks_yolov8s.pt"
-                )
-                self.yolo_watermark_model = YOLO(model_path)
-                print("YOLOv8 watermark model loaded!")
-            except Exception as e:
-                print(f"YOLOv8 watermark model not available: {e}")
-                self.yolo_watermark_model = None
-
-        return self.yolo_watermark_model
+    def _load_yolo_watermark_model(self):
+        """加载 YOLOv8 水印检测模型 (可选，不可用时返回 None)"""
+        try:
+            from ultralytics import YOLO
+            from fixpic.weights import timed_load
+
+            print("Attempting to load YOLOv8 watermark detection model...")
+            model_path = self.models.require('yolo_watermark')
+            with timed_load('yolo_watermark'):
+                model = YOLO(model_path)
+            print("YOLOv8 watermark model loaded!")
+            return model
+        except Exception as e:
+            print(f"YOLOv8 watermark model not available: {e}")
+            return None
 
-    def _get_blind_watermark_model(self):
-        """延迟加载盲水印去除模型 (可选，如果模型不可用则返回 None)"""
-        if not hasattr(self, 'blind_wm_model'):
-            self.blind_wm_model = None  # 默认为 None
+    def _load_blind_watermark_model(self):
+        """加载盲水印去除模型 (可选，如果模型不可用则返回 None)"""
+        import torch
+        import torch.nn as nn
 
-        if self.blind_wm_model is None:
-            import torch
-            import torch.nn as nn
-            from huggingface_hub import hf_hub_download
+        print("Attempting to load blind watermark removal model...")
 
-            print("Attempting to load blind watermark removal model...")
+        try:
+            # 定义模型架构
+            class WatermarkRemover(nn.Module):
+                def __init__(self):
+                    super(WatermarkRemover, self).__init__()
+                    self.enc1 = self._conv_block(3, 64)
+                    self.enc2 = self._conv_block(64, 128)
+                    self.enc3 = self._conv_block(128, 256)
+                    self.enc4 = self._conv_block(256, 512)
+                    self.bottleneck = self._conv_block(512, 1024)
+                    self.dec4 = self._conv_block(1024 + 512, 512)
+                    self.dec3 = self._conv_block(512 + 256, 256)
+                    self.dec2 = self._conv_block(256 + 128, 128)
+                    self.dec1 = self._conv_block(128 + 64, 64)
+                    self.final_layer = nn.Conv2d(64, 3, kernel_size=1)
+                    self.pool = nn.MaxPool2d(2)
+                    self.up = nn.Upsample(scale_factor=2, mode='bilinear', align_corners=True)
+
+                def _conv_block(self, in_ch, out_ch):
+                    return nn.Sequential(
+                        nn.Conv2d(in_ch, out_ch, kernel_size=3, padding=1),
+                        nn.ReLU(inplace=True),
+                        nn.Conv2d(out_ch, out_ch, kernel_size=3, padding=1),
+                        nn.ReLU(inplace=True),
+                    )
 
-            try:
-                # 定义模型架构
-                class WatermarkRemover(nn.Module):
-                    def __init__(self):
-                        super(WatermarkRemover, self).__init__()
-                        self.enc1 = self._conv_block(3, 64)
-                        self.enc2 = self._conv_block(64, 128)
-                        self.enc3 = self._conv_block(128, 256)
-                        self.enc4 = self._conv_block(256, 512)
-                        self.bottleneck = self._conv_block(512, 1024)
-                        self.dec4 = self._conv_block(1024 + 512, 512)
-                        self.dec3 = self._conv_block(512 + 256, 256)
-                        self.dec2 = self._conv_block(256 + 128, 128)
-                        self.dec1 = self._conv_block(128 + 64, 64)
-                        self.final_layer = nn.Conv2d(64, 3, kernel_size=1)
-                        self.pool = nn.MaxPool2d(2)
-                        self.up = nn.Upsample(scale_factor=2, mode='bilinear', align_corners=True)
-
-                    def _conv_block(self, in_ch, out_ch):
-                        return nn.Sequential(
-                            nn.Conv2d(in_ch, out_ch, kernel_size=3, padding=1),
-                            nn.ReLU(inplace=True),
-                            nn.Conv2d(out_ch, out_ch, kernel_size=3, padding=1),
-                            nn.ReLU(inplace=True),
-                        )
-
-                    def forward(self, x):
-                        e1 = self.enc1(x)
-                        e2 = self.enc2(self.pool(e1))
-                        e3 = self.enc3(self.pool(e2))
-                        e4 = self.enc4(self.pool(e3))
-                        b = self.bottleneck(self.pool(e4))
-                        d4 = self.dec4(torch.cat((self.up(b), e4), dim=1))
-                        d3 = self.dec3(torch.cat((self.up(d4), e3), dim=1))
-                        d2 = self.dec2(torch.cat((self.up(d3), e2), dim=1))
-                        d1 = self.dec1(torch.cat((self.up(d2), e1), dim=1))
-                        return self.final_layer(d1)
-
-                # 下载并加载模型权重
-                model_path = hf_hub_download(
-                    repo_id="foduucom/Watermark_Removal",
-                    filename="watermark_remover.pth"
+                def forward(self, x):
+                    e1 = self.enc1(x)
+                    e2 = self.enc2(self.pool(e1))
+                    e3 = self.enc3(self.pool(e2))
+                    e4 = self.enc4(self.pool(e3))
+                    b = self.bottleneck(self.pool(e4))
+                    d4 = self.dec4(torch.cat((self.up(b), e4), dim=1))
+                    d3 = self.dec3(torch.cat((self.up(d4), e3), dim=1))
+                    d2 = self.dec2(torch.cat((self.up(d3), e2), dim=1))
+                    d1 = self.dec1(torch.cat((self.up(d2), e1), dim=1))
+                    return self.final_layer(d1)
+
+            # 加载预先同步的模型权重（safetensors mmap）
+            from fixpic.weights import load_module, timed_load
+
+            self.models.require('blind_watermark')
+            with timed_load('blind_watermark'):
+                model = load_module(
+                    WatermarkRemover, self.models.weights('blind_watermark'), self.device
                 )
-                model = WatermarkRemover()
-                model.load_state_dict(torch.load(model_path, map_location=self.device))
-                model.to(self.device)
-                model.eval()
-                self.blind_wm_model = model
-                print("Blind watermark removal model loaded!")
-            except Exception as e:
-                print(f"Blind watermark model not available: {e}")
-                self.blind_wm_model = None
-
-        return self.blind_wm_model
+            print("Blind watermark removal model loaded!")
+            return model
+        except Exception as e:
+            print(f"Blind watermark model not available: {e}")
+            return None
 
     def _remove_watermark_pixelbin(self, image):
         """使用 Pixelbin API 去除水印 (效果最好) - 纯 HTTP 请求实现"""
@@ -402,21 +603,97 @@ asyncio.run(upload())
             traceback.print_exc()
             return None
 
+    async def _remove_watermark_pixelbin_async(self, image):
+        """Pixelbin 去水印（异步版本）：在事件循环中直接调用 SDK 的异步上传，
+        上传和下载转换结果期间不占用线程；JPEG 编码和结果解码在线程池中执行"""
+        import asyncio
+        import time
+        from PIL import Image as PILImage
+
+        api_secret = os.environ.get('PIXELBIN_API_SECRET', '')
+        cloud_name = os.environ.get('PIXELBIN_CLOUD_NAME', '')
+
+        if not api_secret or not cloud_name:
+            print("Pixelbin credentials not configured, skipping...")
+            return None
+
+        try:
+            from pixelbin import PixelbinConfig, PixelbinClient
+
+            def encode():
+                with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp_file:
+                    image.save(tmp_file, format='JPEG', quality=95)
+                    return tmp_file.name
+
+            tmp_path = await asyncio.to_thread(encode)
+
+            print("Uploading to Pixelbin (async)...")
+            config = PixelbinConfig({
+                "domain": "https://api.pixelbin.io",
+                "apiSecret": api_secret,
+            })
+            client = PixelbinClient(config=config)
+            try:
+                with open(tmp_path, "rb") as f:
+                    upload_result = await client.assets.fileUploadAsync(
+                        file=f,
+                        path="watermark_temp",
+                        name=f"wm_removal_{int(time.time() * 1000)}",
+                        access="public-read",
+                        overwrite=True,
+                    )
+            finally:
+                os.unlink(tmp_path)
+
+            if not upload_result or 'fileId' not in upload_result:
+                print(f"Upload failed: {upload_result}")
+                return None
+
+            file_path = upload_result.get('fileId', '')
+            transform_url = f"https://cdn.pixelbin.io/v2/{cloud_name}/wm.remove(rem_text:true,rem_logo:true)/{file_path}"
+            print(f"Fetching transformed image: {transform_url}")
+
+            response = await self._http_get(transform_url, timeout=120)
+            if response.status_code == 200:
+                result_image = await asyncio.to_thread(
+                    lambda: PILImage.open(io.BytesIO(response.content)).convert('RGB'))
+                print("Pixelbin watermark removal successful!")
+                return result_image
+            print(f"Transform failed: {response.status_code} - {response.text[:200]}")
+            return None
+
+        except Exception as e:
+            print(f"Pixelbin API error: {e}")
+            import traceback
+            traceback.print_exc()
+            return None
+
+    async def _http_get(self, url, timeout=60):
+        """异步 GET（容器内共用一个连接池）"""
+        import httpx
+
+        if self.http_client is None:
+            self.http_client = httpx.AsyncClient(follow_redirects=True)
+        return await self.http_client.get(url, timeout=timeout)
+
     def _remove_watermark_blind(self, image):
         """使用盲水印去除模型处理图片 (可选)"""
-        import torch
+        try:
+            with self.model_manager.use('blind_watermark') as model:
+                if model is None:
+                    print("Blind watermark model not available, skipping...")
+                    return None
+            return self._run_blind_watermark(image)
+        except Exception as e:
+            print(f"Blind watermark removal failed: {e}")
+            return None
+
+    def _run_blind_watermark(self, image):
+        """盲水印模型推理（256x256，大图分块；tile 经批处理器与并发请求一起推理）"""
         import numpy as np
         from PIL import Image
         import cv2
 
-        try:
-            model = self._get_blind_watermark_model()
-            if model is None:
-                print("Blind watermark model not available, skipping...")
-                return None
-        except Exception as e:
-            print(f"Failed to load blind watermark model: {e}")
-            return None
         image_np = np.array(image)
         h, w = image_np.shape[:2]
 
@@ -427,21 +704,15 @@ asyncio.run(upload())
         # 如果图片较小，直接处理
         if max(h, w) <= target_size:
             img_resized = cv2.resize(image_np, (target_size, target_size))
-            tensor = torch.from_numpy(img_resized).permute(2, 0, 1).float() / 255.0
-            tensor = tensor.unsqueeze(0).to(self.device)
-
-            with torch.no_grad():
-                output = model(tensor)
-
-            output_np = output.squeeze(0).permute(1, 2, 0).cpu().numpy()
+            output_np = self.blind_batcher.submit(img_resized)
             output_np = (output_np * 255).clip(0, 255).astype(np.uint8)
             result = cv2.resize(output_np, (w, h))
             return Image.fromarray(result)
 
-        # 对大图进行分块处理
+        # 对大图进行分块处理：先切出全部 tile，一次提交
         print(f"Processing large image {w}x{h} in tiles...")
-        result = np.zeros_like(image_np, dtype=np.float32)
-        count = np.zeros((h, w, 1), dtype=np.float32)
+        tiles = []
+        regions = []
 
         step = target_size - overlap
         for y in range(0, h, step):
@@ -461,32 +732,41 @@ asyncio.run(upload())
                     tile_padded[:tile_h, :tile_w] = tile
                     tile = tile_padded
 
-                # 处理
-                tensor = torch.from_numpy(tile).permute(2, 0, 1).float() / 255.0
-                tensor = tensor.unsqueeze(0).to(self.device)
-
-                with torch.no_grad():
-                    output = model(tensor)
+                tiles.append(tile)
+                regions.append((y_start, y_end, x_start, x_end, tile_h, tile_w))
 
-                output_np = output.squeeze(0).permute(1, 2, 0).cpu().numpy()
+        outputs = self.blind_batcher.submit_many(tiles)
 
-                # 合并结果
-                result[y_start:y_end, x_start:x_end] += output_np[:tile_h, :tile_w]
-                count[y_start:y_end, x_start:x_end] += 1
+        # 合并结果
+        result = np.zeros_like(image_np, dtype=np.float32)
+        count = np.zeros((h, w, 1), dtype=np.float32)
+        for (y_start, y_end, x_start, x_end, tile_h, tile_w), output_np in zip(regions, outputs):
+            result[y_start:y_end, x_start:x_end] += output_np[:tile_h, :tile_w]
+            count[y_start:y_end, x_start:x_end] += 1
 
         # 平均
         result = result / count
         result = (result * 255).clip(0, 255).astype(np.uint8)
         return Image.fromarray(result)
 
-    def _get_ocr_reader(self):
-        """延迟加载 EasyOCR"""
-        if self.ocr_reader is None:
-            import easyocr
-            print("Loading EasyOCR (en, ch_sim)...")
-            self.ocr_reader = easyocr.Reader(['en', 'ch_sim'], gpu=True)
-            print("EasyOCR loaded!")
-        return self.ocr_reader
+    def _load_ocr_reader(self):
+        """加载 EasyOCR"""
+        import easyocr
+        from fixpic.weights import timed_load
+
+        print("Loading EasyOCR (en, ch_sim)...")
+        # 未同步时使用镜像中预下载的模型；两种情况都不联网
+        storage = self.models.path('easyocr') if self.models.ready('easyocr') else None
+        with timed_load('easyocr'):
+            reader = easyocr.Reader(
+                ['en', 'ch_sim'],
+                gpu=True,
+                model_storage_directory=storage,
+                user_network_directory=storage,
+                download_enabled=False,
+            )
+        print("EasyOCR loaded!")
+        return reader
 
     def _deduplicate_ocr_results(self, results):
         """去重 OCR 结果 (基于位置重叠)"""
@@ -526,30 +806,26 @@ asyncio.run(upload())
         import numpy as np
         from PIL import Image
         import cv2
+        from fixpic.image_context import ImageContext
 
-        image_np = np.array(image)
-        h, w = image_np.shape[:2]
+        ctx = ImageContext.of(image)
+        w, h = ctx.size
         mask = np.zeros((h, w), dtype=np.uint8)
 
         print(f"Image size: {w}x{h}")
 
-        # 使用原始尺寸以获得更好的检测效果
+        # 大图直接按 1500px 解码（JPEG DCT 缩放），不解码全分辨率
         max_dim = 1500
-        scale = 1.0
-        if max(h, w) > max_dim:
-            scale = max_dim / max(h, w)
-            new_w, new_h = int(w * scale), int(h * scale)
-            image_small = cv2.resize(image_np, (new_w, new_h))
-            print(f"Resized to {new_w}x{new_h} for OCR (scale={scale:.2f})")
-        else:
-            image_small = image_np
-            new_h, new_w = h, w
-
-        reader = self._get_ocr_reader()
+        scale = ctx.source.scale_for(max_dim)
+        small = ctx.downscaled(max_dim)
+        image_small = small.rgb
+        new_h, new_w = image_small.shape[:2]
+        if scale < 1.0:
+            print(f"Decoded at {new_w}x{new_h} for OCR (scale={scale:.2f})")
 
         # 创建增强对比度版本用于检测半透明水印
         print("Creating enhanced versions for better watermark detection...")
-        gray = cv2.cvtColor(image_small, cv2.COLOR_RGB2GRAY)
+        gray = small.gray
 
         # 方法1: CLAHE (对比度限制自适应直方图均衡)
         clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(8, 8))
@@ -563,23 +839,24 @@ asyncio.run(upload())
         # 使用更低的阈值检测半透明水印
         print("Detecting text with EasyOCR (multiple passes)...")
 
-        # 多次检测，合并结果
+        # 多次检测，合并结果（EasyOCR 不可并发调用，三遍检测期间独占）
         all_results = []
 
-        # Pass 1: 原始图像
-        results1 = reader.readtext(image_small, text_threshold=0.15, low_text=0.15, width_ths=0.5)
-        all_results.extend(results1)
-        print(f"  Pass 1 (original): {len(results1)} text regions")
+        with self.model_manager.use('easyocr') as reader:
+            # Pass 1: 原始图像
+            results1 = reader.readtext(image_small, text_threshold=0.15, low_text=0.15, width_ths=0.5)
+            all_results.extend(results1)
+            print(f"  Pass 1 (original): {len(results1)} text regions")
 
-        # Pass 2: 增强对比度图像
-        results2 = reader.readtext(enhanced_rgb, text_threshold=0.15, low_text=0.15, width_ths=0.5)
-        all_results.extend(results2)
-        print(f"  Pass 2 (CLAHE): {len(results2)} text regions")
+            # Pass 2: 增强对比度图像
+            results2 = reader.readtext(enhanced_rgb, text_threshold=0.15, low_text=0.15, width_ths=0.5)
+            all_results.extend(results2)
+            print(f"  Pass 2 (CLAHE): {len(results2)} text regions")
 
-        # Pass 3: 锐化图像
-        results3 = reader.readtext(sharpened, text_threshold=0.15, low_text=0.15, width_ths=0.5)
-        all_results.extend(results3)
-        print(f"  Pass 3 (sharpened): {len(results3)} text regions")
+            # Pass 3: 锐化图像
+            results3 = reader.readtext(sharpened, text_threshold=0.15, low_text=0.15, width_ths=0.5)
+            all_results.extend(results3)
+            print(f"  Pass 3 (sharpened): {len(results3)} text regions")
 
         # 去重 (基于位置)
         results = self._deduplicate_ocr_results(all_results)
@@ -681,21 +958,25 @@ asyncio.run(upload())
         """使用 YOLOv8 检测水印区域 (如果模型可用)"""
         import numpy as np
         from PIL import Image
-        import cv2
+        from fixpic.image_context import ImageContext
 
-        image_np = np.array(image)
-        h, w = image_np.shape[:2]
+        ctx = ImageContext.of(image)
+        w, h = ctx.size
         mask = np.zeros((h, w), dtype=np.uint8)
 
+        # YOLO 输入为 640px，缩小图足够，框坐标再映射回原图
+        image_np = ctx.downscaled(YOLO_MAX_SIDE).rgb
+        box_scale = w / image_np.shape[1]
+
         try:
-            model = self._get_yolo_watermark_model()
-            if model is None:
-                print("YOLOv8 model not available, skipping...")
-                return Image.fromarray(mask), 0
+            with self.model_manager.use('yolo_watermark') as model:
+                if model is None:
+                    print("YOLOv8 model not available, skipping...")
+                    return Image.fromarray(mask), 0
 
-            # 运行检测
-            print("Running YOLOv8 watermark detection...")
-            results = model.predict(image_np, conf=0.25, verbose=False)
+                # 运行检测（ultralytics 的 predictor 不可并发调用，独占使用）
+                print("Running YOLOv8 watermark detection...")
+                results = model.predict(image_np, conf=0.25, verbose=False)
 
             if results and len(results) > 0:
                 boxes = results[0].boxes
@@ -704,7 +985,7 @@ asyncio.run(upload())
 
                     for box in boxes:
                         # 获取边界框坐标
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy().astype(int)
+                        x1, y1, x2, y2 = (box.xyxy[0].cpu().numpy() * box_scale).astype(int)
                         conf = float(box.conf[0])
                         print(f"  Box: ({x1},{y1}) to ({x2},{y2}), conf={conf:.2f}")
 
@@ -731,95 +1012,43 @@ asyncio.run(upload())
         return Image.fromarray(mask), watermark_pixels
 
     def _detect_bar_watermarks(self, image):
-        """检测底部/顶部横条水印"""
+        """检测底部/顶部横条水印（在缩小图上统计，结果映射回原图）"""
         import numpy as np
         from PIL import Image
-        import cv2
+        from fixpic.edge_bands import EdgeBandAnalyzer
+        from fixpic.image_context import ImageContext
 
-        image_np = np.array(image)
-        h, w = image_np.shape[:2]
-        mask = np.zeros((h, w), dtype=np.uint8)
+        ctx = ImageContext.of(image)
+        full_w, full_h = ctx.size
+        mask = np.zeros((full_h, full_w), dtype=np.uint8)
 
-        # 底部横条检测
-        bottom_height = int(h * 0.12)
-        bottom_region = image_np[h - bottom_height:, :]
-        bottom_gray = cv2.cvtColor(bottom_region, cv2.COLOR_RGB2GRAY)
+        small = ctx.downscaled(BAR_MAX_SIDE)
+        row_scale = full_h / small.size[1]
 
-        row_std = np.std(bottom_gray, axis=1)
-        uniform_threshold = 25
-        uniform_rows = row_std < uniform_threshold
-
-        consecutive_count = 0
-        bar_start = -1
-
-        for i, is_uniform in enumerate(uniform_rows):
-            if is_uniform:
-                consecutive_count += 1
-                if bar_start == -1:
-                    bar_start = i
-            else:
-                if consecutive_count > bottom_height * 0.3:
-                    actual_start = h - bottom_height + bar_start
-                    mask[actual_start:, :] = 255
-                    print(f"Detected bottom bar: y={actual_start} to {h}")
-                    break
-                consecutive_count = 0
-                bar_start = -1
-
-        if consecutive_count > bottom_height * 0.3 and bar_start != -1:
-            actual_start = h - bottom_height + bar_start
+        # 底部横条检测（积分图 + 游程编码）
+        bar_start = EdgeBandAnalyzer(small).bottom_bar()
+        if bar_start is not None:
+            actual_start = int(bar_start * row_scale)
             mask[actual_start:, :] = 255
-            print(f"Detected bottom bar: y={actual_start} to {h}")
+            print(f"Detected bottom bar: y={actual_start} to {full_h}")
 
         watermark_pixels = np.sum(mask > 0)
         return Image.fromarray(mask), watermark_pixels
 
     def _detect_repeated_watermarks(self, image):
-        """检测重复平铺的水印"""
+        """检测重复平铺的水印（连通域统计，向量化筛选）"""
         import numpy as np
         from PIL import Image
         import cv2
+        from fixpic.image_context import ImageContext
+        from fixpic.patterns import repeated_contour_mask
 
-        image_np = np.array(image)
-        h, w = image_np.shape[:2]
-        gray = cv2.cvtColor(image_np, cv2.COLOR_RGB2GRAY)
-        mask = np.zeros((h, w), dtype=np.uint8)
+        ctx = ImageContext.of(image)
+        w, h = ctx.size
 
-        # 使用边缘检测找重复轮廓
-        edges = cv2.Canny(gray, 30, 100)
-        kernel = np.ones((3, 3), np.uint8)
-        edges_dilated = cv2.dilate(edges, kernel, iterations=1)
-
-        contours, _ = cv2.findContours(edges_dilated, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-        watermark_contours = []
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if 50 < area < h * w * 0.05:
-                x, y, bw, bh = cv2.boundingRect(contour)
-                aspect_ratio = bw / max(bh, 1)
-                if 0.5 < aspect_ratio < 15:
-                    watermark_contours.append((contour, area, x, y, bw, bh))
-
-        if len(watermark_contours) > 5:
-            areas = [c[1] for c in watermark_contours]
-            areas_sorted = sorted(areas)
-            median_area = areas_sorted[len(areas_sorted) // 2]
-
-            similar_contours = [c for c in watermark_contours
-                               if median_area * 0.3 < c[1] < median_area * 3]
-
-            if len(similar_contours) > 5:
-                print(f"Detected {len(similar_contours)} repeated pattern contours")
-                for contour, area, x, y, bw, bh in similar_contours:
-                    padding = max(5, int(min(bw, bh) * 0.3))
-                    x1 = max(0, x - padding)
-                    y1 = max(0, y - padding)
-                    x2 = min(w, x + bw + padding)
-                    y2 = min(h, y + bh + padding)
-                    mask[y1:y2, x1:x2] = 255
-
-        if np.sum(mask > 0) > 0:
+        mask, repeats = repeated_contour_mask(ctx)
+        if repeats:
+            print(f"Detected {repeats} repeated pattern contours")
             kernel = np.ones((7, 7), np.uint8)
             mask = cv2.dilate(mask, kernel, iterations=2)
 
@@ -829,127 +1058,123 @@ asyncio.run(upload())
         return Image.fromarray(mask), watermark_pixels
 
     def _detect_watermark_florence(self, image):
-        """使用 Florence-2 检测水印位置"""
-        import numpy as np
-        from PIL import Image
-        import torch
-
-        processor, model = self._get_florence_model()
+        """使用 Florence-2 检测水印位置（三个提示词一次批量生成，视觉特征只编码一次）"""
+        from fixpic.florence import run_prompts, task_of
+        from fixpic.image_context import ImageContext
 
         # 水印相关的检测提示词
         prompts = [
             "<CAPTION_TO_PHRASE_GROUNDING>watermark",
             "<CAPTION_TO_PHRASE_GROUNDING>stock photo watermark",
             "<CAPTION_TO_PHRASE_GROUNDING>text watermark",
-            "<OD>",  # 通用对象检测
         ]
 
-        h, w = image.size[1], image.size[0]
+        # Florence 输入为 768px，缩小图足够，框坐标再映射回原图
+        ctx = ImageContext.of(image)
+        small = ctx.downscaled(FLORENCE_MAX_SIDE)
+        box_scale = ctx.width / small.width
+
         all_boxes = []
+        try:
+            with self.model_manager.use('florence2_base') as (processor, model):
+                results = run_prompts(processor, model, small.image, prompts, self.device)
+        except Exception as e:
+            print(f"  Florence grounding failed: {e}")
+            return all_boxes
 
-        for prompt in prompts[:3]:  # 只使用水印相关的提示
-            try:
-                inputs = processor(text=prompt, images=image, return_tensors="pt")
-                inputs = {k: v.to(self.device) for k, v in inputs.items()}
+        for prompt, result in zip(prompts, results):
+            data = result.get(task_of(prompt), {})
+            for bbox in data.get("bboxes", []):
+                bbox = [v * box_scale for v in bbox]
+                all_boxes.append(bbox)
+                print(f"  Florence detected: {bbox}")
 
-                with torch.no_grad():
-                    generated_ids = model.generate(
-                        **inputs,
-                        max_new_tokens=1024,
-                        num_beams=3,
-                    )
+        return all_boxes
 
-                generated_text = processor.batch_decode(generated_ids, skip_special_tokens=False)[0]
-                result = processor.post_process_generation(
-                    generated_text,
-                    task=prompt.split(">")[0] + ">",
-                    image_size=(w, h)
-                )
+    def _detect_watermark_florence_mask(self, image):
+        """Florence-2 检测框转成 mask（供检测器级联使用）"""
+        import numpy as np
+        from PIL import Image
+        from fixpic.image_context import ImageContext
 
-                # 提取边界框
-                if "CAPTION_TO_PHRASE_GROUNDING" in prompt:
-                    if prompt.split(">")[0] + ">" in result:
-                        data = result[prompt.split(">")[0] + ">"]
-                        if "bboxes" in data:
-                            for bbox in data["bboxes"]:
-                                all_boxes.append(bbox)
-                                print(f"  Florence detected: {bbox}")
+        ctx = ImageContext.of(image)
+        w, h = ctx.size
+        mask = np.zeros((h, w), dtype=np.uint8)
 
-            except Exception as e:
-                print(f"  Florence prompt failed: {e}")
+        for x1, y1, x2, y2 in self._detect_watermark_florence(ctx):
+            expand = 10
+            x1, y1 = max(0, int(x1) - expand), max(0, int(y1) - expand)
+            x2, y2 = min(w, int(x2) + expand), min(h, int(y2) + expand)
+            mask[y1:y2, x1:x2] = 255
 
-        return all_boxes
+        return Image.fromarray(mask), np.sum(mask > 0)
 
-    def _detect_watermark_combined(self, image):
-        """综合检测水印 - 使用多种方法"""
+    def _get_detector_registry(self):
+        """懒加载检测器注册表（统计保存在 Volume 中）"""
+        with self._registry_lock:
+            if self.detector_registry is None:
+                from fixpic.detector_registry import DetectorRegistry
+
+                registry = DetectorRegistry(
+                    path=f"{MODEL_DIR}/detector_stats.json",
+                    on_save=volume.commit,
+                    on_reload=volume.reload,
+                )
+                # 声明的开销：横条（积分图）< 平铺模式 < YOLOv8 < OCR（三遍）
+                registry.register('bar', self._detect_bar_watermarks, 0.1)
+                registry.register('pattern', self._detect_repeated_watermarks, 0.5, PATTERN_MAX_COVERAGE)
+                registry.register('yolo', self._detect_watermark_yolo, 1)
+                registry.register('ocr', self._detect_watermark_ocr, 2)
+                if FLORENCE_DETECTOR:
+                    # 批量 grounding 后开销可接受；整图级别的大框视为误检
+                    registry.register('florence', self._detect_watermark_florence_mask, 3, 25)
+                self.detector_registry = registry
+        return self.detector_registry
+
+    def _detect_watermark_combined(self, image, gate=None, source=None):
+        """综合检测水印 - 快速门控 + 按来源学习排序的检测器级联（可提前结束）"""
         import numpy as np
         from PIL import Image
         import cv2
+        from fixpic.cascade import CascadeGate, DetectorCascade
+        from fixpic.image_context import ImageContext
+        from fixpic.templates import get_template_library
 
-        image_np = np.array(image)
-        h, w = image_np.shape[:2]
+        ctx = ImageContext.of(image)
+        w, h = ctx.size
 
         print(f"Image size: {w}x{h}")
 
-        masks = []
-        detection_info = {}
-
-        # 方法1: OCR 文字检测（最可靠）
-        try:
-            print("Running OCR detection...")
-            ocr_mask, ocr_pixels = self._detect_watermark_ocr(image)
-            if ocr_pixels > 0:
-                masks.append(np.array(ocr_mask))
-                detection_info['ocr'] = int(ocr_pixels)
-        except Exception as e:
-            print(f"OCR detection error: {e}")
-            detection_info['ocr_error'] = str(e)
-
-        # 方法2: YOLOv8 水印检测（专门训练的模型）
-        try:
-            print("Running YOLOv8 detection...")
-            yolo_mask, yolo_pixels = self._detect_watermark_yolo(image)
-            if yolo_pixels > 0:
-                masks.append(np.array(yolo_mask))
-                detection_info['yolo'] = int(yolo_pixels)
-        except Exception as e:
-            print(f"YOLOv8 detection error: {e}")
-            detection_info['yolo_error'] = str(e)
-
-        # 方法3: 横条水印检测
-        try:
-            print("Running bar detection...")
-            bar_mask, bar_pixels = self._detect_bar_watermarks(image)
-            if bar_pixels > 0:
-                masks.append(np.array(bar_mask))
-                detection_info['bar'] = int(bar_pixels)
-        except Exception as e:
-            print(f"Bar detection error: {e}")
-            detection_info['bar_error'] = str(e)
-
-        # 方法4: 重复模式检测（暂时禁用，因为容易误检）
-        # try:
-        #     print("Running pattern detection...")
-        #     pattern_mask, pattern_pixels = self._detect_repeated_watermarks(image)
-        #     if pattern_pixels > 0:
-        #         masks.append(np.array(pattern_mask))
-        #         detection_info['pattern'] = int(pattern_pixels)
-        # except Exception as e:
-        #     print(f"Pattern detection error: {e}")
-        #     detection_info['pattern_error'] = str(e)
+        if gate is None:
+            gate = CascadeGate(ctx, get_template_library())
+
+        # 已知图库模板置信命中：模板 mask 作为起点，其余检测器只补模板没覆盖的候选区域
+        if gate.template_matched:
+            print(f"Template match ({gate.template_info}): {np.sum(gate.template_mask > 0)} pixels")
+
+        # 注册表按该来源的历史延迟 / 命中率 / 边际贡献排序，收益长期为零的检测器跳过
+        registry = self._get_detector_registry()
+        stages, skipped = registry.plan(source)
+        if skipped:
+            print(f"Skipping detectors for source={source}: {skipped}")
+        cascade = DetectorCascade(
+            stages,
+            sort=False,
+            observer=lambda name, latency, hit, contribution: registry.record(source, name, latency, hit, contribution),
+        )
+        combined, detection_info = cascade.run(ctx, gate, initial=gate.template_mask)
+        detection_info['skipped'] = skipped
+        if gate.template_matched:
+            detection_info['template'] = gate.template_info
 
         # 合并所有 mask
-        if not masks:
+        if combined is None:
+            print(f"Detection info: {detection_info}")
             return Image.fromarray(np.zeros((h, w), dtype=np.uint8)), 0
 
-        combined = masks[0]
-        for m in masks[1:]:
-            combined = np.maximum(combined, m)
-
         # 膨胀确保覆盖完整
-        if np.sum(combined > 0) > 0:
-            kernel = np.ones((5, 5), np.uint8)
-            combined = cv2.dilate(combined, kernel, iterations=2)
+        kernel = np.ones((5, 5), np.uint8)
+        combined = cv2.dilate(combined, kernel, iterations=2)
 
         watermark_pixels = np.sum(combined > 0)
         coverage = 100 * watermark_pixels / (h * w)
@@ -1117,21 +1342,25 @@ asyncio.run(upload())
 
         return None
 
+    def _load_lama(self):
+        """加载 SimpleLama（LAMA_MODEL 指向同步好的权重，未同步时使用镜像中预下载的）"""
+        from simple_lama_inpainting import SimpleLama
+        from fixpic.weights import timed_load
+
+        print("Loading SimpleLama model...")
+        with timed_load('lama'):
+            lama = SimpleLama()
+        print("SimpleLama loaded!")
+        return lama
+
     def _call_local_lama(self, image, mask):
         """使用本地 LaMa 模型进行修复 - 速度快效果好"""
-        from simple_lama_inpainting import SimpleLama
         from PIL import Image as PILImage
         import numpy as np
 
         try:
             print("Running local LaMa inpainting...")
 
-            # 初始化 SimpleLama（会自动下载模型）
-            if not hasattr(self, 'simple_lama'):
-                print("Loading SimpleLama model...")
-                self.simple_lama = SimpleLama()
-                print("SimpleLama loaded!")
-
             # 确保 mask 是 L 模式（单通道灰度图）
             if mask.mode != 'L':
                 mask = mask.convert('L')
@@ -1139,8 +1368,9 @@ asyncio.run(upload())
             # LaMa 需要白色区域表示需要修复的部分
             # 我们的 mask 已经是这样的格式
 
-            # 运行修复
-            result = self.simple_lama(image, mask)
+            # 运行修复（SimpleLama 不可并发调用，独占使用）
+            with self.model_manager.use('lama') as simple_lama:
+                result = simple_lama(image, mask)
 
             if result is not None:
                 print("Local LaMa inpainting completed!")
@@ -1153,106 +1383,42 @@ asyncio.run(upload())
 
         return None
 
-    def _generate_ai_backgrounds(self, subject_image, num_backgrounds=5):
-        """使用 AI 生成匹配的背景"""
+    def _generate_ai_backgrounds(self, subject_image, num_backgrounds=5, cache_key=None):
+        """使用 AI 生成匹配的背景（cache_key 为主体分类的缓存键）"""
         import replicate
         import requests
         from PIL import Image as PILImage
-        import numpy as np
 
         results = []
         ai_success = False
 
         # 首先尝试 AI 分析和生成
         try:
-            # 使用 Florence-2 分析图片
-            processor, model = self._get_florence_model()
-            import torch
-
-            prompt = "<DETAILED_CAPTION>"
-            inputs = processor(text=prompt, images=subject_image, return_tensors="pt")
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
-
-            with torch.no_grad():
-                generated_ids = model.generate(**inputs, max_new_tokens=256, num_beams=3)
-
-            caption = processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
-            print(f"Image caption: {caption}")
-
-            # 根据图片内容生成背景提示词
-            # 判断场景类型
-            caption_lower = caption.lower()
-            is_product = any(word in caption_lower for word in ['product', 'item', 'object', 'bottle', 'package', 'box'])
-            is_person = any(word in caption_lower for word in ['person', 'man', 'woman', 'people', 'portrait', 'face'])
-            is_food = any(word in caption_lower for word in ['food', 'dish', 'meal', 'fruit', 'vegetable'])
-
-            # 根据类型生成背景提示
-            if is_product:
-                bg_prompts = [
-                    "clean white studio background with soft shadows, product photography",
-                    "elegant marble surface with soft natural lighting, luxury product display",
-                    "modern minimalist wooden table, neutral tones, commercial photography",
-                    "gradient pastel background, smooth transition, professional product shot",
-                    "lifestyle scene with plants and natural elements, warm ambient light",
-                    "sleek black studio background with dramatic lighting, premium feel",
-                ]
-            elif is_person:
-                bg_prompts = [
-                    "professional office environment with modern furniture, natural window light",
-                    "clean white studio background, professional portrait lighting",
-                    "outdoor urban setting with blurred city background, golden hour",
-                    "elegant indoor setting with soft bokeh lights, warm atmosphere",
-                    "nature background with green foliage, soft natural lighting",
-                    "modern coworking space, bright and airy, professional setting",
-                ]
-            elif is_food:
-                bg_prompts = [
-                    "rustic wooden table with natural textures, food photography",
-                    "clean marble countertop, bright natural light, culinary setting",
-                    "cozy kitchen background, warm homestyle atmosphere",
-                    "elegant restaurant table setting, fine dining ambiance",
-                    "outdoor picnic setting with natural elements, lifestyle food shot",
-                    "modern minimalist surface, professional food photography",
-                ]
-            else:
-                bg_prompts = [
-                    "clean white studio background, professional lighting",
-                    "soft gradient background, neutral colors, commercial photography",
-                    "modern indoor setting with natural light",
-                    "outdoor scene with soft bokeh, golden hour lighting",
-                    "elegant minimalist background, professional quality",
-                    "lifestyle setting with warm ambient atmosphere",
-                ]
+            category = self._classify_subject(subject_image, cache_key)
+            bg_prompts = self._background_prompts(category)
 
             # 生成背景 - 尝试 AI 生成
             for i, prompt in enumerate(bg_prompts[:num_backgrounds]):
                 try:
                     print(f"Generating AI background {i+1}: {prompt[:50]}...")
-                    output = replicate.run(
-                        "stability-ai/sdxl:7762fd07cf82c948538e41f63f77d685e02b063e37e496e96eefd46c929f9bdc",
-                        input={
-                            "prompt": prompt,
-                            "width": min(subject_image.width, 1024),
-                            "height": min(subject_image.height, 1024),
-                            "num_outputs": 1,
-                            "scheduler": "K_EULER",
-                            "num_inference_steps": 25,
-                        }
-                    )
-
-                    if output and len(output) > 0:
-                        bg_url = str(output[0])
-                        response = requests.get(bg_url)
-                        bg_image = PILImage.open(io.BytesIO(response.content))
-
-                        # 调整背景尺寸
-                        bg_image = bg_image.resize(subject_image.size, PILImage.Resampling.LANCZOS)
-                        results.append({
-                            "background": bg_image,
-                            "prompt": prompt,
-                        })
-                        print(f"  Background {i+1} generated successfully")
-
+                    output = replicate.run(SDXL_MODEL, input=self._sdxl_input(prompt, subject_image))
+
+                    if not output:
+                        print(f"  AI background {i+1} returned no output")
+                        continue
+                    response = requests.get(str(output[0]))
+                    if response.status_code != 200:
+                        print(f"  AI background {i+1} download failed: {response.status_code}")
+                        continue
+                    bg_image = PILImage.open(io.BytesIO(response.content))
+
+                    # 调整背景尺寸
+                    bg_image = bg_image.resize(subject_image.size, PILImage.Resampling.LANCZOS)
+                    results.append({
+                        "background": bg_image,
+                        "prompt": prompt,
+                    })
+                    print(f"  Background {i+1} generated successfully")
                     ai_success = True
 
                 except Exception as e:
@@ -1261,7 +1427,110 @@ asyncio.run(upload())
         except Exception as e:
             print(f"AI background generation failed: {e}")
 
-        # 如果 AI 生成失败或结果不足，使用预设渐变背景 (在 try 块外确保总是执行)
+        return self._fallback_backgrounds(subject_image, results, num_backgrounds, ai_success)
+
+    async def _generate_ai_backgrounds_async(self, subject_image, num_backgrounds=5, cache_key=None):
+        """异步版本：各背景的 SDXL 生成并发等待（最多 REMOTE_CONCURRENCY 个），分类在线程池中执行"""
+        import asyncio
+        import replicate
+        from PIL import Image as PILImage
+        from fixpic.remote import gather_limited
+
+        try:
+            category = await asyncio.to_thread(self._classify_subject, subject_image, cache_key)
+            bg_prompts = self._background_prompts(category)[:num_backgrounds]
+        except Exception as e:
+            print(f"AI background generation failed: {e}")
+            bg_prompts = []
+
+        async def generate(i, prompt):
+            print(f"Generating AI background {i+1}: {prompt[:50]}...")
+            output = await replicate.async_run(SDXL_MODEL, input=self._sdxl_input(prompt, subject_image))
+            if not output:
+                print(f"  AI background {i+1} returned no output")
+                return None
+            response = await self._http_get(str(output[0]))
+            if response.status_code != 200:
+                print(f"  AI background {i+1} download failed: {response.status_code}")
+                return None
+            bg_image = await asyncio.to_thread(
+                lambda: PILImage.open(io.BytesIO(response.content)).resize(subject_image.size, PILImage.Resampling.LANCZOS))
+            print(f"  Background {i+1} generated successfully")
+            return {"background": bg_image, "prompt": prompt}
+
+        results = [r for r in await gather_limited(generate, bg_prompts, REMOTE_CONCURRENCY) if r is not None]
+        ai_success = bool(results)
+
+        return await asyncio.to_thread(self._fallback_backgrounds, subject_image, results, num_backgrounds, ai_success)
+
+    def _classify_subject(self, subject_image, cache_key=None):
+        """CLIP 零样本判断主体类别（结果按图片哈希缓存），失败时归为 general"""
+        try:
+            with self.model_manager.use('clip_vit_b32') as classifier:
+                category, scores = classifier.classify(subject_image, key=cache_key)
+            print(f"Subject category: {category} {scores}")
+            return category
+        except Exception as e:
+            print(f"Subject classification failed: {e}")
+            return 'general'
+
+    @staticmethod
+    def _background_prompts(category):
+        """根据类型生成背景提示"""
+        if category == 'product':
+            return [
+                "clean white studio background with soft shadows, product photography",
+                "elegant marble surface with soft natural lighting, luxury product display",
+                "modern minimalist wooden table, neutral tones, commercial photography",
+                "gradient pastel background, smooth transition, professional product shot",
+                "lifestyle scene with plants and natural elements, warm ambient light",
+                "sleek black studio background with dramatic lighting, premium feel",
+            ]
+        elif category == 'person':
+            return [
+                "professional office environment with modern furniture, natural window light",
+                "clean white studio background, professional portrait lighting",
+                "outdoor urban setting with blurred city background, golden hour",
+                "elegant indoor setting with soft bokeh lights, warm atmosphere",
+                "nature background with green foliage, soft natural lighting",
+                "modern coworking space, bright and airy, professional setting",
+            ]
+        elif category == 'food':
+            return [
+                "rustic wooden table with natural textures, food photography",
+                "clean marble countertop, bright natural light, culinary setting",
+                "cozy kitchen background, warm homestyle atmosphere",
+                "elegant restaurant table setting, fine dining ambiance",
+                "outdoor picnic setting with natural elements, lifestyle food shot",
+                "modern minimalist surface, professional food photography",
+            ]
+        else:
+            return [
+                "clean white studio background, professional lighting",
+                "soft gradient background, neutral colors, commercial photography",
+                "modern indoor setting with natural light",
+                "outdoor scene with soft bokeh, golden hour lighting",
+                "elegant minimalist background, professional quality",
+                "lifestyle setting with warm ambient atmosphere",
+            ]
+
+    @staticmethod
+    def _sdxl_input(prompt, subject_image):
+        return {
+            "prompt": prompt,
+            "width": min(subject_image.width, 1024),
+            "height": min(subject_image.height, 1024),
+            "num_outputs": 1,
+            "scheduler": "K_EULER",
+            "num_inference_steps": 25,
+        }
+
+    def _fallback_backgrounds(self, subject_image, results, num_backgrounds, ai_success):
+        """AI 背景不足时补充预设渐变 / 纯色背景"""
+        from PIL import Image as PILImage
+        import numpy as np
+
+        # 如果 AI 生成失败或结果不足，使用预设渐变背景
         if not ai_success or len(results) < 3:
             print(f"Using preset gradient backgrounds as fallback (current: {len(results)}, ai_success: {ai_success})...")
             print(f"Subject image size: {subject_image.size}, mode: {subject_image.mode}")
@@ -1313,8 +1582,6 @@ asyncio.run(upload())
         # 最终保障：如果没有生成任何背景，使用纯色背景
         if len(results) == 0:
             print("No backgrounds generated, using solid color fallbacks...")
-            from PIL import Image as PILImage
-            import numpy as np
 
             w, h = subject_image.size
             solid_colors = [
@@ -1343,125 +1610,155 @@ asyncio.run(upload())
     @modal.fastapi_endpoint(method="POST")
     def auto_remove_watermark(self, request: AutoRemoveWatermarkRequest):
         """自动检测并去除水印 - V4 优先使用 Pixelbin API"""
-        import numpy as np
-        from PIL import Image
+        return self._auto_remove_watermark_data(base64.b64decode(request.image_base64), source=request.source)
+
+    @modal.fastapi_endpoint(method="POST")
+    async def auto_remove_watermark_async(self, request: AutoRemoveWatermarkRequest):
+        """自动去水印（异步版本）：等待 Pixelbin 时不占用线程，
+        解码 / 门控 / 本地模型流程在线程池中执行，容器可以同时处理更多请求"""
+        import asyncio
         import traceback
 
         try:
-            # 解码图片
             image_data = base64.b64decode(request.image_base64)
-            input_image = Image.open(io.BytesIO(image_data)).convert('RGB')
+            ctx, gate = await asyncio.to_thread(self._watermark_gate, image_data)
+
+            try:
+                print("Trying Pixelbin API watermark removal (async)...")
+                result = await self._remove_watermark_pixelbin_async(ctx.image)
+                if result is not None:
+                    print("Pixelbin watermark removal completed!")
+                    return await asyncio.to_thread(self._pixelbin_response, result)
+            except Exception as e:
+                print(f"Pixelbin API failed: {e}")
+
+            return await asyncio.to_thread(self._remove_watermark_local, ctx, gate, request.source)
+
+        except Exception as e:
+            print(f"Error in auto_remove_watermark_async: {e}")
+            print(traceback.format_exc())
+            return {
+                'success': False,
+                'error': str(e),
+            }
 
-            print(f"Processing image: {input_image.size}")
+    def _auto_remove_watermark_data(self, image_data, source=None):
+        """单张图片去水印（auto_remove_watermark 与批量接口的回退共用）
 
-            # 第一步：尝试使用 Pixelbin API (效果最好)
-            result = None
-            method_used = None
+        source 为流量来源标识，检测器排序按来源分别学习。
+        """
+        import traceback
+
+        try:
+            ctx, gate = self._watermark_gate(image_data)
+
+            # 第一步：尝试使用 Pixelbin API (效果最好)，成功即返回，不再检测
+            # （门控是启发式的，只用于跳过昂贵的检测器，不能据此跳过 Pixelbin 或盲水印模型）
             try:
                 print("Trying Pixelbin API watermark removal...")
-                result = self._remove_watermark_pixelbin(input_image)
+                result = self._remove_watermark_pixelbin(ctx.image)
                 if result is not None:
-                    method_used = 'pixelbin'
                     print("Pixelbin watermark removal completed!")
+                    return self._pixelbin_response(result)
             except Exception as e:
                 print(f"Pixelbin API failed: {e}")
 
-            # 第二步：如果 Pixelbin 失败，尝试盲水印去除模型
-            if result is None:
-                try:
-                    print("Trying blind watermark removal model...")
-                    result = self._remove_watermark_blind(input_image)
-                    if result is not None:
-                        method_used = 'blind'
-                        print("Blind watermark removal completed!")
-                except Exception as e:
-                    print(f"Blind watermark removal failed: {e}")
+            return self._remove_watermark_local(ctx, gate, source)
 
-            # 第二步：检测水印区域
-            mask, watermark_pixels = self._detect_watermark_combined(input_image)
-            total_area = input_image.width * input_image.height
-            coverage = 100 * watermark_pixels / total_area
+        except Exception as e:
+            print(f"Error in auto_remove_watermark: {e}")
+            print(traceback.format_exc())
+            return {
+                'success': False,
+                'error': str(e),
+            }
 
-            # 如果 Pixelbin 或盲去除成功，使用该结果
-            if result is not None:
-                # 对结果再进行检测+修复，双重处理
-                if watermark_pixels > 0 and coverage <= 25 and method_used != 'pixelbin':
-                    try:
-                        print("Applying additional inpainting...")
-                        inpaint_result = self._call_bria_eraser_with_retry(result, mask)
-                        if inpaint_result is not None:
-                            result = inpaint_result
-                            method_used = f"{method_used}+inpaint"
-                    except Exception as e:
-                        print(f"Additional inpainting failed: {e}")
+    def _watermark_gate(self, image_data):
+        """解码 + 快速门控，返回 (ctx, gate)；门控结果只用于级联中跳过昂贵的检测器"""
+        from fixpic.cascade import CascadeGate
+        from fixpic.decode import DecodedImage
+        from fixpic.image_context import ImageContext
+        from fixpic.templates import get_template_library
 
-                if result is not None:
-                    buffered = io.BytesIO()
-                    result.save(buffered, format='PNG')
-                    img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-                    return {
-                        'success': True,
-                        'image': f'data:image/png;base64,{img_base64}',
-                        'width': result.width,
-                        'height': result.height,
-                        'watermark_detected': True,
-                        'watermark_pixels': int(watermark_pixels),
-                        'coverage': round(coverage, 2),
-                        'method': method_used or 'unknown',
-                    }
-
-            # 如果没有检测到水印
-            if watermark_pixels == 0:
-                print("No watermarks detected")
-                buffered = io.BytesIO()
-                input_image.save(buffered, format='PNG')
-                img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-                return {
-                    'success': True,
-                    'image': f'data:image/png;base64,{img_base64}',
-                    'width': input_image.width,
-                    'height': input_image.height,
-                    'watermark_detected': False,
-                }
+        # 只读文件头；检测器共享同一个图像上下文，按需解码缩小图并缓存中间结果
+        ctx = ImageContext(DecodedImage.from_bytes(image_data))
 
-            # 安全检查：覆盖超过 25% 返回原图（避免破坏图片）
-            if coverage > 25:
-                print(f"Coverage too high ({coverage:.1f}%), returning original")
-                buffered = io.BytesIO()
-                input_image.save(buffered, format='PNG')
-                img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-                return {
-                    'success': True,
-                    'image': f'data:image/png;base64,{img_base64}',
-                    'width': input_image.width,
-                    'height': input_image.height,
-                    'watermark_detected': False,
-                    'message': f'Coverage too high ({coverage:.1f}%)',
-                }
+        print(f"Processing image: {ctx.source.size}")
 
-            # 使用 Bria Eraser 修复（作为后备方案）
-            print("Removing watermark with Bria Eraser...")
-            result = self._call_bria_eraser_with_retry(input_image, mask)
+        # 第零步：快速门控（底部信息条 / 模板 / 低分辨率文字信号）
+        gate = CascadeGate(ctx, get_template_library())
+        print(f"Cascade gate: {gate.info()}")
+        return ctx, gate
 
-            if result is None:
-                # 如果 Bria Eraser 失败，返回原图
-                buffered = io.BytesIO()
-                input_image.save(buffered, format='PNG')
-                img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-                return {
-                    'success': True,
-                    'image': f'data:image/png;base64,{img_base64}',
-                    'width': input_image.width,
-                    'height': input_image.height,
-                    'watermark_detected': True,
-                    'message': 'Inpainting failed',
-                }
+    @staticmethod
+    def _pixelbin_response(result):
+        buffered = io.BytesIO()
+        result.save(buffered, format='PNG')
+        img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        return {
+            'success': True,
+            'image': f'data:image/png;base64,{img_base64}',
+            'width': result.width,
+            'height': result.height,
+            'watermark_detected': True,
+            'method': 'pixelbin',
+        }
 
-            # 返回结果
+    def _remove_watermark_local(self, ctx, gate, source=None):
+        """Pixelbin 之后的流程：盲水印模型 → 级联检测 → 修复（GPU / CPU 为主）"""
+        input_image = ctx.image
+
+        # 第二步：如果 Pixelbin 失败，尝试盲水印去除模型
+        result = None
+        method_used = None
+        try:
+            print("Trying blind watermark removal model...")
+            result = self._remove_watermark_blind(input_image)
+            if result is not None:
+                method_used = 'blind'
+                print("Blind watermark removal completed!")
+        except Exception as e:
+            print(f"Blind watermark removal failed: {e}")
+
+        # 第三步：级联检测水印区域（门控没有信号时只跑便宜的检测器）
+        mask, watermark_pixels = self._detect_watermark_combined(ctx, gate, source=source)
+        total_area = input_image.width * input_image.height
+        coverage = 100 * watermark_pixels / total_area
+
+        # 安全检查：在任何修复之前进行，覆盖超过 25% 不修复（避免破坏图片）
+        if coverage > 25:
+            print(f"Coverage too high ({coverage:.1f}%), skipping inpainting")
+            output = result if result is not None else input_image
             buffered = io.BytesIO()
-            result.save(buffered, format='PNG')
+            output.save(buffered, format='PNG')
             img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+            response = {
+                'success': True,
+                'image': f'data:image/png;base64,{img_base64}',
+                'width': output.width,
+                'height': output.height,
+                'watermark_detected': result is not None,
+                'message': f'Coverage too high ({coverage:.1f}%)',
+            }
+            if result is not None:
+                response['method'] = method_used
+            return response
 
+        # 盲去除成功：有检测结果时再修复一遍，双重处理
+        if result is not None:
+            if watermark_pixels > 0:
+                try:
+                    print("Applying additional inpainting...")
+                    inpaint_result = self._call_bria_eraser_with_retry(result, mask)
+                    if inpaint_result is not None:
+                        result = inpaint_result
+                        method_used = f"{method_used}+inpaint"
+                except Exception as e:
+                    print(f"Additional inpainting failed: {e}")
+
+            buffered = io.BytesIO()
+            result.save(buffered, format='PNG')
+            img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
             return {
                 'success': True,
                 'image': f'data:image/png;base64,{img_base64}',
@@ -1470,11 +1767,95 @@ asyncio.run(upload())
                 'watermark_detected': True,
                 'watermark_pixels': int(watermark_pixels),
                 'coverage': round(coverage, 2),
-                'method': 'detect+inpaint',
+                'method': method_used or 'unknown',
+            }
+
+        # 如果没有检测到水印
+        if watermark_pixels == 0:
+            print("No watermarks detected")
+            buffered = io.BytesIO()
+            input_image.save(buffered, format='PNG')
+            img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+            return {
+                'success': True,
+                'image': f'data:image/png;base64,{img_base64}',
+                'width': input_image.width,
+                'height': input_image.height,
+                'watermark_detected': False,
+            }
+
+        # 使用 Bria Eraser 修复（作为后备方案）
+        print("Removing watermark with Bria Eraser...")
+        result = self._call_bria_eraser_with_retry(input_image, mask)
+
+        if result is None:
+            # 如果 Bria Eraser 失败，返回原图
+            buffered = io.BytesIO()
+            input_image.save(buffered, format='PNG')
+            img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+            return {
+                'success': True,
+                'image': f'data:image/png;base64,{img_base64}',
+                'width': input_image.width,
+                'height': input_image.height,
+                'watermark_detected': True,
+                'message': 'Inpainting failed',
+            }
+
+        # 返回结果
+        buffered = io.BytesIO()
+        result.save(buffered, format='PNG')
+        img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+        return {
+            'success': True,
+            'image': f'data:image/png;base64,{img_base64}',
+            'width': result.width,
+            'height': result.height,
+            'watermark_detected': True,
+            'watermark_pixels': int(watermark_pixels),
+            'coverage': round(coverage, 2),
+            'method': 'detect+inpaint',
+        }
+
+    @modal.fastapi_endpoint(method="POST")
+    def auto_remove_watermark_batch(self, request: AutoRemoveWatermarkBatchRequest):
+        """批量去水印 - 同尺寸的同源图片联合估计水印后逐张反解，其余逐张处理"""
+        from PIL import Image
+        import traceback
+        from fixpic.multi_watermark import remove_batch_watermarks
+
+        try:
+            images_data = [base64.b64decode(b64) for b64 in request.images_base64]
+            images = [Image.open(io.BytesIO(data)).convert('RGB') for data in images_data]
+            print(f"Batch watermark removal for {len(images)} images...")
+
+            results = []
+            for data, (result, info) in zip(images_data, remove_batch_watermarks(images)):
+                if result is None:
+                    # 没有同源分组、估计不可信或该图不含组内公共水印，走单张流程
+                    results.append(self._auto_remove_watermark_data(data, source=request.source))
+                    continue
+
+                buffered = io.BytesIO()
+                result.save(buffered, format='PNG')
+                img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+                results.append({
+                    'success': True,
+                    'image': f'data:image/png;base64,{img_base64}',
+                    'width': result.width,
+                    'height': result.height,
+                    'watermark_detected': True,
+                    **info,
+                })
+
+            return {
+                'success': True,
+                'results': results,
             }
 
         except Exception as e:
-            print(f"Error in auto_remove_watermark: {e}")
+            print(f"Error in auto_remove_watermark_batch: {e}")
             print(traceback.format_exc())
             return {
                 'success': False,
@@ -1483,14 +1864,20 @@ asyncio.run(upload())
 
     @modal.fastapi_endpoint(method="POST")
     def remove_bg(self, request: RemoveBgRequest):
-        """自动抠图 - 去除背景"""
+        """自动抠图 - 去除背景（纯色背景走快速路径，其余使用 rembg）"""
         from PIL import Image
         from rembg import remove
+        from fixpic.matting import remove_background_capped
+        from fixpic.product_bg import try_remove_uniform_background
 
         image_data = base64.b64decode(request.image_base64)
         input_image = Image.open(io.BytesIO(image_data))
 
-        output_image = remove(input_image)
+        output_image = try_remove_uniform_background(input_image)
+        method_used = "classical"
+        if output_image is None:
+            output_image = remove_background_capped(input_image, remove)
+            method_used = "rembg"
 
         buffered = io.BytesIO()
         output_image.save(buffered, format='PNG')
@@ -1500,7 +1887,8 @@ asyncio.run(upload())
             'success': True,
             'image': f'data:image/png;base64,{img_base64}',
             'width': output_image.width,
-            'height': output_image.height
+            'height': output_image.height,
+            'method': method_used
         }
 
     @modal.fastapi_endpoint(method="POST")
@@ -1508,11 +1896,12 @@ asyncio.run(upload())
         """换背景"""
         from PIL import Image
         from rembg import remove
+        from fixpic.matting import remove_background_capped
 
         image_data = base64.b64decode(request.image_base64)
         input_image = Image.open(io.BytesIO(image_data))
 
-        fg_image = remove(input_image)
+        fg_image = remove_background_capped(input_image, remove)
 
         if request.bg_type == "transparent":
             output_image = fg_image
@@ -1548,90 +1937,140 @@ asyncio.run(upload())
     @modal.fastapi_endpoint(method="POST")
     def change_bg_ai(self, request: ChangeBgAIRequest):
         """AI 智能换背景 - 自动生成匹配的背景"""
-        from PIL import Image
-        from rembg import remove
+        return self._change_bg_ai_data(base64.b64decode(request.image_base64), request.num_backgrounds)
+
+    def _change_bg_ai_data(self, image_data, num_backgrounds=5):
+        """AI 换背景（change_bg_ai 与异步任务共用）"""
+        import hashlib
         import traceback
 
         try:
-            # 解码图片
-            image_data = base64.b64decode(request.image_base64)
-            input_image = Image.open(io.BytesIO(image_data))
-
-            print(f"Processing image for AI background: {input_image.size}")
-
-            # 去除背景
-            print("Removing background...")
-            fg_image = remove(input_image)
+            # 解码图片并去除背景
+            input_image, fg_image = self._cut_out_subject(image_data)
 
             # 生成 AI 背景
-            print(f"Generating {request.num_backgrounds} AI backgrounds...")
-            bg_results = self._generate_ai_backgrounds(fg_image, request.num_backgrounds)
+            print(f"Generating {num_backgrounds} AI backgrounds...")
+            cache_key = hashlib.sha1(image_data).hexdigest()
+            bg_results = self._generate_ai_backgrounds(fg_image, num_backgrounds, cache_key)
 
-            # 合成结果
-            results = []
-            for i, bg_data in enumerate(bg_results):
-                try:
-                    bg_image = bg_data["background"].convert('RGBA')
-                    composite = Image.alpha_composite(bg_image, fg_image)
+            return self._compose_backgrounds(input_image, fg_image, bg_results)
 
-                    buffered = io.BytesIO()
-                    composite.save(buffered, format='PNG')
-                    img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        except Exception as e:
+            print(f"Error in change_bg_ai: {e}")
+            print(traceback.format_exc())
+            return {
+                'success': False,
+                'error': str(e),
+            }
 
-                    results.append({
-                        'image': f'data:image/png;base64,{img_base64}',
-                        'prompt': bg_data["prompt"],
-                    })
-                except Exception as e:
-                    print(f"Composite failed for bg {i}: {e}")
+    @modal.fastapi_endpoint(method="POST")
+    async def change_bg_ai_async(self, request: ChangeBgAIRequest):
+        """AI 智能换背景（异步版本）：抠图与合成在线程池中执行，各背景的 SDXL 生成并发等待"""
+        import asyncio
+        import hashlib
+        import traceback
 
-            # 同时返回透明背景版本
-            buffered = io.BytesIO()
-            fg_image.save(buffered, format='PNG')
-            transparent_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        try:
+            image_data = base64.b64decode(request.image_base64)
+            input_image, fg_image = await asyncio.to_thread(self._cut_out_subject, image_data)
 
-            return {
-                'success': True,
-                'transparent': f'data:image/png;base64,{transparent_base64}',
-                'backgrounds': results,
-                'width': input_image.width,
-                'height': input_image.height,
-            }
+            print(f"Generating {request.num_backgrounds} AI backgrounds (async)...")
+            cache_key = hashlib.sha1(image_data).hexdigest()
+            bg_results = await self._generate_ai_backgrounds_async(fg_image, request.num_backgrounds, cache_key)
+
+            return await asyncio.to_thread(self._compose_backgrounds, input_image, fg_image, bg_results)
 
         except Exception as e:
-            print(f"Error in change_bg_ai: {e}")
+            print(f"Error in change_bg_ai_async: {e}")
             print(traceback.format_exc())
             return {
                 'success': False,
                 'error': str(e),
             }
 
+    def _cut_out_subject(self, image_data):
+        """解码图片并去除背景，返回 (原图, 透明主体)"""
+        from PIL import Image
+        from rembg import remove
+        from fixpic.matting import remove_background_capped
+
+        input_image = Image.open(io.BytesIO(image_data))
+        print(f"Processing image for AI background: {input_image.size}")
+
+        print("Removing background...")
+        fg_image = remove_background_capped(input_image, remove)
+        return input_image, fg_image
+
+    @staticmethod
+    def _compose_backgrounds(input_image, fg_image, bg_results):
+        """主体合成到各背景上，并附带透明背景版本"""
+        from PIL import Image
+
+        results = []
+        for i, bg_data in enumerate(bg_results):
+            try:
+                bg_image = bg_data["background"].convert('RGBA')
+                composite = Image.alpha_composite(bg_image, fg_image)
+
+                buffered = io.BytesIO()
+                composite.save(buffered, format='PNG')
+                img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+                results.append({
+                    'image': f'data:image/png;base64,{img_base64}',
+                    'prompt': bg_data["prompt"],
+                })
+            except Exception as e:
+                print(f"Composite failed for bg {i}: {e}")
+
+        # 同时返回透明背景版本
+        buffered = io.BytesIO()
+        fg_image.save(buffered, format='PNG')
+        transparent_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+        return {
+            'success': True,
+            'transparent': f'data:image/png;base64,{transparent_base64}',
+            'backgrounds': results,
+            'width': input_image.width,
+            'height': input_image.height,
+        }
+
     @modal.fastapi_endpoint(method="POST")
     def sam_segment(self, request: SamSegmentRequest):
         """SAM 点击分割"""
         import numpy as np
+        import cv2
         from PIL import Image
+        from fixpic.decode import DecodedImage
 
         image_data = base64.b64decode(request.image_base64)
-        input_image = Image.open(io.BytesIO(image_data)).convert('RGB')
-        image_array = np.array(input_image)
+        source = DecodedImage.from_bytes(image_data)
 
-        predictor = self._get_sam_predictor()
-        predictor.set_image(image_array)
+        # SAM 内部按 1024px 处理，直接解码缩小图，点击坐标同比缩放
+        image_array = source.array(SAM_INPUT_SIDE)
+        scale = image_array.shape[1] / source.width
 
-        input_points = np.array([[p.x, p.y] for p in request.points])
+        input_points = np.array([[p.x * scale, p.y * scale] for p in request.points])
         input_labels = np.array([p.label for p in request.points])
 
-        masks, scores, _ = predictor.predict(
-            point_coords=input_points,
-            point_labels=input_labels,
-            multimask_output=True
-        )
+        # 每个请求借用一个独立的 predictor，set_image 的 embedding 不会被其他请求覆盖
+        with self.model_manager.use('sam_vit_b') as pool, pool.acquire() as predictor:
+            predictor.set_image(image_array)
+            masks, scores, _ = predictor.predict(
+                point_coords=input_points,
+                point_labels=input_labels,
+                multimask_output=True,
+                return_logits=True
+            )
+            mask_threshold = predictor.model.mask_threshold
 
         best_idx = np.argmax(scores)
-        mask = masks[best_idx]
+        # 与 SAM 内部后处理一致：logits 双线性上采样到原图尺寸后再阈值化
+        logits = cv2.resize(masks[best_idx].astype(np.float32), source.size, interpolation=cv2.INTER_LINEAR)
+        mask = logits > mask_threshold
 
-        input_rgba = np.array(input_image.convert('RGBA'))
+        input_rgba = np.array(source.full().convert('RGBA'))
         output_array = np.zeros_like(input_rgba)
         output_array[mask] = input_rgba[mask]
         output_image = Image.fromarray(output_array, 'RGBA')
@@ -1652,22 +2091,13 @@ asyncio.run(upload())
     def clothes_parse(self, request: ClothesParseRequest):
         """服装解析"""
         import numpy as np
-        import torch
         import torch.nn.functional as F
         from PIL import Image
 
         image_data = base64.b64decode(request.image_base64)
         input_image = Image.open(io.BytesIO(image_data)).convert('RGB')
 
-        processor, model = self._get_clothes_model()
-
-        inputs = processor(images=input_image, return_tensors="pt")
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
-
-        with torch.no_grad():
-            outputs = model(**inputs)
-
-        logits = outputs.logits
+        logits = self._segment_clothes(input_image)
         upsampled_logits = F.interpolate(
             logits,
             size=input_image.size[::-1],
@@ -1703,22 +2133,13 @@ asyncio.run(upload())
     def clothes_segment(self, request: ClothesSegmentRequest):
         """服装分割"""
         import numpy as np
-        import torch
         import torch.nn.functional as F
         from PIL import Image
 
         image_data = base64.b64decode(request.image_base64)
         input_image = Image.open(io.BytesIO(image_data)).convert('RGB')
 
-        processor, model = self._get_clothes_model()
-
-        inputs = processor(images=input_image, return_tensors="pt")
-        inputs = {k: v.to(self.device) for k, v in inputs.items()}
-
-        with torch.no_grad():
-            outputs = model(**inputs)
-
-        logits = outputs.logits
+        logits = self._segment_clothes(input_image)
         upsampled_logits = F.interpolate(
             logits,
             size=input_image.size[::-1],
@@ -1747,10 +2168,163 @@ asyncio.run(upload())
             'height': output_image.height
         }
 
+    @modal.fastapi_endpoint(method="POST")
+    def remove_fake_transparency(self, request: RemoveFakeTransparencyRequest):
+        """去除假透明背景（棋盘格）- 批量图片在进程池中并行处理"""
+        from fixpic.checkerboard import remove_fake_transparency_batch
+
+        images_data = [base64.b64decode(b64) for b64 in request.images_base64]
+        print(f"Removing fake transparency for {len(images_data)} images...")
+
+        results = []
+        for png, info in remove_fake_transparency_batch(images_data):
+            img_base64 = base64.b64encode(png).decode('utf-8')
+            results.append({
+                'image': f'data:image/png;base64,{img_base64}',
+                **info,
+            })
+
+        return {
+            'success': True,
+            'results': results,
+        }
+
+    @modal.fastapi_endpoint(method="POST")
+    def compress(self, request: CompressRequest):
+        """批量压缩 / 格式转换 - 支持平台预设和目标体积"""
+        from fixpic.compress import compress_batch, resolve_options
+
+        try:
+            options = resolve_options(
+                request.preset,
+                fmt=request.format,
+                quality=request.quality,
+                max_width=request.max_width,
+                max_bytes=request.max_bytes,
+                min_bytes=request.min_bytes,
+            )
+        except ValueError as e:
+            return {'success': False, 'error': str(e)}
+
+        images_data = [base64.b64decode(b64) for b64 in request.images_base64]
+        print(f"Compressing {len(images_data)} images with {options}...")
+
+        results = []
+        for data, info in compress_batch(images_data, options):
+            img_base64 = base64.b64encode(data).decode('utf-8')
+            results.append({
+                'image': f"data:{info['mime']};base64,{img_base64}",
+                **info,
+            })
+
+        return {
+            'success': True,
+            'results': results,
+        }
+
     @modal.fastapi_endpoint(method="GET")
     def health(self):
-        """健康检查"""
-        return {'status': 'ok', 'version': '2.0'}
+        """健康检查：预热中或必需模型预热失败时返回 503，可选模型失败只在 optional_failed 中列出；
+        含各模型同步 / 预热状态、冷启动耗时和驻留情况"""
+        from fastapi.responses import JSONResponse
+        from fixpic.weights import load_times
+
+        warmup = self.warmup.status()
+        ready = warmup['ready']
+        body = {
+            'status': warmup['state'],
+            'version': '2.0',
+            'ready': ready,
+            'failed': warmup['failed'],
+            'optional_failed': warmup['optional_failed'],
+            'warmup': warmup['models'],
+            'models': self.models.status(),
+            'cold_start': {'setup': self.setup_seconds, 'models': load_times()},
+            'residency': self.model_manager.stats(),
+            'batching': {b.name: b.stats() for b in (self.clothes_batcher, self.blind_batcher)},
+        }
+        return body if ready else JSONResponse(status_code=503, content=body)
+
+    @modal.fastapi_endpoint(method="POST")
+    def submit_job(self, request: JobSubmitRequest):
+        """提交异步任务，立即返回 job_id；之后轮询 job_status 或等待 webhook"""
+        if request.kind not in JOB_KINDS:
+            return {
+                'success': False,
+                'error': f"Unknown job kind: {request.kind} (supported: {', '.join(JOB_KINDS)})",
+            }
+        try:
+            JOB_KINDS[request.kind](**request.request)  # 提交时校验请求体
+        except Exception as e:
+            return {'success': False, 'error': f"Invalid request: {e}"}
+        if request.webhook_url:
+            from fixpic.jobs import validate_webhook_url
+            try:
+                validate_webhook_url(request.webhook_url)
+            except ValueError as e:
+                return {'success': False, 'error': f"Invalid webhook_url: {e}"}
+
+        job = self.jobs.create(request.kind, request.webhook_url)
+        # 任务进入 Modal 队列，由任意 FixPicAPI 容器执行；客户端断开不影响任务
+        FixPicAPI().run_job.spawn(job['id'], request.kind, request.request)
+        print(f"[jobs] {job['id']} queued ({request.kind})")
+        return {'success': True, 'job_id': job['id'], 'status': job['status'], 'expires_at': job['expires_at']}
+
+    @modal.fastapi_endpoint(method="GET")
+    def job_status(self, job_id: str):
+        """任务状态：queued / processing / success（含 result）/ failed（含 error）"""
+        from fastapi.responses import JSONResponse
+        from fixpic.jobs import JobStore
+
+        job = self.jobs.get(job_id)
+        if job is None:
+            return JSONResponse(status_code=404, content={'success': False, 'error': 'Job not found or expired'})
+        return {'success': True, **JobStore.public(job)}
+
+    @modal.method()
+    def run_job(self, job_id: str, kind: str, payload: dict):
+        """执行异步任务（由 submit_job spawn）"""
+        from fixpic.jobs import run_job
+
+        request = JOB_KINDS[kind](**payload)
+        image_data = base64.b64decode(request.image_base64)
+        if kind == 'auto_remove_watermark':
+            run_job(self.jobs, job_id, self._auto_remove_watermark_data, image_data, source=request.source)
+        else:
+            run_job(self.jobs, job_id, self._change_bg_ai_data, image_data, request.num_backgrounds)
+
+    @modal.fastapi_endpoint(method="GET")
+    def detector_stats(self):
+        """水印检测器调度统计：各来源的延迟、命中率、边际贡献和当前排序"""
+        return self._get_detector_registry().snapshot()
+
+    @modal.exit()
+    def teardown(self):
+        """容器退出前保存检测器统计"""
+        if self.detector_registry is not None:
+            self.detector_registry.save()
+
+
+@app.function(volumes={MODEL_DIR: volume}, timeout=3600)
+def sync_models(names: Optional[List[str]] = None, force: bool = False, allow_unpinned: bool = False):
+    """预先下载模型权重到 Volume 并写入锁文件：modal run modal_app_v2.py::sync_models
+
+    没有固定值（fixpic.model_pins）的模型默认不下载，allow_unpinned=True 时下载后需执行 pin 固定。
+    """
+    from fixpic.model_registry import ModelRegistry
+
+    registry = ModelRegistry(MODEL_DIR)
+    synced = registry.sync(names, force=force, allow_unpinned=allow_unpinned)
+
+    # 已知图库水印模板：把镜像中发布的模板复制到 Volume（已登记的跳过）
+    from fixpic.templates import TEMPLATE_DIR, seed_templates
+    seeded = seed_templates(TEMPLATE_DIR)
+    if seeded:
+        print(f"Seeded watermark templates: {seeded}")
+
+    volume.commit()
+    print(f"Synced: {synced or 'nothing new'}")
+    return registry.status()
 
 
 @app.local_entrypoint()
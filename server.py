@@ -1,29 +1,51 @@
 #!/usr/bin/env python3
-"""Fix-Pic 后端服务 - 抠图换背景"""
+"""Fix-Pic 后端服务 - 抠图换背景
+
+torch / segment_anything / transformers / rembg 在首次用到的接口（或预热）中才导入，
+只用压缩、假透明等轻量接口时进程启动不加载它们；导入耗时见 /health。
+"""
+
+import time
+
+BOOT_START = time.perf_counter()
 
 import io
 import os
 import base64
+import tempfile
+import threading
+import cv2
 import numpy as np
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 from PIL import Image
-from rembg import remove
-
-# SAM 相关
-import torch
-from segment_anything import sam_model_registry, SamPredictor
 
-# 语义分割相关
-from transformers import SegformerImageProcessor, AutoModelForSemanticSegmentation
-import torch.nn.functional as F
+from fixpic.matting import remove_background_capped
+from fixpic.product_bg import try_remove_uniform_background
+from fixpic.checkerboard import remove_fake_transparency_batch
+from fixpic.compress import compress_batch, resolve_options
+from fixpic.decode import DecodedImage
+from fixpic.jobs import DirectoryBackend, JobStore, run_job, validate_webhook_url
+from fixpic.model_manager import PredictorPool
+from fixpic.model_registry import get_model_registry
+from fixpic.weights import load_module, load_times, timed_load
+from fixpic.warmup import Warmup, selected_models
+from fixpic.lazy_imports import heavy_modules_loaded, import_times, lazy_import
+
+# 模型目录：python -m fixpic.model_registry --root models sync 预先同步，加载时不联网
+MODEL_DIR = os.environ.get('FIXPIC_MODEL_DIR', os.path.join(os.path.dirname(__file__), 'models'))
+models = get_model_registry(MODEL_DIR)
+models.configure_offline()
 
 app = Flask(__name__)
 CORS(app)
 
-# SAM 模型路径
-SAM_CHECKPOINT = os.path.join(os.path.dirname(__file__), 'models', 'sam_vit_b.pth')
+# SAM 模型
 SAM_MODEL_TYPE = 'vit_b'
+SAM_INPUT_SIDE = 1024  # SAM 内部按 1024px 处理
+# 开发服务器按线程并发处理请求；每个 SAM predictor 持有一张图片的 embedding，
+# 按此数量准备实例（共享同一份权重）
+SAM_POOL_SIZE = int(os.environ.get('SAM_POOL_SIZE', '2'))
 
 # 服装分割类别（对应 mattmdjaga/segformer_b2_clothes 模型）
 CLOTHES_LABELS = {
@@ -69,91 +91,188 @@ CLOTHES_LABELS_CN = {
     17: '围巾'
 }
 
-# 延迟加载 SAM
-sam_predictor = None
+# 延迟加载 SAM（predictor 池）
+sam_pool = None
+_sam_lock = threading.Lock()
 
-# 延迟加载服装分割模型
+# 延迟加载服装分割模型（只做无状态 forward，可并发使用）
 clothes_processor = None
 clothes_model = None
-
-def get_sam_predictor():
-    """延迟加载 SAM 模型"""
-    global sam_predictor
-    if sam_predictor is None:
-        print("🔄 正在加载 SAM 模型...")
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        sam = sam_model_registry[SAM_MODEL_TYPE](checkpoint=SAM_CHECKPOINT)
-        sam.to(device)
-        sam_predictor = SamPredictor(sam)
-        print(f"✅ SAM 模型加载完成 (设备: {device})")
-    return sam_predictor
+_clothes_lock = threading.Lock()
+
+def get_sam_pool():
+    """延迟加载 SAM 模型（预热线程与请求线程并发调用时只加载一次）"""
+    global sam_pool
+    if sam_pool is None:
+        with _sam_lock:
+            if sam_pool is None:
+                print("🔄 正在加载 SAM 模型...")
+                torch = lazy_import('torch')
+                segment_anything = lazy_import('segment_anything')
+                device = 'cuda' if torch.cuda.is_available() else 'cpu'
+                models.require('sam_vit_b')
+                with timed_load('sam_vit_b'):
+                    build = segment_anything.sam_model_registry[SAM_MODEL_TYPE]
+                    sam = load_module(build, models.weights('sam_vit_b'), device)
+                    sam_pool = PredictorPool(sam, segment_anything.SamPredictor, SAM_POOL_SIZE)
+                print(f"✅ SAM 模型加载完成 (设备: {device}，{sam_pool.size} 个 predictor)")
+    return sam_pool
 
 def get_clothes_model():
     """延迟加载服装分割模型"""
     global clothes_processor, clothes_model
     if clothes_model is None:
-        print("🔄 正在加载服装分割模型...")
-        clothes_processor = SegformerImageProcessor.from_pretrained("mattmdjaga/segformer_b2_clothes")
-        clothes_model = AutoModelForSemanticSegmentation.from_pretrained("mattmdjaga/segformer_b2_clothes")
-        device = 'cuda' if torch.cuda.is_available() else 'cpu'
-        clothes_model.to(device)
-        print(f"✅ 服装分割模型加载完成 (设备: {device})")
+        with _clothes_lock:
+            if clothes_model is None:
+                print("🔄 正在加载服装分割模型...")
+                torch = lazy_import('torch')
+                transformers = lazy_import('transformers')
+                model_path = models.require('segformer_clothes')
+                device = 'cuda' if torch.cuda.is_available() else 'cpu'
+                with timed_load('segformer_clothes'):
+                    processor = transformers.SegformerImageProcessor.from_pretrained(model_path)
+                    model = transformers.AutoModelForSemanticSegmentation.from_pretrained(
+                        model_path, low_cpu_mem_usage=True
+                    )
+                    model.to(device)
+                # 两者都就绪后再发布，其他线程不会拿到半初始化的模型
+                clothes_processor = processor
+                clothes_model = model
+                print(f"✅ 服装分割模型加载完成 (设备: {device})")
     return clothes_processor, clothes_model
 
+def remove(*args, **kwargs):
+    """rembg.remove（onnxruntime 导入较慢，首次抠图时才导入）"""
+    return lazy_import('rembg').remove(*args, **kwargs)
+
+def _warmup_sam():
+    with get_sam_pool().acquire() as predictor:
+        predictor.set_image(np.zeros((SAM_INPUT_SIDE, SAM_INPUT_SIDE, 3), dtype=np.uint8))
+        predictor.predict(point_coords=np.array([[512, 512]]), point_labels=np.array([1]))
+        predictor.reset_image()
+
+def _warmup_clothes():
+    torch = lazy_import('torch')
+    processor, model = get_clothes_model()
+    inputs = processor(images=Image.new('RGB', (512, 512)), return_tensors="pt")
+    with torch.no_grad():
+        model(**{k: v.to(model.device) for k, v in inputs.items()})
+
+# 启动预热（WARMUP_MODELS 覆盖，空字符串表示不预热），在后台线程中进行
+WARMUP_STEPS = {'sam_vit_b': _warmup_sam, 'segformer_clothes': _warmup_clothes}
+warmup = Warmup(selected_models('sam_vit_b,segformer_clothes', WARMUP_STEPS))
+
+# 异步任务：长流程接口加 ?async=1 提交后立即返回 job_id，GET /api/jobs/<job_id> 轮询；
+# 表单带 webhook_url 时任务结束后回调。状态存为文件，gunicorn 的各 worker 共享
+JOB_DIR = os.environ.get('FIXPIC_JOB_DIR', os.path.join(tempfile.gettempdir(), 'fixpic-jobs'))
+JOB_WORKERS = int(os.environ.get('FIXPIC_JOB_WORKERS', '2'))
+jobs = JobStore(DirectoryBackend(JOB_DIR))
+_job_executor = None
+_job_lock = threading.Lock()
+
+def _job_pool():
+    """任务线程池（fork 之后在各 worker 中创建）"""
+    global _job_executor
+    with _job_lock:
+        if _job_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job')
+        return _job_executor
+
+def respond(handler, **kwargs):
+    """执行接口的处理函数（只接受解析好的参数，返回 (响应 dict, HTTP 状态码)）
+
+    带 ?async=1 时交给任务线程池，立即返回 202 和 job_id；处理函数返回 4xx/5xx 时任务记为失败。
+    """
+    if request.args.get('async') != '1':
+        body, status = handler(**kwargs)
+        return jsonify(body), status
+    webhook_url = request.form.get('webhook_url')
+    if webhook_url:
+        try:
+            validate_webhook_url(webhook_url)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+    jobs.purge()
+    job = jobs.create(request.path, webhook_url)
+    _job_pool().submit(run_job, jobs, job['id'], handler, **kwargs)
+    return jsonify({'success': True, 'job_id': job['id'], 'status': job['status']}), 202
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """任务状态：queued / processing / success（含 result）/ failed（含 error）"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    return jsonify({'success': True, **JobStore.public(job)})
+
+def _uploaded(name):
+    """上传文件的字节，没有该文件时返回 None"""
+    file = request.files.get(name)
+    return file.read() if file is not None else None
+
 @app.route('/api/remove-bg', methods=['POST'])
 def remove_background():
     """抠图 - 去除背景"""
-    try:
-        if 'image' not in request.files:
-            return jsonify({'error': '请上传图片'}), 400
+    if 'image' not in request.files:
+        return jsonify({'error': '请上传图片'}), 400
+    return respond(remove_background_image, image=_uploaded('image'))
 
-        file = request.files['image']
-        input_image = Image.open(file.stream)
 
-        # 使用 rembg 去除背景
-        output_image = remove(input_image)
+def remove_background_image(image):
+    """抠图：image 为图片字节，返回 (响应 dict, HTTP 状态码)"""
+    try:
+        input_image = Image.open(io.BytesIO(image))
+
+        # 纯色背景走快速路径，否则使用 rembg 去除背景
+        output_image = try_remove_uniform_background(input_image)
+        if output_image is None:
+            output_image = remove_background_capped(input_image, remove)
 
         # 转换为 base64
         buffered = io.BytesIO()
         output_image.save(buffered, format='PNG')
         img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
 
-        return jsonify({
+        return {
             'success': True,
             'image': f'data:image/png;base64,{img_base64}',
             'width': output_image.width,
             'height': output_image.height
-        })
+        }, 200
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
 
 
 @app.route('/api/change-bg', methods=['POST'])
 def change_background():
     """换背景"""
-    try:
-        if 'image' not in request.files:
-            return jsonify({'error': '请上传图片'}), 400
+    if 'image' not in request.files:
+        return jsonify({'error': '请上传图片'}), 400
+    return respond(change_background_image, image=_uploaded('image'),
+                   background=_uploaded('background'), bg_color=request.form.get('bg_color'))
 
-        file = request.files['image']
-        input_image = Image.open(file.stream)
+
+def change_background_image(image, background=None, bg_color=None):
+    """换背景：background 为背景图字节，否则使用 bg_color（#RRGGBB，默认白色）；
+    返回 (响应 dict, HTTP 状态码)"""
+    try:
+        input_image = Image.open(io.BytesIO(image))
 
         # 去除背景
-        fg_image = remove(input_image)
+        fg_image = remove_background_capped(input_image, remove)
 
         # 获取新背景
-        if 'background' in request.files:
+        if background is not None:
             # 用户上传的背景图
-            bg_file = request.files['background']
-            bg_image = Image.open(bg_file.stream).convert('RGBA')
+            bg_image = Image.open(io.BytesIO(background)).convert('RGBA')
             bg_image = bg_image.resize(fg_image.size, Image.Resampling.LANCZOS)
-        elif 'bg_color' in request.form:
+        elif bg_color is not None:
             # 纯色背景
-            color = request.form['bg_color']
-            if color.startswith('#'):
-                r = int(color[1:3], 16)
-                g = int(color[3:5], 16)
-                b = int(color[5:7], 16)
+            if bg_color.startswith('#'):
+                r = int(bg_color[1:3], 16)
+                g = int(bg_color[3:5], 16)
+                b = int(bg_color[5:7], 16)
             else:
                 r, g, b = 255, 255, 255
             bg_image = Image.new('RGBA', fg_image.size, (r, g, b, 255))
@@ -169,14 +288,14 @@ def change_background():
         result.save(buffered, format='PNG')
         img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
 
-        return jsonify({
+        return {
             'success': True,
             'image': f'data:image/png;base64,{img_base64}',
             'width': result.width,
             'height': result.height
-        })
+        }, 200
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return {'error': str(e)}, 500
 
 
 @app.route('/api/sam-segment', methods=['POST'])
@@ -194,31 +313,36 @@ def sam_segment():
         if not points:
             return jsonify({'error': '请点击选择要抠出的区域'}), 400
 
+        # SAM 内部按 1024px 处理，直接解码缩小图
         file = request.files['image']
-        input_image = Image.open(file.stream).convert('RGB')
-        image_array = np.array(input_image)
+        source = DecodedImage.from_bytes(file.read())
+        image_array = source.array(SAM_INPUT_SIDE)
+        scale = image_array.shape[1] / source.width
 
-        # 获取 SAM 预测器
-        predictor = get_sam_predictor()
-        predictor.set_image(image_array)
-
-        # 准备点击点和标签
-        input_points = np.array([[p['x'], p['y']] for p in points])
+        # 准备点击点和标签（坐标同比缩放）
+        input_points = np.array([[p['x'] * scale, p['y'] * scale] for p in points])
         input_labels = np.array([p.get('label', 1) for p in points])  # 1=前景, 0=背景
 
-        # 预测分割掩码
-        masks, scores, _ = predictor.predict(
-            point_coords=input_points,
-            point_labels=input_labels,
-            multimask_output=True
-        )
+        # 借用一个独立的 SAM 预测器（embedding 保存在实例上，不能与其他请求共用）
+        with get_sam_pool().acquire() as predictor:
+            predictor.set_image(image_array)
+
+            # 预测分割掩码
+            masks, scores, _ = predictor.predict(
+                point_coords=input_points,
+                point_labels=input_labels,
+                multimask_output=True,
+                return_logits=True
+            )
+            mask_threshold = predictor.model.mask_threshold
 
-        # 选择得分最高的掩码
+        # 选择得分最高的掩码，logits 上采样到原图尺寸后再阈值化
         best_idx = np.argmax(scores)
-        mask = masks[best_idx]
+        logits = cv2.resize(masks[best_idx].astype(np.float32), source.size, interpolation=cv2.INTER_LINEAR)
+        mask = logits > mask_threshold
 
         # 应用掩码创建透明图 (使用 numpy 加速)
-        input_rgba = np.array(input_image.convert('RGBA'))
+        input_rgba = np.array(source.full().convert('RGBA'))
         output_array = np.zeros_like(input_rgba)
         output_array[mask] = input_rgba[mask]
         output_image = Image.fromarray(output_array, 'RGBA')
@@ -252,6 +376,8 @@ def clothes_parse():
         input_image = Image.open(file.stream).convert('RGB')
 
         # 获取模型
+        torch = lazy_import('torch')
+        F = lazy_import('torch.nn.functional')
         processor, model = get_clothes_model()
         device = next(model.parameters()).device
 
@@ -322,6 +448,8 @@ def clothes_segment():
         input_image = Image.open(file.stream).convert('RGB')
 
         # 获取模型
+        torch = lazy_import('torch')
+        F = lazy_import('torch.nn.functional')
         processor, model = get_clothes_model()
         device = next(model.parameters()).device
 
@@ -371,14 +499,180 @@ def clothes_segment():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/remove-fake-transparency', methods=['POST'])
+def remove_fake_transparency():
+    """去除假透明背景（棋盘格）- 支持多张图片批量处理"""
+    try:
+        files = request.files.getlist('images') or request.files.getlist('image')
+        if not files:
+            return jsonify({'error': '请上传图片'}), 400
+
+        images_data = [f.read() for f in files]
+        results = []
+        for png, info in remove_fake_transparency_batch(images_data):
+            img_base64 = base64.b64encode(png).decode('utf-8')
+            results.append({
+                'image': f'data:image/png;base64,{img_base64}',
+                **info
+            })
+
+        return jsonify({
+            'success': True,
+            'results': results
+        })
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/api/compress', methods=['POST'])
+def compress():
+    """批量压缩 / 格式转换 - 支持平台预设和目标体积（max_bytes）"""
+    try:
+        files = request.files.getlist('images') or request.files.getlist('image')
+        if not files:
+            return jsonify({'error': '请上传图片'}), 400
+
+        def form_int(name):
+            value = request.form.get(name)
+            return int(value) if value else None
+
+        try:
+            options = resolve_options(
+                request.form.get('preset') or None,
+                fmt=request.form.get('format') or None,
+                quality=form_int('quality'),
+                max_width=form_int('max_width'),
+                max_bytes=form_int('max_bytes'),
+                min_bytes=form_int('min_bytes')
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        images_data = [f.read() for f in files]
+        results = []
+        for data, info in compress_batch(images_data, options):
+            img_base64 = base64.b64encode(data).decode('utf-8')
+            results.append({
+                'image': f"data:{info['mime']};base64,{img_base64}",
+                **info
+            })
+
+        return jsonify({
+            'success': True,
+            'results': results
+        })
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/health', methods=['GET'])
 def health():
-    """健康检查"""
-    return jsonify({'status': 'ok'})
+    """健康检查：预热中或必需模型预热失败时返回 503；含各模型同步 / 预热状态和加载耗时"""
+    status = warmup.status()
+    ready = status['ready']
+    body = {
+        'status': status['state'],
+        'ready': ready,
+        'failed': status['failed'],
+        'optional_failed': status['optional_failed'],
+        'warmup': status['models'],
+        'models': models.status(),
+        'load_times': load_times(),
+        'startup': {
+            'boot_seconds': BOOT_SECONDS,
+            'imports': import_times(),
+            'heavy_modules': heavy_modules_loaded(),
+        },
+    }
+    return jsonify(body), (200 if ready else 503)
+
+
+# 模块导入（不含重量级依赖）耗时
+BOOT_SECONDS = round(time.perf_counter() - BOOT_START, 3)
+
+
+def configure_worker_threads(num_threads):
+    """限制单个 worker 的计算线程数（torch / ONNX Runtime / OpenCV / 批处理进程池），
+    避免 N 个 worker 各自占满全部核心"""
+    import sys
+    import fixpic.pool
+
+    os.environ['OMP_NUM_THREADS'] = str(num_threads)  # rembg 据此设置 ONNX Runtime 线程数
+    os.environ['MKL_NUM_THREADS'] = str(num_threads)
+    cv2.setNumThreads(num_threads)
+    if 'torch' in sys.modules:
+        sys.modules['torch'].set_num_threads(num_threads)
+    if 'FIXPIC_POOL_WORKERS' not in os.environ:
+        fixpic.pool.POOL_WORKERS = num_threads
+
+
+def serve(host, port, workers):
+    """生产模式：父进程加载并预热模型后 fork 出 workers 个 gunicorn worker，
+    模型权重以写时复制方式共享"""
+    from gunicorn.app.base import BaseApplication
+
+    cores = os.cpu_count() or 1
+    threads_per_worker = max(1, cores // workers)
+
+    # CUDA 上下文不能跨 fork 使用，GPU 环境下由各 worker 自行加载
+    torch = lazy_import('torch') if warmup.status()['models'] else None
+    preload = not (torch is not None and torch.cuda.is_available() and workers > 1)
+    if preload:
+        # libgomp / OpenCV 的线程池不是 fork 安全的：父进程里多线程跑过推理后，
+        # fork 出的 worker 第一次矩阵运算会卡死。父进程单线程预热（不创建线程池），
+        # 各 worker 在 post_fork 中再设置自己的线程数
+        configure_worker_threads(1)
+        warmup.run(WARMUP_STEPS)
+    else:
+        print("⚠️ CUDA 可用：跳过父进程预加载，各 worker 启动后自行预热")
+
+    def post_fork(server, worker):
+        configure_worker_threads(threads_per_worker)
+        if not preload:
+            warmup.start(WARMUP_STEPS)
+
+    class FixPicServer(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f'{host}:{port}')
+            self.cfg.set('workers', workers)
+            self.cfg.set('threads', 1)
+            self.cfg.set('preload_app', True)
+            self.cfg.set('timeout', 300)
+            self.cfg.set('post_fork', post_fork)
+
+        def load(self):
+            return app
+
+    print(f"🚀 Fix-Pic 生产模式：{workers} 个 worker × {threads_per_worker} 线程，http://{host}:{port}")
+    FixPicServer().run()
 
 
 if __name__ == '__main__':
-    print("🚀 Fix-Pic 后端服务启动中...")
-    print("📍 http://localhost:5001")
-    print("💡 首次抠图会下载模型（约170MB），请耐心等待")
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Fix-Pic 后端服务")
+    parser.add_argument('--serve', action='store_true', help="生产模式（gunicorn 多 worker）")
+    parser.add_argument('--workers', type=int,
+                        default=int(os.environ.get('FIXPIC_WORKERS', '0')) or max(1, min(4, (os.cpu_count() or 1) // 2)))
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5001)
+    args = parser.parse_args()
+
+    missing = [name for name, s in models.status().items() if not s['ready']]
+    if missing:
+        print(f"💡 以下模型尚未同步：{', '.join(missing)}")
+        print(f"   python -m fixpic.model_registry --root {MODEL_DIR} sync")
+
+    if args.serve:
+        serve(args.host, args.port, args.workers)
+    else:
+        print(f"🚀 Fix-Pic 后端服务启动中...（导入耗时 {BOOT_SECONDS:.2f}s）")
+        print(f"📍 http://localhost:{args.port}")
+        # debug 模式的重载器会启动两个进程，只在实际服务的子进程中预热
+        if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+            warmup.start(WARMUP_STEPS)
+        app.run(host=args.host, port=args.port, debug=True)
@@ -0,0 +1,71 @@
+"""动态批处理：合并推理、结果按提交顺序分发、异常传回每个请求"""
+
+import threading
+
+import pytest
+
+from fixpic.batcher import DynamicBatcher
+
+
+def run_concurrently(fn, args):
+    results = [None] * len(args)
+    errors = [None] * len(args)
+    barrier = threading.Barrier(len(args))
+
+    def worker(i):
+        barrier.wait()
+        try:
+            results[i] = fn(args[i])
+        except Exception as e:
+            errors[i] = e
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(len(args))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(5)
+    return results, errors
+
+
+def test_scatters_results_in_submission_order():
+    batches = []
+
+    def run_batch(items):
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    batcher = DynamicBatcher('toy', run_batch, max_batch=16, max_wait_ms=50)
+    requests = [[i * 100 + j for j in range(i + 1)] for i in range(6)]
+    results, errors = run_concurrently(batcher.submit_many, requests)
+
+    assert errors == [None] * 6
+    assert results == [[x * 10 for x in items] for items in requests]
+    assert len(batches) < len(requests)  # 并发请求被合并
+    assert batcher.stats()['items'] == sum(len(r) for r in requests)
+
+
+def test_keys_are_not_mixed():
+    def run_batch(items):
+        assert len({item[0] for item in items}) == 1
+        return [item[1] for item in items]
+
+    batcher = DynamicBatcher('toy', run_batch, max_batch=8, max_wait_ms=20)
+    args = [(k, i) for i in range(8) for k in ('a', 'b')]
+    results, errors = run_concurrently(lambda item: batcher.submit(item, key=item[0]), args)
+
+    assert errors == [None] * len(args)
+    assert results == [i for _, i in args]
+
+
+def test_errors_reach_every_caller():
+    def run_batch(items):
+        raise ValueError('boom')
+
+    batcher = DynamicBatcher('toy', run_batch, max_batch=4, max_wait_ms=20)
+    _, errors = run_concurrently(batcher.submit, list(range(4)))
+    assert all(isinstance(e, ValueError) for e in errors)
+    assert batcher.stats()['errors'] >= 1
+
+    short = DynamicBatcher('short', lambda items: items[:-1], max_batch=1)
+    with pytest.raises(RuntimeError, match='returned'):
+        short.submit(1)
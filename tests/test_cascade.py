@@ -0,0 +1,125 @@
+"""门控与级联：横排 / 竖排 / 斜向水印都要有信号，门控不能让斜向平铺水印被判为空"""
+
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from fixpic.cascade import TEXT_MIN_RATIO, CascadeGate, DetectorCascade, text_candidates
+from fixpic.image_context import ImageContext
+from fixpic.patterns import repeated_contour_mask
+
+TEST_IMAGES = Path(__file__).resolve().parent.parent / 'test_images'
+
+
+def text_image(vertical):
+    image = np.full((600, 600, 3), 128, np.uint8)
+    strip = np.zeros((80, 500, 3), np.uint8)
+    cv2.putText(strip, 'WATERMARK', (5, 60), cv2.FONT_HERSHEY_SIMPLEX, 2, (255, 255, 255), 4)
+    if vertical:
+        image[50:550, 260:340] = np.rot90(strip)
+    else:
+        image[260:340, 50:550] = strip
+    return Image.fromarray(image)
+
+
+def test_plain_image_has_no_text_signal():
+    _, ratio = text_candidates(Image.new('RGB', (600, 600), (128, 128, 128)))
+    assert ratio < TEXT_MIN_RATIO
+
+
+def test_horizontal_and_vertical_text():
+    for vertical in (False, True):
+        _, ratio = text_candidates(text_image(vertical))
+        assert ratio >= TEXT_MIN_RATIO, vertical
+
+
+def gradient(size=(900, 700)):
+    w, h = size
+    g = np.linspace(60, 200, w, dtype=np.float32)[None, :].repeat(h, 0)
+    return np.stack([g, g * 0.9, g * 0.8], 2).astype(np.uint8)
+
+
+def tiled_watermark(base, angle, alpha, step=260):
+    """旋转 angle 度的平铺文字水印（白色，不透明度 alpha）"""
+    h, w = base.shape[:2]
+    big = max(h, w) * 2
+    layer = np.zeros((big, big), np.uint8)
+    for row, y in enumerate(range(0, big, step // 2)):
+        for x in range(row % 2 * step // 2, big, step):
+            cv2.putText(layer, 'WATERMARK', (x, y), cv2.FONT_HERSHEY_SIMPLEX, 1.4, 255, 3, cv2.LINE_AA)
+    rotation = cv2.getRotationMatrix2D((big / 2, big / 2), angle, 1.0)
+    layer = cv2.warpAffine(layer, rotation, (big, big))
+    top, left = (big - h) // 2, (big - w) // 2
+    a = layer[top:top + h, left:left + w].astype(np.float32)[:, :, None] / 255 * alpha
+    return Image.fromarray(np.clip(a * 255 + (1 - a) * base, 0, 255).astype(np.uint8))
+
+
+@pytest.mark.parametrize('angle', [30, 45, -30, -45])
+def test_diagonal_text_has_signal(angle):
+    _, ratio = text_candidates(tiled_watermark(gradient(), angle, 0.5))
+    assert ratio >= TEXT_MIN_RATIO
+
+
+def pattern_stage(ctx):
+    mask, _ = repeated_contour_mask(ctx)
+    return mask, np.count_nonzero(mask)
+
+
+@pytest.mark.parametrize('base', ['gradient', 'adobe_stock_watermark.jpg'])
+@pytest.mark.parametrize('angle', [30, 45])
+@pytest.mark.parametrize('alpha', [0.3, 0.7])
+def test_rotated_tiles_are_not_judged_empty(base, angle, alpha):
+    background = gradient() if base == 'gradient' else np.asarray(Image.open(TEST_IMAGES / base).convert('RGB'))
+    ctx = ImageContext.of(tiled_watermark(background, angle, alpha))
+    gate = CascadeGate(ctx)
+    expensive = []
+
+    # 注册表可能把昂贵的检测器排在前面；文字信号弱时便宜的平铺模式检测仍要先跑
+    cascade = DetectorCascade([
+        ('ocr', lambda c: expensive.append('ocr') or (None, 0), 2, None),
+        ('pattern', pattern_stage, 0.5, 15),
+    ], sort=False)
+    combined, info = cascade.run(ctx, gate)
+
+    assert 'pattern' in info['stages']
+    assert info.get('early_exit') != 'empty'
+    # 要么门控看到了斜向文字（昂贵的检测器照常运行），要么便宜的平铺模式检测已经找到水印
+    assert expensive or combined is not None
+
+
+def test_clean_image_skips_only_expensive_detectors():
+    ctx = ImageContext.of(Image.fromarray(gradient()))
+    gate = CascadeGate(ctx)
+    assert gate.clean
+
+    ran = []
+    cascade = DetectorCascade([
+        ('ocr', lambda c: ran.append('ocr') or (None, 0), 2, None),
+        ('bar', lambda c: ran.append('bar') or (None, 0), 0.1, None),
+    ], sort=False)
+    combined, info = cascade.run(ctx, gate)
+
+    assert combined is None and ran == ['bar']
+    assert info['early_exit'] == 'empty'
+
+
+def test_weak_gate_runs_cheap_detectors_before_giving_up():
+    ctx = ImageContext.of(Image.fromarray(gradient()))
+    gate = CascadeGate(ctx)
+    found = np.zeros((700, 900), np.uint8)
+    found[100:140, 100:400] = 255
+
+    ran = []
+    cascade = DetectorCascade([
+        ('ocr', lambda c: ran.append('ocr') or (None, 0), 2, None),
+        ('pattern', lambda c: ran.append('pattern') or (found, np.count_nonzero(found)), 0.5, 15),
+    ], sort=False)
+    combined, info = cascade.run(ctx, gate)
+
+    # 便宜的检测器先跑并找到水印：结果保留，不会被判为空
+    assert ran[0] == 'pattern'
+    assert np.array_equal(combined, found)
+    assert info.get('early_exit') != 'empty'
@@ -0,0 +1,35 @@
+"""假透明背景：棋盘格检测与 alpha"""
+
+import numpy as np
+from PIL import Image
+
+from fixpic.checkerboard import remove_fake_transparency
+
+
+def fake_transparent(size=(240, 180), period=12, offset=(5, 3)):
+    w, h = size
+    ys, xs = np.mgrid[0:h, 0:w]
+    parity = (((ys + offset[1]) // period) + ((xs + offset[0]) // period)) % 2
+    rgb = np.where(parity[:, :, None] == 0, 255, 204).repeat(3, axis=2).astype(np.uint8)
+    rgb[60:120, 80:160] = (200, 40, 40)  # 主体
+    return rgb
+
+
+def test_checkerboard_becomes_transparent():
+    rgb = fake_transparent()
+    output, info = remove_fake_transparency(Image.fromarray(rgb))
+
+    assert info['method'] == 'checkerboard' and info['period'] == 12
+    alpha = np.asarray(output)[:, :, 3]
+    assert alpha[60:120, 80:160].min() == 255
+    background = np.ones(alpha.shape, bool)
+    background[58:122, 78:162] = False
+    assert alpha[background].max() == 0
+
+
+def test_plain_image_falls_back_to_threshold():
+    rgb = np.zeros((120, 120, 3), np.uint8)
+    rgb[:] = (30, 90, 160)
+    output, info = remove_fake_transparency(Image.fromarray(rgb))
+    assert info['method'] == 'threshold'
+    assert np.asarray(output)[:, :, 3].min() == 255
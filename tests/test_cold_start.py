@@ -0,0 +1,35 @@
+"""冷启动计时：只记录成功的加载，检查点包装键被解开（不依赖 torch）"""
+
+import time
+
+import pytest
+
+from fixpic import weights
+
+
+def test_timed_load_records_successful_loads():
+    with weights.timed_load('test_model_ok'):
+        time.sleep(0.05)
+    assert weights.load_times()['test_model_ok'] >= 0.05
+
+    with pytest.raises(RuntimeError):
+        with weights.timed_load('test_model_broken'):
+            raise RuntimeError('corrupt weights')
+    assert 'test_model_broken' not in weights.load_times()
+
+
+def test_load_times_is_a_snapshot():
+    with weights.timed_load('test_model_snapshot'):
+        pass
+    snapshot = weights.load_times()
+    snapshot.clear()
+    assert 'test_model_snapshot' in weights.load_times()
+
+
+@pytest.mark.parametrize('checkpoint', [
+    {'state_dict': {'w': 1}},
+    {'model': {'w': 1}},
+    {'w': 1},
+])
+def test_checkpoint_wrappers_are_unwrapped(checkpoint):
+    assert weights._unwrap_state_dict(checkpoint) == {'w': 1}
@@ -0,0 +1,89 @@
+"""图片压缩：参数校验、目标体积搜索与透明度"""
+
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from fixpic.compress import compress_image, encode, resolve_options
+
+
+def noisy_image(size=(800, 600), seed=0, sigma=25):
+    rng = np.random.default_rng(seed)
+    base = np.linspace(0, 255, size[0], dtype=np.float32)[None, :, None].repeat(size[1], 0).repeat(3, 2)
+    noise = rng.normal(0, sigma, (size[1], size[0], 3))
+    return Image.fromarray(np.clip(base + noise, 0, 255).astype(np.uint8))
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'fmt': 'gif'},
+    {'quality': 0},
+    {'quality': 101},
+    {'max_bytes': -1},
+])
+def test_rejects_invalid_options(kwargs):
+    with pytest.raises(ValueError):
+        resolve_options(**kwargs)
+
+
+def test_preset_with_overrides():
+    options = resolve_options('taobao', fmt='WEBP', max_width=None)
+    assert options['fmt'] == 'webp' and options['max_width'] == 800
+    with pytest.raises(ValueError):
+        resolve_options('unknown')
+
+
+def test_max_bytes_stays_within_requested_quality():
+    image = noisy_image()
+    data, info = compress_image(image, 'jpeg', quality=60, max_bytes=10 * 1024 * 1024)
+    assert info['quality'] == 60 and info['full_encodes'] == 1
+
+    limit = 60 * 1024
+    data, info = compress_image(image, 'jpeg', quality=90, max_bytes=limit)
+    assert len(data) <= limit and info['within_limits']
+    assert info['quality'] <= 90
+    assert info['full_encodes'] <= 3
+
+
+def test_min_bytes_can_go_above_requested_quality():
+    # 平滑的白底图：默认质量 80 只有约 17KB，低于 taobao_white 的 38KB 下限
+    image = noisy_image(sigma=2)
+    options = resolve_options('taobao_white')
+    assert len(encode(image, 'JPEG', options['quality'])) < options['min_bytes']
+
+    data, info = compress_image(image, **options)
+    assert info['within_limits']
+    assert options['min_bytes'] <= len(data) <= options['max_bytes']
+    assert info['quality'] > options['quality']
+
+
+def test_min_bytes_keeps_requested_quality_when_large_enough():
+    image = noisy_image(sigma=6)
+    data, info = compress_image(image, 'jpeg', quality=80, min_bytes=38 * 1024, max_bytes=300 * 1024)
+    assert info['quality'] == 80 and info['full_encodes'] == 1
+
+
+def test_unreachable_min_bytes_returns_closest_encode():
+    image = noisy_image(size=(64, 64), sigma=2)
+    first = encode(image, 'JPEG', 80)
+    data, info = compress_image(image, 'jpeg', quality=80, min_bytes=10 * 1024 * 1024)
+
+    # 不是第一个（质量 80）的编码，而是尝试过的最大的
+    assert not info['within_limits']
+    assert len(data) > len(first) and info['quality'] > 80
+
+
+def test_palette_transparency_is_kept():
+    image = Image.new('P', (64, 64), 0)
+    image.putpalette([255, 0, 0, 0, 0, 255] + [0] * 762)
+    image.paste(1, (0, 0, 32, 64))
+    image.info['transparency'] = 0
+
+    data, _ = compress_image(image, 'png')
+    alpha = np.asarray(Image.open(io.BytesIO(data)).convert('RGBA'))[:, :, 3]
+    assert alpha[:, 40:].max() == 0 and alpha[:, :32].min() == 255
+
+    data, _ = compress_image(image, 'jpeg')
+    rgb = np.asarray(Image.open(io.BytesIO(data)).convert('RGB'))
+    assert rgb[:, 40:].min() > 240  # 透明区域铺白底
@@ -0,0 +1,36 @@
+"""按需分辨率解码：缩小图不触发全分辨率解码"""
+
+import io
+
+import numpy as np
+from PIL import Image
+
+from fixpic.decode import DecodedImage, as_decoded
+
+
+def jpeg_bytes(size=(2000, 1200)):
+    w, h = size
+    gradient = np.linspace(0, 255, w, dtype=np.uint8)[None, :, None].repeat(h, 0).repeat(3, 2)
+    buffered = io.BytesIO()
+    Image.fromarray(gradient).save(buffered, format='JPEG', quality=90)
+    return buffered.getvalue()
+
+
+def test_reduced_decode_skips_full_resolution():
+    decoded = DecodedImage.from_bytes(jpeg_bytes())
+    assert decoded.size == (2000, 1200) and decoded.format == 'JPEG'
+
+    small = decoded.array(500)
+    assert small.shape == (300, 500, 3)
+    assert decoded.array(500) is small  # 缓存
+    assert decoded._full is None  # 只解码了缩小图
+
+    assert decoded.full().size == (2000, 1200)
+    assert decoded.array().shape == (1200, 2000, 3)
+
+
+def test_small_image_is_not_upscaled():
+    decoded = as_decoded(Image.new('RGB', (300, 200), (10, 20, 30)))
+    assert as_decoded(decoded) is decoded
+    assert decoded.reduced(1500) is decoded.full()
+    assert decoded.array(1500).shape == (200, 300, 3)
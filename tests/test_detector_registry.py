@@ -0,0 +1,111 @@
+"""检测器注册表：多容器合并保存、来源上限、确定的排序快照"""
+
+import fixpic.detector_registry as detector_registry
+from fixpic.detector_registry import DetectorRegistry
+
+
+def make_registry(path):
+    registry = DetectorRegistry(path=str(path))
+    registry.register('bar', None, 0.1)
+    registry.register('ocr', None, 2)
+    return registry
+
+
+def test_save_merges_stats_from_other_containers(tmp_path):
+    path = tmp_path / 'stats.json'
+    first = make_registry(path)
+    second = make_registry(path)
+
+    for _ in range(3):
+        first.record('shop', 'bar', 0.01, True, 0.5)
+    for _ in range(5):
+        second.record('shop', 'bar', 0.03, False, 0.0)
+    first.save()
+    second.save()
+
+    stats = make_registry(path).snapshot()['sources']['shop']['bar']
+    assert stats['runs'] == 8
+    assert stats['hit_rate'] == round(3 / 8, 4)
+    # 第二个容器保存后，本地视图也包含第一个容器的统计
+    assert second.snapshot()['sources']['shop']['bar']['runs'] == 8
+
+    # 增量只合并一次，重复保存不会重复计数
+    second.save()
+    assert make_registry(path).snapshot()['sources']['shop']['bar']['runs'] == 8
+
+
+def test_sources_are_capped(tmp_path, monkeypatch):
+    monkeypatch.setattr(detector_registry, 'MAX_SOURCES', 2)
+    registry = make_registry(tmp_path / 'stats.json')
+
+    for source in ['a', 'B ', 'c', 'd', None, 42]:
+        registry.record(source, 'bar', 0.01, True, 0.5)
+
+    assert sorted(registry.snapshot()['sources']) == ['a', 'b', 'default']
+
+
+def test_allowlisted_sources(tmp_path, monkeypatch):
+    monkeypatch.setattr(detector_registry, 'ALLOWED_SOURCES', {'shop'})
+    registry = make_registry(tmp_path / 'stats.json')
+
+    registry.record('Shop', 'bar', 0.01, True, 0.5)
+    registry.record('other', 'bar', 0.01, True, 0.5)
+
+    assert sorted(registry.snapshot()['sources']) == ['default', 'shop']
+
+
+def test_snapshot_order_is_deterministic(tmp_path, monkeypatch):
+    monkeypatch.setattr(detector_registry, 'EXPLORE_RATE', 0.5)
+    registry = make_registry(tmp_path / 'stats.json')
+    for _ in range(detector_registry.MIN_RUNS):
+        registry.record('shop', 'bar', 0.01, False, 0.0)
+        registry.record('shop', 'ocr', 0.5, True, 0.8)
+
+    orders = {tuple(registry.snapshot()['order']['shop']) for _ in range(50)}
+    assert orders == {('ocr',)}
+
+
+def test_failed_reload_keeps_shared_file_and_pending(tmp_path, monkeypatch):
+    monkeypatch.setattr(detector_registry, 'RELOAD_BACKOFF', 0)
+    path = tmp_path / 'stats.json'
+    other = make_registry(path)
+    for _ in range(4):
+        other.record('shop', 'bar', 0.01, True, 0.5)
+    other.save()
+    before = path.read_text()
+
+    reloads = []
+
+    def reload():
+        reloads.append(1)
+        raise RuntimeError("there are open files preventing the operation")
+
+    registry = DetectorRegistry(path=str(path), on_reload=reload)
+    registry.register('bar', None, 0.1)
+    registry.record('shop', 'bar', 0.02, False, 0.0)
+
+    assert registry.save() is False
+    assert len(reloads) == detector_registry.RELOAD_ATTEMPTS
+    # 不会用本容器的视图覆盖其他容器的统计
+    assert path.read_text() == before
+
+    # reload 恢复后增量照常合并
+    registry.on_reload = lambda: None
+    assert registry.save() is True
+    assert make_registry(path).snapshot()['sources']['shop']['bar']['runs'] == 5
+
+
+def test_transient_reload_failure_is_retried(tmp_path, monkeypatch):
+    monkeypatch.setattr(detector_registry, 'RELOAD_BACKOFF', 0)
+    failures = [RuntimeError("busy")]
+
+    def reload():
+        if failures:
+            raise failures.pop()
+
+    registry = DetectorRegistry(path=str(tmp_path / 'stats.json'), on_reload=reload)
+    registry.register('bar', None, 0.1)
+    registry.record('shop', 'bar', 0.01, True, 0.5)
+
+    assert registry.save() is True
+    assert make_registry(tmp_path / 'stats.json').snapshot()['sources']['shop']['bar']['runs'] == 1
@@ -0,0 +1,54 @@
+"""斜向文字水印：缩小图上检测，mask 放大回原图尺寸"""
+
+import os
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+from fixpic.diagonal import detect_diagonal_text
+
+FONT = '/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf'
+
+
+def gradient(size):
+    w, h = size
+    row = np.linspace(60, 200, w, dtype=np.uint8)
+    return Image.fromarray(np.stack([row] * 3, axis=-1)[None].repeat(h, 0))
+
+
+def with_diagonal_watermark(image, text='SAMPLE', spacing=360):
+    """平铺的 45° 白色文字"""
+    if not os.path.exists(FONT):
+        pytest.skip('DejaVu font not available')
+    font = ImageFont.truetype(FONT, 48)
+    side = int(max(image.size) * 1.5)
+    layer = Image.new('L', (side, side), 0)
+    draw = ImageDraw.Draw(layer)
+    for y in range(0, side, spacing // 2):
+        for x in range(0, side, spacing):
+            draw.text((x, y), text, fill=255, font=font)
+    layer = layer.rotate(45, resample=Image.Resampling.BILINEAR)
+    left, top = (side - image.width) // 2, (side - image.height) // 2
+    alpha = layer.crop((left, top, left + image.width, top + image.height)).point(lambda v: v * 0.6)
+
+    marked = image.copy()
+    marked.paste(Image.new('RGB', image.size, (255, 255, 255)), mask=alpha)
+    return marked
+
+
+def test_tiled_diagonal_text_is_detected():
+    clean = gradient((2048, 1536))
+    image = with_diagonal_watermark(clean)
+    mask, info = detect_diagonal_text(image)
+    text = np.abs(np.asarray(image, np.int16) - np.asarray(clean, np.int16)).max(axis=2) > 20
+
+    assert mask.shape == (1536, 2048)
+    assert info['scale'] == 0.5 and info['regions'] > 0
+    assert np.count_nonzero(mask) / mask.size < 0.3
+    assert np.mean(mask[text] > 0) > 0.5  # 大部分文字像素被覆盖
+
+
+def test_clean_image_has_no_diagonal_regions():
+    mask, info = detect_diagonal_text(gradient((2048, 1536)))
+    assert info['regions'] == 0 and not mask.any()
@@ -0,0 +1,40 @@
+"""边缘横条分析：积分图查表与逐行统计一致，能找到底部信息条"""
+
+import numpy as np
+from PIL import Image
+
+from fixpic.edge_bands import EdgeBandAnalyzer, band_mask, find_runs
+from fixpic.image_context import ImageContext
+
+
+def photo(size=(640, 480), seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8)
+
+
+def test_find_runs():
+    starts, lengths = find_runs([0, 1, 1, 0, 1, 1, 1])
+    assert starts.tolist() == [1, 4] and lengths.tolist() == [2, 3]
+
+
+def test_row_std_matches_numpy():
+    ctx = ImageContext.of(Image.fromarray(photo()))
+    analyzer = EdgeBandAnalyzer(ctx)
+    assert np.allclose(analyzer.row_std(100, 200), np.std(ctx.gray[100:200].astype(np.float64), axis=1))
+
+
+def test_bottom_info_bar_is_found():
+    rgb = photo()
+    rgb[440:] = (40, 40, 40)  # 图库预览底部的深色信息条
+    analyzer = EdgeBandAnalyzer(Image.fromarray(rgb))
+
+    assert analyzer.distinct_bottom_bar() == 440
+    bands = analyzer.candidates()
+    assert bands['bottom'] == 440 and bands['top'] is None
+    assert band_mask((640, 480), bands)[440:].min() == 255
+
+
+def test_clean_photo_has_no_bands():
+    analyzer = EdgeBandAnalyzer(Image.fromarray(photo()))
+    assert analyzer.distinct_bottom_bar() is None
+    assert analyzer.candidates() == {'bottom': None, 'top': None, 'left': None, 'right': None}
@@ -0,0 +1,101 @@
+"""Florence-2 批量提示：视觉编码只做一次，结果与提示词顺序对齐"""
+
+import pytest
+
+from fixpic.florence import run_prompts, task_of
+
+PROMPTS = [
+    '<CAPTION_TO_PHRASE_GROUNDING>watermark',
+    '<CAPTION_TO_PHRASE_GROUNDING>logo',
+    '<OD>',
+]
+
+
+class FakeImage:
+    size = (64, 48)
+
+
+class FakeProcessor:
+    """按提示词编号生成 token，解码结果即编号"""
+
+    def __call__(self, text, images, return_tensors, padding=False):
+        import torch
+
+        prompts = [text] if isinstance(text, str) else text
+        ids = torch.tensor([[PROMPTS.index(p) + 1] * 3 for p in prompts])
+        return {
+            'input_ids': ids,
+            'attention_mask': torch.ones_like(ids),
+            'pixel_values': torch.zeros(len(prompts), 3, 4, 4),
+        }
+
+    def batch_decode(self, ids, skip_special_tokens=False):
+        return [str(int(ids[0, 0]))]
+
+    def post_process_generation(self, text, task, image_size):
+        return {task: text, 'size': image_size}
+
+
+def expected_results():
+    return [{task_of(p): str(i + 1), 'size': (64, 48)} for i, p in enumerate(PROMPTS)]
+
+
+def test_task_of():
+    assert task_of(PROMPTS[0]) == '<CAPTION_TO_PHRASE_GROUNDING>'
+    assert task_of('<OD>') == '<OD>'
+
+
+def test_batched_prompts_encode_image_once():
+    torch = pytest.importorskip('torch')
+
+    class LanguageModel:
+        def __init__(self):
+            self.calls = []
+
+        def generate(self, input_ids, inputs_embeds, attention_mask, **kwargs):
+            self.calls.append((tuple(inputs_embeds.shape), tuple(attention_mask.shape)))
+            # 输出第一个文本 token 的嵌入值（= 提示词编号）
+            return inputs_embeds[:, 2:3, 0].round().long()
+
+    class Model(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.embed = torch.nn.Embedding(8, 4)
+            with torch.no_grad():
+                self.embed.weight.copy_(torch.arange(8, dtype=torch.float32)[:, None].expand(8, 4))
+            self.language_model = LanguageModel()
+            self.encoded = 0
+
+        def _encode_image(self, pixel_values):
+            self.encoded += 1
+            return torch.zeros(pixel_values.shape[0], 2, 4)
+
+        def get_input_embeddings(self):
+            return self.embed
+
+    model = Model()
+    results = run_prompts(FakeProcessor(), model, FakeImage(), PROMPTS, 'cpu')
+
+    assert model.encoded == 1
+    assert model.language_model.calls == [((3, 5, 4), (3, 5))]
+    assert results == expected_results()
+
+
+def test_models_without_split_encoder_run_sequentially():
+    torch = pytest.importorskip('torch')
+
+    class Model(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.weight = torch.nn.Parameter(torch.zeros(1))
+            self.generated = 0
+
+        def generate(self, input_ids, attention_mask, pixel_values, **kwargs):
+            self.generated += 1
+            return input_ids
+
+    model = Model()
+    results = run_prompts(FakeProcessor(), model, FakeImage(), PROMPTS, 'cpu')
+
+    assert model.generated == len(PROMPTS)
+    assert results == expected_results()
@@ -0,0 +1,45 @@
+"""单次请求共享的图像上下文：各检测器共用同一份转换结果"""
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from fixpic.diagonal import detect_diagonal_text
+from fixpic.edge_bands import EdgeBandAnalyzer
+from fixpic.image_context import ImageContext
+from fixpic.patterns import grid_anomaly_mask, repeated_contour_mask
+
+
+def sample_image(size=(640, 480), seed=0):
+    rng = np.random.default_rng(seed)
+    return Image.fromarray(rng.integers(0, 256, (size[1], size[0], 3), dtype=np.uint8))
+
+
+def test_of_reuses_existing_context():
+    ctx = ImageContext.of(sample_image())
+    assert ImageContext.of(ctx) is ctx
+    assert ctx.downscaled(4096) is ctx  # 不放大
+
+
+def test_conversions_match_opencv():
+    image = sample_image()
+    ctx = ImageContext.of(image)
+    rgb = np.asarray(image)
+
+    assert np.array_equal(ctx.rgb, rgb)
+    assert np.array_equal(ctx.gray, cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY))
+    assert np.array_equal(ctx.saturation, cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV)[:, :, 1])
+    total, _ = ctx.integral('gray')
+    assert total[-1, -1] == ctx.gray.sum()
+
+
+def test_detectors_share_each_conversion_once():
+    ctx = ImageContext.of(sample_image())
+    EdgeBandAnalyzer(ctx).candidates()
+    repeated_contour_mask(ctx)
+    grid_anomaly_mask(ctx)
+    detect_diagonal_text(ctx, work_side=320)
+    EdgeBandAnalyzer(ctx).candidates()
+
+    assert len(ctx.computed) == len(set(ctx.computed))
+    assert {'rgb', 'gray', 'integral:gray', 'edges:30:100', 'downscaled:320'} <= set(ctx.computed)
@@ -0,0 +1,101 @@
+"""异步任务：TTL 过期、webhook 地址检查与签名"""
+
+import hashlib
+import hmac
+import os
+import socket
+import time
+
+import pytest
+
+from fixpic.jobs import DirectoryBackend, JobStore, run_job, sign_webhook, validate_webhook_url
+
+
+def resolving_to(monkeypatch, *addresses):
+    def getaddrinfo(host, port, *args, **kwargs):
+        return [(socket.AF_INET6 if ':' in a else socket.AF_INET, socket.SOCK_STREAM, 6, '', (a, port)) for a in addresses]
+    monkeypatch.setattr(socket, 'getaddrinfo', getaddrinfo)
+
+
+@pytest.mark.parametrize('url', [
+    'https://127.0.0.1/hook',
+    'https://10.0.0.5/hook',
+    'https://169.254.169.254/latest/meta-data',
+    'https://[::1]/hook',
+    'https://[::ffff:192.168.1.1]/hook',
+    'http://93.184.216.34/hook',
+    'ftp://93.184.216.34/hook',
+    'https:///hook',
+])
+def test_rejects_unsafe_urls(url):
+    with pytest.raises(ValueError):
+        validate_webhook_url(url, allowed_hosts=set())
+
+
+def test_checks_every_resolved_address(monkeypatch):
+    resolving_to(monkeypatch, '93.184.216.34')
+    assert validate_webhook_url('https://hooks.example.com/x', allowed_hosts=set())
+
+    resolving_to(monkeypatch, '93.184.216.34', '192.168.0.10')
+    with pytest.raises(ValueError, match='non-public'):
+        validate_webhook_url('https://hooks.example.com/x', allowed_hosts=set())
+
+
+def test_allowlist(monkeypatch):
+    resolving_to(monkeypatch, '93.184.216.34')
+    allowed = {'hooks.example.com'}
+    assert validate_webhook_url('https://HOOKS.example.com/x', allowed_hosts=allowed)
+    with pytest.raises(ValueError, match='not allowed'):
+        validate_webhook_url('https://other.example.com/x', allowed_hosts=allowed)
+
+
+def test_signature():
+    body = b'{"id": "abc"}'
+    expected = hmac.new(b'secret', b'1700000000.' + body, hashlib.sha256).hexdigest()
+    assert sign_webhook(body, '1700000000', 'secret') == 'sha256=' + expected
+    assert sign_webhook(body, '1700000000', '') is None
+
+
+def test_jobs_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    store = JobStore(ttl=60)
+    job = store.create('remove_bg')
+
+    now[0] += 30
+    store.update(job['id'], status='processing')  # 更新会续期
+    now[0] += 45
+    assert store.get(job['id'])['status'] == 'processing'
+
+    stale = store.create('compress')
+    now[0] += 61
+    assert store.purge() == 2
+    assert store.get(job['id']) is None and store.get(stale['id']) is None
+
+
+def test_directory_backend_expiry(tmp_path):
+    store = JobStore(DirectoryBackend(str(tmp_path)), ttl=60)
+    old, fresh = store.create('a'), store.create('b')
+    past = time.time() - 120
+    os.utime(tmp_path / f"{old['id']}.json", (past, past))
+
+    assert store.purge() == 1
+    assert store.get(old['id']) is None
+    assert store.get(fresh['id'])['kind'] == 'b'
+    assert store.get('../etc/passwd') is None
+
+
+@pytest.mark.parametrize('result, status, error', [
+    (({'error': 'bad color'}, 400), 'failed', 'bad color'),
+    (({}, 500), 'failed', 'HTTP 500'),
+    (({'success': True, 'image': 'x'}, 200), 'success', None),
+    ({'success': False, 'error': 'no mask'}, 'failed', 'no mask'),
+])
+def test_run_job_status_follows_handler_result(result, status, error):
+    store = JobStore()
+    job = store.create('change_bg')
+
+    done = run_job(store, job['id'], lambda: result)
+
+    assert done['status'] == status
+    assert done.get('error') == error
@@ -0,0 +1,36 @@
+"""延迟导入：并发导入时不返回未初始化完的模块，耗时只记录真正的首次导入"""
+
+import sys
+import textwrap
+import threading
+
+from fixpic import lazy_imports
+
+
+def test_concurrent_import_waits_for_initialisation(tmp_path, monkeypatch):
+    (tmp_path / 'slow_module_for_test.py').write_text(textwrap.dedent('''
+        import time
+        time.sleep(0.3)
+        READY = True
+    '''))
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.delitem(sys.modules, 'slow_module_for_test', raising=False)
+
+    results = []
+
+    def worker():
+        results.append(getattr(lazy_imports.lazy_import('slow_module_for_test'), 'READY', False))
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == [True] * 4
+    assert lazy_imports.import_times()['slow_module_for_test'] >= 0.3
+
+
+def test_already_loaded_modules_are_not_timed():
+    lazy_imports.lazy_import('json')
+    assert 'json' not in lazy_imports.import_times()
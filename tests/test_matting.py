@@ -0,0 +1,51 @@
+"""限制分辨率的抠图：模型只看到缩小图，alpha 按原图边缘上采样"""
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from fixpic.matting import remove_background_capped
+
+
+def disk_image(size=(2000, 1500)):
+    w, h = size
+    yy, xx = np.mgrid[:h, :w]
+    inside = (xx - w / 2) ** 2 + (yy - h / 2) ** 2 < (h / 3) ** 2
+    rgb = np.full((h, w, 3), 235, np.uint8)
+    rgb[inside] = (40, 90, 160)
+    return Image.fromarray(rgb), inside
+
+
+def fake_matting(calls):
+    def remove(image):
+        calls.append(image.size)
+        gray = np.asarray(image.convert('L'))
+        rgba = image.convert('RGBA')
+        rgba.putalpha(Image.fromarray(np.where(gray < 180, 255, 0).astype(np.uint8)))
+        return rgba
+    return remove
+
+
+def test_matting_runs_at_working_resolution():
+    image, inside = disk_image()
+    calls = []
+
+    output = remove_background_capped(image, fake_matting(calls), max_side=512)
+
+    assert calls == [(512, 384)]
+    assert output.size == image.size and output.mode == 'RGBA'
+    alpha = np.asarray(output)[:, :, 3]
+    assert alpha[750, 1000] == 255 and alpha[10, 10] == 0
+
+    # 引导滤波上采样的边缘比直接插值更贴近原图
+    small = np.asarray(fake_matting([])(image.resize((512, 384))))[:, :, 3]
+    bilinear = cv2.resize(small, image.size, interpolation=cv2.INTER_LINEAR)
+    truth = inside.astype(np.float32) * 255
+    assert np.abs(alpha - truth).mean() < np.abs(bilinear - truth).mean()
+
+
+def test_small_image_uses_model_directly():
+    image, _ = disk_image((400, 300))
+    calls = []
+    remove_background_capped(image, fake_matting(calls), max_side=512)
+    assert calls == [(400, 300)]
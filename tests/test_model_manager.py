@@ -0,0 +1,125 @@
+"""模型驻留：按 LRU 淘汰，use() 期间固定不被淘汰，并发请求只加载一次"""
+
+import threading
+import time
+
+from fixpic.model_manager import ModelManager, PredictorPool
+
+
+def make_manager(budget_mb=100):
+    manager = ModelManager('cpu', cpu_budget_mb=budget_mb)
+    loads = []
+    for name in ('a', 'b', 'c'):
+        manager.register(name, lambda name=name: loads.append(name) or name, estimate_mb=40)
+    return manager, loads
+
+
+def test_evicts_least_recently_used():
+    manager, loads = make_manager()
+    manager.get('a')
+    manager.get('b')
+    manager.get('a')  # b 成为最久未用
+    manager.get('c')
+
+    assert manager.loaded('a') and manager.loaded('c')
+    assert not manager.loaded('b')
+    assert manager.stats()['models']['b']['evictions'] == 1
+
+    manager.get('b')
+    assert loads == ['a', 'b', 'c', 'b']
+
+
+def test_models_in_use_are_not_evicted():
+    manager, _ = make_manager()
+    with manager.use('a'):
+        manager.get('b')
+        manager.get('c')  # a 在使用中，只能淘汰 b
+        assert manager.loaded('a')
+        assert not manager.loaded('b')
+
+        manager.evict('a')
+        assert manager.loaded('a')
+
+    manager.evict('a')
+    assert not manager.loaded('a')
+
+
+def test_failed_load_is_not_cached():
+    manager = ModelManager('cpu', cpu_budget_mb=0)
+    attempts = []
+    manager.register('flaky', lambda: attempts.append(1) or (None if len(attempts) == 1 else 'model'))
+
+    with manager.use('flaky') as model:
+        assert model is None
+    assert manager.get('flaky') == 'model'
+    assert manager.stats()['models']['flaky']['in_use'] == 0
+
+
+def run_threads(target, count=8):
+    threads = [threading.Thread(target=target) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_use_loads_once():
+    manager = ModelManager('cpu', cpu_budget_mb=0)
+    loads = []
+
+    def slow_loader():
+        loads.append(1)
+        time.sleep(0.1)
+        return 'model'
+
+    manager.register('slow', slow_loader)
+    seen = []
+
+    def worker():
+        with manager.use('slow') as model:
+            seen.append(model)
+
+    run_threads(worker)
+    assert loads == [1] and seen == ['model'] * 8
+    assert manager.stats()['models']['slow']['in_use'] == 0
+
+
+def test_exclusive_model_is_used_by_one_thread_at_a_time():
+    manager = ModelManager('cpu', cpu_budget_mb=0)
+    manager.register('sam', lambda: 'model', exclusive=True)
+    active, peak = [0], [0]
+    lock = threading.Lock()
+
+    def worker():
+        with manager.use('sam'):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.01)
+            with lock:
+                active[0] -= 1
+
+    run_threads(worker)
+    assert peak[0] == 1
+
+
+def test_predictor_pool_lends_each_predictor_to_one_request():
+    class Predictor:
+        def __init__(self, model):
+            self.model = model
+            self.busy = False
+
+    pool = PredictorPool('weights', Predictor, size=2)
+    assert pool.size == 2 and all(p.model == 'weights' for p in pool.predictors)
+    overlaps = []
+
+    def worker():
+        for _ in range(5):
+            with pool.acquire() as predictor:
+                overlaps.append(predictor.busy)
+                predictor.busy = True
+                time.sleep(0.005)
+                predictor.busy = False
+
+    run_threads(worker, count=6)
+    assert len(overlaps) == 30 and not any(overlaps)
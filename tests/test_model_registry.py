@@ -0,0 +1,114 @@
+"""模型清单：固定校验值 / commit 的应用、校验与 pin 生成"""
+
+import hashlib
+import os
+
+import pytest
+
+from fixpic.model_registry import ARTIFACTS, Artifact, ModelNotPinned, ModelRegistry, write_pins
+
+
+def local_artifact(tmp_path, data=b'weights', **pins):
+    source = tmp_path / 'source.bin'
+    source.write_bytes(data)
+    return Artifact('toy', 'url', source.as_uri(), 'toy.bin', **pins)
+
+
+def test_pins_are_applied():
+    sam = ARTIFACTS['sam_vit_b']
+    assert sam.sha256.startswith('ec2df627')
+    # 官方文件名后缀是 md5 前缀
+    assert sam.md5.startswith('01ec64') and sam.source.endswith('01ec64.pth')
+
+
+def test_sync_checks_pinned_hashes(tmp_path):
+    data = b'weights'
+    good = local_artifact(tmp_path, data, sha256=hashlib.sha256(data).hexdigest(), md5=hashlib.md5(data).hexdigest())
+    registry = ModelRegistry(str(tmp_path / 'models'), {'toy': good})
+    assert registry.sync() == ['toy']
+    assert registry.verify() == {'toy': True}
+
+    bad = local_artifact(tmp_path, data, md5='0' * 32)
+    registry = ModelRegistry(str(tmp_path / 'other'), {'toy': bad})
+    with pytest.raises(ValueError, match='md5'):
+        registry.sync()
+
+
+def test_hf_revision_is_resolved_once_and_pinned(tmp_path, monkeypatch):
+    artifact = Artifact('repo', 'hf_file', 'org/repo', 'repo', filename='model.bin')
+    registry = ModelRegistry(str(tmp_path / 'models'), {'repo': artifact})
+    downloads = []
+
+    def download(artifact, target, revision=None):
+        downloads.append(revision)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(b'weights')
+
+    monkeypatch.setattr(registry, '_download', download)
+    monkeypatch.setattr(registry, '_revision', lambda name, artifact: registry.lock.get(name, {}).get('revision') or 'abc123')
+    registry.sync(allow_unpinned=True)
+    registry.sync(force=True, allow_unpinned=True)
+    assert downloads == ['abc123', 'abc123']
+
+    pins_file = tmp_path / 'model_pins.py'
+    pins_file.write_text('"""说明"""\n\nPINS = {}\n')
+    write_pins(registry.pins(), str(pins_file))
+    namespace = {}
+    exec(pins_file.read_text(), namespace)
+    assert namespace['PINS'] == {'repo': {'revision': 'abc123', 'sha256': hashlib.sha256(b'weights').hexdigest()}}
+    assert namespace['__doc__'] == '说明'
+
+
+def test_unpinned_artifacts_are_refused(tmp_path):
+    registry = ModelRegistry(str(tmp_path / 'models'), {'toy': local_artifact(tmp_path)})
+    assert registry.sync() == []
+    assert not os.path.exists(registry.path('toy'))
+
+    # 显式允许时下载，但固定之前 require 仍然拒绝
+    assert registry.sync(allow_unpinned=True) == ['toy']
+    assert not registry.ready('toy')
+    with pytest.raises(ModelNotPinned, match='no pin'):
+        registry.require('toy')
+
+    registry.artifacts['toy'].sha256 = registry.pins()['toy']['sha256']
+    assert registry.require('toy') == registry.path('toy')
+
+
+def test_lock_that_disagrees_with_pin_is_refused(tmp_path):
+    data = b'weights'
+    artifact = local_artifact(tmp_path, data, md5=hashlib.md5(data).hexdigest())
+    registry = ModelRegistry(str(tmp_path / 'models'), {'toy': artifact})
+    registry.sync()
+    assert registry.require('toy')
+
+    # 更新了 pin 但没有重新同步
+    artifact.sha256 = '0' * 64
+    with pytest.raises(ModelNotPinned, match='sha256'):
+        registry.require('toy')
+    with pytest.raises(ValueError, match='sha256'):
+        registry.sync()
+
+
+def test_sync_backfills_lock_for_pinned_files(tmp_path):
+    data = b'weights'
+    artifact = local_artifact(tmp_path, data)
+    registry = ModelRegistry(str(tmp_path / 'models'), {'toy': artifact})
+    registry.sync(allow_unpinned=True)
+
+    # 早于 md5 记录同步的文件：不重新下载，校验文件后补写锁文件
+    artifact.md5 = hashlib.md5(data).hexdigest()
+    assert not registry.ready('toy')
+    assert registry.sync() == ['toy']
+    assert registry.lock['toy']['md5'] == artifact.md5
+    assert registry.ready('toy')
+
+
+def test_every_shipped_artifact_reports_its_pin_state():
+    # 没有固定值的模型在 status 中标出，不会被当作就绪
+    registry = ModelRegistry('/nonexistent')
+    status = registry.status()
+    assert status['sam_vit_b']['pinned'] and status['u2net']['pinned']
+    for name, entry in status.items():
+        assert entry['pinned'] == ARTIFACTS[name].pinned
+        assert not entry['ready']
@@ -0,0 +1,92 @@
+"""同源批量去水印：用 test_images 合成已知 alpha 的水印图，检查反解误差"""
+
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from fixpic.multi_watermark import remove_batch_watermarks
+
+TEST_IMAGES = Path(__file__).resolve().parent.parent / 'test_images'
+SIZE = (640, 480)
+
+
+def backgrounds(n, seed=0):
+    """从测试图随机裁剪 / 翻转出 n 张内容不同的背景"""
+    rng = np.random.default_rng(seed)
+    sources = [np.asarray(Image.open(p).convert('RGB')) for p in sorted(TEST_IMAGES.glob('*.jpg'))]
+    w, h = SIZE
+    out = []
+    for i in range(n):
+        src = sources[i % len(sources)]
+        scale = rng.uniform(1.0, 1.6) * max(w / src.shape[1], h / src.shape[0])
+        src = cv2.resize(src, (int(src.shape[1] * scale) + 1, int(src.shape[0] * scale) + 1))
+        y = rng.integers(0, src.shape[0] - h + 1)
+        x = rng.integers(0, src.shape[1] - w + 1)
+        crop = src[y:y + h, x:x + w]
+        if rng.random() < 0.5:
+            crop = crop[:, ::-1]
+        out.append(np.ascontiguousarray(crop))
+    return out
+
+
+def watermark_alpha(text='SAMPLE', origin=(210, 255), opacity=0.5):
+    w, h = SIZE
+    mask = np.zeros((h, w), np.uint8)
+    cv2.putText(mask, text, origin, cv2.FONT_HERSHEY_SIMPLEX, 1.6, 255, 4, cv2.LINE_AA)
+    return mask.astype(np.float32) / 255 * opacity
+
+
+def composite(images, alpha, color):
+    a = alpha[:, :, None]
+    return [np.clip(a * color + (1 - a) * b, 0, 255).round().astype(np.uint8) for b in images]
+
+
+def inside_error(image, truth, alpha):
+    inside = alpha > 0.05
+    return float(np.abs(np.asarray(image, dtype=np.float32) - truth)[inside].mean())
+
+
+@pytest.mark.parametrize('color', [255, 0])
+def test_removes_shared_watermark(color):
+    clean = backgrounds(8)
+    alpha = watermark_alpha()
+    marked = composite(clean, alpha, color)
+
+    results = remove_batch_watermarks([Image.fromarray(m) for m in marked])
+
+    far = cv2.dilate((alpha > 0).astype(np.uint8), np.ones((31, 31), np.uint8)) == 0
+    # 背景接近水印颜色的个别图片可能判为无法确认而交给单张流程
+    assert sum(image is not None for image, _ in results) >= 6
+    for (image, info), truth, original in zip(results, clean, marked):
+        if image is None:
+            continue
+        assert info['method'] == 'multi-image'
+        before = inside_error(original, truth, alpha)
+        after = inside_error(image, truth, alpha)
+        assert after < 0.4 * before, (before, after)
+        # 水印以外的像素保持不变
+        assert np.array_equal(np.asarray(image)[far], original[far])
+
+
+def test_clean_batch_falls_back():
+    results = remove_batch_watermarks([Image.fromarray(b) for b in backgrounds(8, seed=1)])
+    assert all(image is None for image, _ in results)
+
+
+def test_excludes_images_without_the_watermark():
+    images = backgrounds(9, seed=2)
+    marked = composite(images[:7], watermark_alpha(), 255) + images[7:]
+
+    results = remove_batch_watermarks([Image.fromarray(m) for m in marked])
+
+    processed = [image is not None for image, _ in results]
+    assert processed[7:] == [False, False]
+    assert sum(processed[:7]) >= 5
+
+
+def test_small_groups_use_single_image_path():
+    marked = composite(backgrounds(2), watermark_alpha(), 255)
+    assert remove_batch_watermarks([Image.fromarray(m) for m in marked]) == [(None, {'method': 'single'})] * 2
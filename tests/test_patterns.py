@@ -0,0 +1,47 @@
+"""重复平铺水印检测：向量化版与原逐轮廓实现结果一致"""
+
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from fixpic.image_context import ImageContext
+from fixpic.patterns import repeated_contour_mask
+
+TEST_IMAGES = sorted((Path(__file__).resolve().parent.parent / 'test_images').glob('*.jpg'))
+
+
+def reference_mask(ctx):
+    """原实现：外轮廓 + contourArea，逐个筛选、逐个画框"""
+    w, h = ctx.size
+    mask = np.zeros((h, w), np.uint8)
+    edges = cv2.dilate(ctx.edges(30, 100), np.ones((3, 3), np.uint8), iterations=1)
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    found = []
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if 50 < area < h * w * 0.05:
+            x, y, bw, bh = cv2.boundingRect(contour)
+            if 0.5 < bw / max(bh, 1) < 15:
+                found.append((area, x, y, bw, bh))
+    if len(found) <= 5:
+        return mask, 0
+    median = sorted(c[0] for c in found)[len(found) // 2]
+    similar = [c for c in found if median * 0.3 < c[0] < median * 3]
+    if len(similar) <= 5:
+        return mask, 0
+    for _, x, y, bw, bh in similar:
+        p = max(5, int(min(bw, bh) * 0.3))
+        mask[max(0, y - p):min(h, y + bh + p), max(0, x - p):min(w, x + bw + p)] = 255
+    return mask, len(similar)
+
+
+@pytest.mark.parametrize('path', TEST_IMAGES, ids=lambda p: p.stem)
+def test_matches_reference(path):
+    ctx = ImageContext.of(Image.open(path).convert('RGB'))
+    mask, count = repeated_contour_mask(ctx)
+    expected, expected_count = reference_mask(ctx)
+    assert count == expected_count
+    assert np.array_equal(mask, expected)
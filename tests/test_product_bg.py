@@ -0,0 +1,38 @@
+"""纯色背景商品图：快速抠图与回退"""
+
+import numpy as np
+from PIL import Image
+
+from fixpic.product_bg import try_remove_uniform_background
+
+
+def studio_shot(size=(240, 180), background=(246, 246, 246)):
+    w, h = size
+    rgb = np.empty((h, w, 3), np.uint8)
+    rgb[:] = background
+    rgb[50:130, 70:170] = (30, 90, 180)  # 商品
+    return rgb
+
+
+def test_white_studio_background_is_keyed():
+    output = try_remove_uniform_background(Image.fromarray(studio_shot()), min_confidence=0.9)
+
+    assert output is not None and output.mode == 'RGBA'
+    alpha = np.asarray(output)[:, :, 3]
+    assert alpha[55:125, 75:165].min() == 255
+    background = np.ones(alpha.shape, bool)
+    background[45:135, 65:175] = False
+    assert alpha[background].max() == 0
+
+
+def test_busy_background_falls_back_to_model():
+    rng = np.random.default_rng(0)
+    rgb = studio_shot()
+    rgb[:] = rng.integers(0, 256, rgb.shape, dtype=np.uint8)
+    assert try_remove_uniform_background(Image.fromarray(rgb), min_confidence=0.9) is None
+
+
+def test_coloured_background_falls_back_to_model():
+    # 彩色背景不在快速路径范围内（可能与商品同色），交给模型
+    rgb = studio_shot(background=(40, 200, 60))
+    assert try_remove_uniform_background(Image.fromarray(rgb), min_confidence=0.9) is None
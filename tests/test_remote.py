@@ -0,0 +1,49 @@
+"""远程调用并发：同时进行的调用数受限，单个失败不影响其余结果"""
+
+import asyncio
+
+from fixpic.remote import gather_limited
+
+
+def test_concurrency_is_limited_and_results_keep_order():
+    active, peak = 0, 0
+
+    async def call(index, item):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01 * (5 - index))  # 后提交的先完成
+        active -= 1
+        return item * 10
+
+    results = asyncio.run(gather_limited(call, [1, 2, 3, 4, 5], limit=2))
+
+    assert results == [10, 20, 30, 40, 50]
+    assert peak == 2
+
+
+def test_failed_calls_become_none():
+    async def call(index, item):
+        await asyncio.sleep(0)
+        if item == 'bad':
+            raise RuntimeError('remote API error')
+        return item
+
+    results = asyncio.run(gather_limited(call, ['a', 'bad', 'c'], limit=4))
+    assert results == ['a', None, 'c']
+
+
+def test_calls_overlap_instead_of_running_one_by_one():
+    async def call(index, item):
+        await asyncio.sleep(0.2)
+        return index
+
+    async def timed():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        results = await gather_limited(call, range(4), limit=4)
+        return results, loop.time() - start
+
+    results, elapsed = asyncio.run(timed())
+    assert results == [0, 1, 2, 3]
+    assert elapsed < 0.6
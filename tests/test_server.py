@@ -0,0 +1,141 @@
+"""Flask 服务：?async=1 的任务与同步请求执行同一个处理函数"""
+
+import io
+import time
+
+import pytest
+from PIL import Image
+
+pytest.importorskip('flask')
+
+import server  # noqa: E402
+from fixpic.jobs import DirectoryBackend, JobStore  # noqa: E402
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, 'jobs', JobStore(DirectoryBackend(str(tmp_path))))
+    # 不加载 rembg：前景直接用原图
+    monkeypatch.setattr(server, 'remove_background_capped', lambda image, remove: image.convert('RGBA'))
+    return server.app.test_client()
+
+
+def png_bytes(color=(200, 30, 30)):
+    buffer = io.BytesIO()
+    Image.new('RGB', (8, 6), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def wait_for(client, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f'/api/jobs/{job_id}').get_json()
+        if job['status'] not in ('queued', 'processing'):
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+def submit(client, **form):
+    response = client.post('/api/change-bg?async=1', data={'image': (io.BytesIO(png_bytes()), 'a.png'), **form},
+                           content_type='multipart/form-data')
+    assert response.status_code == 202
+    return wait_for(client, response.get_json()['job_id'])
+
+
+def test_async_job_runs_the_same_handler(client):
+    job = submit(client, bg_color='#00ff00')
+
+    assert job['status'] == 'success'
+    assert job['result']['width'] == 8 and job['result']['height'] == 6
+
+
+def test_async_job_fails_when_handler_returns_error_tuple(client):
+    # 处理函数返回 ({'error': ...}, 500) 而不是抛出异常
+    body, status = server.change_background_image(png_bytes(), bg_color='#zz0000')
+    assert status == 500 and 'error' in body
+
+    job = submit(client, bg_color='#zz0000')
+    assert job['status'] == 'failed'
+    assert job['error'] == body['error']
+
+
+def test_missing_image_is_rejected_before_a_job_is_created(client):
+    response = client.post('/api/remove-bg?async=1', data={}, content_type='multipart/form-data')
+    assert response.status_code == 400
+    assert server.jobs.purge() == 0 and not server.jobs._data.keys()
+
+
+def test_sync_request_returns_handler_status(client):
+    response = client.post('/api/change-bg', data={'image': (io.BytesIO(png_bytes()), 'a.png'), 'bg_color': '#zz0000'},
+                           content_type='multipart/form-data')
+    assert response.status_code == 500
+    assert 'error' in response.get_json()
+
+
+def test_health_reports_optional_failures_without_503(client, monkeypatch):
+    from fixpic.warmup import Warmup
+
+    warmup = Warmup(['sam_vit_b', 'segformer_clothes'], optional=['segformer_clothes'])
+    warmup.run({'sam_vit_b': lambda: None, 'segformer_clothes': lambda: 1 / 0})
+    monkeypatch.setattr(server, 'warmup', warmup)
+    response = client.get('/health')
+    assert response.status_code == 200
+    assert response.get_json()['optional_failed'] == ['segformer_clothes']
+
+    warmup = Warmup(['sam_vit_b'])
+    warmup.run({'sam_vit_b': lambda: 1 / 0})
+    monkeypatch.setattr(server, 'warmup', warmup)
+    response = client.get('/health')
+    assert response.status_code == 503
+    assert response.get_json()['failed'] == ['sam_vit_b']
+
+
+def test_configure_worker_threads_limits_each_worker(monkeypatch):
+    import cv2
+    import fixpic.pool
+
+    monkeypatch.setenv('OMP_NUM_THREADS', '')
+    monkeypatch.setenv('MKL_NUM_THREADS', '')
+    monkeypatch.delenv('FIXPIC_POOL_WORKERS', raising=False)
+    monkeypatch.setattr(fixpic.pool, 'POOL_WORKERS', 16)
+    previous = cv2.getNumThreads()
+    try:
+        server.configure_worker_threads(2)
+        assert cv2.getNumThreads() == 2
+    finally:
+        cv2.setNumThreads(previous)
+    assert server.os.environ['OMP_NUM_THREADS'] == '2' and server.os.environ['MKL_NUM_THREADS'] == '2'
+    assert fixpic.pool.POOL_WORKERS == 2
+
+
+def test_serve_warms_up_single_threaded_before_forking(monkeypatch):
+    gunicorn_base = pytest.importorskip('gunicorn.app.base')
+
+    events = []
+
+    class FakeWarmup:
+        def status(self):
+            return {'models': {}}
+
+        def run(self, steps):
+            events.append(('warmup', server.os.environ['OMP_NUM_THREADS']))
+
+        def start(self, steps):
+            events.append(('start',))
+
+    def run(application):
+        assert application.load() is server.app
+        assert application.cfg.workers == 3 and application.cfg.preload_app
+        application.cfg.post_fork(None, None)  # 模拟 fork 出的 worker
+
+    monkeypatch.setattr(server, 'warmup', FakeWarmup())
+    monkeypatch.setattr(server, 'configure_worker_threads', lambda n: events.append(('threads', n)))
+    monkeypatch.setattr(server.os, 'cpu_count', lambda: 12)
+    monkeypatch.setenv('OMP_NUM_THREADS', '1')
+    monkeypatch.setattr(gunicorn_base.BaseApplication, 'run', run)
+
+    server.serve('127.0.0.1', 0, 3)
+
+    # 父进程单线程预热，worker 各 12 // 3 个线程，且不再重复预热
+    assert events == [('threads', 1), ('warmup', '1'), ('threads', 4)]
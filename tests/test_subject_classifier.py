@@ -0,0 +1,60 @@
+"""主体分类：按图片哈希缓存，置信度不足归为 general"""
+
+import math
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from fixpic.subject_classifier import DEFAULT_CATEGORY, SubjectClassifier, image_key
+
+
+def test_image_key_depends_on_content_and_mode():
+    red = Image.new('RGB', (8, 8), (255, 0, 0))
+    assert image_key(red) == image_key(red.copy())
+    assert image_key(red) != image_key(Image.new('RGB', (8, 8), (0, 255, 0)))
+    assert image_key(red) != image_key(red.convert('RGBA'))
+
+
+def test_transparent_subject_is_flattened_on_white():
+    image = Image.new('RGBA', (4, 4), (0, 0, 0, 0))
+    image.putpixel((0, 0), (200, 10, 10, 255))
+    flat = np.asarray(SubjectClassifier._flatten(image))
+    assert flat.shape == (4, 4, 3)
+    assert flat[0, 0].tolist() == [200, 10, 10] and flat[3, 3].tolist() == [255, 255, 255]
+
+
+def test_classify_caches_by_image_and_falls_back_to_general():
+    torch = pytest.importorskip('torch')
+
+    class Processor:
+        def __call__(self, images, return_tensors):
+            mean = np.asarray(images, np.float32).reshape(-1, 3).mean(axis=0) / 255.0
+            return {'pixel_values': torch.tensor([[*mean, 0.0]])}
+
+    class Model:
+        logit_scale = torch.tensor(math.log(100.0))
+
+        def __init__(self):
+            self.calls = 0
+
+        def get_image_features(self, pixel_values):
+            self.calls += 1
+            return pixel_values + 1e-6
+
+    classifier = SubjectClassifier()
+    classifier.processor = Processor()
+    classifier.model = Model()
+    # product / person / food / general 各对应一个通道
+    classifier._text_embeds = torch.eye(4)
+
+    red = Image.new('RGB', (16, 16), (255, 0, 0))
+    category, scores = classifier.classify(red)
+    assert category == 'product' and scores['product'] > 0.9
+    assert classifier.classify(red.copy()) == (category, scores)
+    assert classifier.model.calls == 1
+
+    # 前三个类别分数相同，最高分低于 MIN_CONFIDENCE
+    gray = Image.new('RGB', (16, 16), (128, 128, 128))
+    assert classifier.classify(gray)[0] == DEFAULT_CATEGORY
+    assert classifier.model.calls == 2
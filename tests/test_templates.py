@@ -0,0 +1,145 @@
+"""水印模板：发布的模板在留出集上验证阈值，透明通道保留
+
+截取模板用的预览图（manifest 中 origin 记录）不参与验证。正例为同图库的其他预览图，
+以及用不同字重（DejaVu Sans 常规体，模板为粗体）叠加字标的合成预览图；反例为无水印的图片。
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw, ImageFont
+
+from fixpic.image_context import ImageContext
+from fixpic.templates import (ASSET_DIR, LAYOUT_PROFILES, MATCH_THRESHOLD, WORK_SIDE, TemplateLibrary,
+                              add_template, highpass, seed_templates)
+
+TEST_IMAGES = Path(__file__).resolve().parent.parent / 'test_images'
+HELD_OUT_FONT = Path('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+CLEAN = ['pexels_stock.jpg', 'adobe_stock_watermark.jpg', 'freepik_sample.jpg']
+
+
+def assets():
+    with open(Path(ASSET_DIR) / 'manifest.json') as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope='module')
+def library(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('templates')
+    assert len(seed_templates(str(directory))) == len(assets())
+    # 重复执行不会重复登记
+    assert seed_templates(str(directory)) == []
+    return TemplateLibrary.load(str(directory))
+
+
+def gradient(width=800, height=600):
+    x = np.linspace(0, 1, width)[None, :]
+    y = np.linspace(0, 1, height)[:, None]
+    rgb = np.stack([x * 200 + 30 + 0 * y, y * 180 + 40 + 0 * x, (x + y) * 90 + 20], axis=2)
+    return Image.fromarray(rgb.astype(np.uint8))
+
+
+def clean_image(name):
+    return gradient() if name == 'gradient' else Image.open(TEST_IMAGES / name).convert('RGB')
+
+
+def blend(image, layer, opacity):
+    alpha = np.asarray(layer, np.float32)[..., None] / 255 * opacity
+    return Image.fromarray((np.asarray(image, np.float32) * (1 - alpha) + 255 * alpha).astype(np.uint8))
+
+
+def text_size(text, width):
+    """字宽为 width 像素时的字号"""
+    font = ImageFont.truetype(str(HELD_OUT_FONT), 100)
+    return max(6, int(100 * width / font.getbbox(text)[2]))
+
+
+def adobe_comp(image, opacity, scale=1.0):
+    """左侧竖排 'Adobe Stock'，字长约为长边的 1/4"""
+    w, h = image.size
+    font = ImageFont.truetype(str(HELD_OUT_FONT), text_size('Adobe Stock', 0.25 * scale * max(w, h)))
+    x0, y0, x1, y1 = font.getbbox('Adobe Stock')
+    mark = Image.new('L', (x1 - x0, y1 - y0), 0)
+    ImageDraw.Draw(mark).text((-x0, -y0), 'Adobe Stock', fill=255, font=font)
+    mark = mark.rotate(90, expand=True)
+    layer = Image.new('L', image.size, 0)
+    layer.paste(mark, (int(0.02 * w), (h - mark.height) // 2))
+    return blend(image, layer, opacity)
+
+
+def freepik_comp(image, opacity, scale=1.0):
+    """错行平铺的 'freepik'，字长约为长边的 12%"""
+    w, h = image.size
+    font = ImageFont.truetype(str(HELD_OUT_FONT), text_size('freepik', 0.12 * scale * max(w, h)))
+    x0, y0, x1, y1 = font.getbbox('freepik')
+    layer = Image.new('L', image.size, 0)
+    draw = ImageDraw.Draw(layer)
+    for row, y in enumerate(range(0, h, 3 * y1)):
+        for x in range(-(row % 2) * x1 // 2, w, int(1.6 * x1)):
+            draw.text((x, y), 'freepik', fill=255, font=font)
+    return blend(image, layer, opacity)
+
+
+def test_held_out_images_are_not_curation_images():
+    origins = ' '.join(entry['origin'] for entry in assets())
+    for name in CLEAN + ['dreamstime_sample.jpg']:
+        assert name not in origins
+    assert {entry['source'] for entry in assets()} == set(LAYOUT_PROFILES)
+
+
+def test_template_matches_held_out_sample(library):
+    # 模板从 dreamstime_preview（横图）截取，在 dreamstime_sample（竖图）上匹配
+    image = Image.open(TEST_IMAGES / 'dreamstime_sample.jpg').convert('RGB')
+    mask, info = library.match(image)
+
+    assert info['matched'] and info['source'] == 'dreamstime'
+    assert info['anchor_score'] >= MATCH_THRESHOLD
+    assert mask[-20:, :].all()  # 底部横条
+    assert not mask[:image.height // 2].any()
+
+
+@pytest.mark.skipif(not HELD_OUT_FONT.exists(), reason="DejaVu Sans not installed")
+@pytest.mark.parametrize('source, comp, min_recall', [('adobe', adobe_comp, 0.5), ('freepik', freepik_comp, 0.8)])
+def test_wordmark_recall_on_held_out_comps(library, source, comp, min_recall):
+    # 字标大小 ±15%、不透明度 0.3 / 0.5；360px 的小图低于模板分辨率，不参与
+    results = []
+    for name in ['pexels_stock.jpg', 'adobe_stock_watermark.jpg', 'gradient']:
+        for scale in (0.85, 1.0, 1.15):
+            for opacity in (0.3, 0.5):
+                _, info = library.match(comp(clean_image(name), opacity, scale))
+                results.append(info.get('source'))
+    # 不会认成别的图库
+    assert set(results) <= {source, None}
+    assert results.count(source) / len(results) >= min_recall
+
+
+@pytest.mark.parametrize('name', CLEAN + ['gradient'])
+def test_no_match_on_clean_image(library, name):
+    mask, info = library.match(clean_image(name))
+    assert mask is None and not info['matched']
+
+
+def test_thresholds_clear_clean_images(library):
+    # 每个模板在无水印图片上的最高分都低于它的阈值
+    for name in CLEAN + ['gradient']:
+        work = highpass(ImageContext.of(clean_image(name)).downscaled(WORK_SIDE).gray)
+        for source, templates in library.by_source.items():
+            for t in templates:
+                region = LAYOUT_PROFILES[source]['anchor_region'] if t.role == 'anchor' else (0.0, 0.0, 1.0, 1.0)
+                hits = library._match(work, t, region, 1, threshold=-1)
+                assert not hits or hits[0][0] < t.threshold, (name, t.name, hits[0][0])
+
+
+def test_add_template_keeps_alpha(tmp_path):
+    image = np.zeros((40, 60, 4), np.uint8)
+    image[10:30, 10:50] = (255, 255, 255, 128)
+    Image.fromarray(image, 'RGBA').save(tmp_path / 'logo.png')
+
+    name = add_template(str(tmp_path), 'demo', 'tile', str(tmp_path / 'logo.png'), (0, 0, 60, 40))
+
+    saved = Image.open(tmp_path / name)
+    assert saved.mode == 'LA'
+    assert np.array(saved.getchannel('A'))[20, 30] == 128
+    assert np.array(saved.getchannel('A'))[0, 0] == 0
@@ -0,0 +1,44 @@
+"""预热状态：必需模型全部成功才就绪，只有可选模型失败为 degraded（仍然就绪）"""
+
+from fixpic.warmup import Warmup
+
+
+def fail():
+    raise RuntimeError('no weights')
+
+
+def test_pending_models_are_warming():
+    warmup = Warmup(['a'])
+    assert warmup.state == 'warming' and not warmup.ready
+
+
+def test_all_models_ready():
+    warmup = Warmup(['a', 'b'])
+    warmup.run({'a': lambda: None, 'b': lambda: None})
+    assert warmup.ready
+    assert warmup.status()['state'] == 'ok'
+
+
+def test_failed_required_model_is_not_ready():
+    warmup = Warmup(['a', 'b'])
+    warmup.run({'a': lambda: None, 'b': fail})
+    status = warmup.status()
+    assert not warmup.ready
+    assert status['state'] == 'failed'
+    assert status['failed'] == ['b'] and status['optional_failed'] == []
+    assert status['models']['b']['error'] == 'no weights'
+
+
+def test_failed_optional_model_is_degraded_but_ready():
+    warmup = Warmup(['sam', 'yolo', 'blind'], optional=['yolo', 'blind'])
+    warmup.run({'sam': lambda: None, 'yolo': fail, 'blind': lambda: None})
+    status = warmup.status()
+    assert warmup.ready
+    assert status['state'] == 'degraded'
+    assert status['failed'] == [] and status['optional_failed'] == ['yolo']
+    assert status['models']['yolo']['optional'] and not status['models']['sam']['optional']
+
+    # 可选模型失败的同时必需模型也失败时不可用
+    warmup = Warmup(['sam', 'yolo'], optional=['yolo'])
+    warmup.run({'sam': fail, 'yolo': fail})
+    assert warmup.state == 'failed' and not warmup.ready
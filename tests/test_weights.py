@@ -0,0 +1,77 @@
+"""权重零拷贝加载：参数在 meta 上构建，非持久 buffer 保留构建时的值，键不匹配时报错"""
+
+import threading
+
+import pytest
+
+torch = pytest.importorskip('torch')
+pytest.importorskip('safetensors')
+
+from safetensors.torch import save_file  # noqa: E402
+
+from fixpic.weights import load_module, non_persistent_buffers, parameters_on_meta  # noqa: E402
+
+
+class Normalized(torch.nn.Module):
+    """与 SAM 一样用非持久 buffer 保存归一化常数"""
+
+    def __init__(self):
+        super().__init__()
+        self.register_buffer('pixel_mean', torch.tensor([123.675, 116.28, 103.53]), False)
+        self.register_buffer('scale', torch.ones(4))
+        self.head = torch.nn.Linear(4, 2)
+
+    def forward(self, x):
+        return self.head(x * self.scale)
+
+
+def saved(tmp_path, state):
+    path = str(tmp_path / 'weights.safetensors')
+    save_file({k: v.contiguous() for k, v in state.items()}, path)
+    return path
+
+
+def test_non_persistent_buffers_keep_their_values(tmp_path):
+    reference = Normalized()
+    reference.scale.fill_(2.0)
+    path = saved(tmp_path, reference.state_dict())
+
+    model = load_module(Normalized, path)
+
+    assert non_persistent_buffers(model) == {'pixel_mean'}
+    assert not any(t.is_meta for t in list(model.parameters()) + list(model.buffers()))
+    assert torch.equal(model.pixel_mean, reference.pixel_mean)
+    assert torch.equal(model.scale, reference.scale)
+    assert torch.equal(model.head.weight, reference.head.weight)
+    assert not model.training
+
+
+@pytest.mark.parametrize('change', ['missing', 'unexpected'])
+def test_mismatched_keys_raise(tmp_path, change):
+    state = dict(Normalized().state_dict())
+    if change == 'missing':
+        del state['head.bias']
+        key = 'head.bias'
+    else:
+        state['extra.weight'] = torch.zeros(1)
+        key = 'extra.weight'
+
+    with pytest.raises(RuntimeError, match=key):
+        load_module(Normalized, saved(tmp_path, state))
+
+
+def test_meta_parameters_only_in_the_loading_thread():
+    built = {}
+
+    def other():
+        built['other'] = torch.nn.Linear(2, 2)
+
+    with parameters_on_meta():
+        thread = threading.Thread(target=other)
+        thread.start()
+        thread.join()
+        built['here'] = torch.nn.Linear(2, 2)
+
+    assert built['here'].weight.is_meta
+    assert not built['other'].weight.is_meta
+    assert not torch.nn.Linear(2, 2).weight.is_meta